@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Analytics Cache Module
+Bounded, thread-safe LRU cache with TTL expiry and single-flight computation
+"""
+
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Callable, Dict, Hashable, Optional
+import threading
+import time
+
+
+class _Flight:
+    """
+    A computation in progress for one key, shared by all concurrent callers
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+        self.stale = False  # set when the key is invalidated while computing, later callers start a new flight
+
+
+class AnalyticsCache:
+    """
+    LRU + TTL cache safe to share between Flask request threads
+
+    Entries expire ttl after being stored and the least recently used entry is
+    evicted once max_size is reached. get_or_compute runs at most one computation
+    per key at a time: concurrent misses wait for it and share its result.
+    """
+
+    def __init__(self, max_size: int = 256, ttl: timedelta = timedelta(minutes=5)):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.max_size = max_size
+        self.ttl = ttl
+        self._ttl_seconds = ttl.total_seconds()
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._inflight: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Return the cached value for key, or default if missing or expired
+        """
+        with self._lock:
+            found, value = self._lookup(key)
+        return value if found else default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Store a value, evicting expired and then least recently used entries if full
+        """
+        with self._lock:
+            self._store(key, value)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Return the cached value for key, computing and storing it on a miss
+        Exceptions raised by compute propagate to every waiting caller and nothing is cached.
+        """
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                return value
+
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if flight.error is None and not flight.stale:
+                    self._store(key, flight.value)
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+            flight.done.set()
+
+        return flight.value
+
+    def invalidate(self, key: Hashable) -> bool:
+        """
+        Drop one key; a computation already running for it will not be stored
+        and callers arriving after the invalidation do not wait for it
+        Returns True if a cached entry was removed
+        """
+        with self._lock:
+            flight = self._inflight.pop(key, None)
+            if flight:
+                flight.stale = True
+            return self._entries.pop(key, None) is not None
+
+    def clear(self) -> None:
+        """
+        Drop every entry and discard the results of running computations
+        """
+        with self._lock:
+            self._entries.clear()
+            for flight in self._inflight.values():
+                flight.stale = True
+            self._inflight.clear()
+
+    def cleanup_expired(self) -> int:
+        """
+        Remove expired entries, returns how many were removed
+        """
+        with self._lock:
+            return self._purge_expired()
+
+    def stats(self) -> Dict:
+        """
+        Size, configuration and hit/miss/eviction counters
+        """
+        with self._lock:
+            now = time.monotonic()
+            valid = sum(1 for _, stored_at in self._entries.values() if not self._is_expired(stored_at, now))
+            lookups = self.hits + self.misses
+            return {
+                'total_entries': len(self._entries),
+                'valid_entries': valid,
+                'expired_entries': len(self._entries) - valid,
+                'max_entries': self.max_size,
+                'cache_ttl_minutes': self._ttl_seconds / 60,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._inflight)
+            }
+
+    def __contains__(self, key: Hashable) -> bool:
+        """
+        True if key has a valid entry (does not count as a hit or miss)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and not self._is_expired(entry[1], time.monotonic())
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _lookup(self, key: Hashable) -> tuple:
+        """
+        Look up a key under the lock, updating LRU order and counters
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            if not self._is_expired(entry[1], time.monotonic()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[0]
+            del self._entries[key]
+            self.expirations += 1
+        self.misses += 1
+        return False, None
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._purge_expired()
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _purge_expired(self) -> int:
+        now = time.monotonic()
+        expired = [key for key, (_, stored_at) in self._entries.items() if self._is_expired(stored_at, now)]
+        for key in expired:
+            del self._entries[key]
+        self.expirations += len(expired)
+        return len(expired)
+
+    def _is_expired(self, stored_at: float, now: float) -> bool:
+        return now - stored_at >= self._ttl_seconds
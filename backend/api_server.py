@@ -7,16 +7,22 @@ Server Flask leggero che espone solo endpoints REST per la dashboard
 from flask import Flask, jsonify, request, Response
 from flask_cors import CORS
 import argparse
+import atexit
 import os
 import subprocess
 import threading
 import time
-import shutil
 import glob
 import json
+import requests
 from datetime import datetime, timedelta
-from data_processor import SalesAnalyzer
+from cigarette_machine_client import CigaretteMachineClient
+from event_backfill import EventBackfill, DEFAULT_CONCURRENCY as BACKFILL_CONCURRENCY, get_backfill_progress
+from data_processor import (SalesAnalyzer, EventArchiveWriter, date_range_to_ts,
+                            sale_datetime_conditions)
 from motor_analytics import MotorAnalytics
+from refill_forecast import RefillForecaster
+from statistics_query import StatisticsQuery, DEFAULT_LIMIT
 import sys
 
 # Add parent directory to path to import shared
@@ -29,6 +35,7 @@ CORS(app)  # Abilita CORS per dashboard statica
 # Inizializza analyzer
 analyzer = None
 motor_analytics = None
+refill_forecaster = None
 
 # Variabile globale per stato download
 download_status = {
@@ -42,6 +49,18 @@ download_status = {
 # Variabile globale per IP distributore (verrà impostata da args.ip)
 DISTRIBUTORE_IP = None
 
+# Secondi di attesa massima per connessione e dati durante il download eventi
+DOWNLOAD_TIMEOUT = 120
+
+# Client del distributore riutilizzato tra i download: sessione e cookie restano
+# validi e il login viene ripetuto solo quando il distributore lo richiede.
+# Dopo MACHINE_SESSION_IDLE_TIMEOUT secondi senza download la sessione viene
+# chiusa uscendo dalla modalità programmazione.
+MACHINE_SESSION_IDLE_TIMEOUT = 300
+machine_client = None
+machine_client_timer = None
+machine_client_lock = threading.Lock()
+
 # Lista globale per gestire connessioni SSE
 sse_clients = []
 
@@ -52,6 +71,22 @@ distributore_ping_cache = {
     'cache_duration': 10  # 10 secondi (ridotto per maggiore reattività)
 }
 
+def date_range_args():
+    """Legge date_from e date_to dalla query string validandone il formato
+
+    Solleva ValueError se una delle due date non è nel formato YYYY-MM-DD.
+    """
+    dates = []
+    for name in ('date_from', 'date_to'):
+        value = request.args.get(name)
+        if value:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f"{name} deve essere una data nel formato YYYY-MM-DD")
+        dates.append(value)
+    return tuple(dates)
+
 # === CORE API ENDPOINTS ===
 
 @app.route('/api/dashboard')
@@ -92,13 +127,14 @@ def api_motor_detail(motor_id):
             return jsonify({"error": "Motore non trovato"}), 404
 
         # Vendite recenti (ultimi 7 giorni)
+        since = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
         cursor.execute('''
             SELECT sale_datetime, price
             FROM sales
-            WHERE motor_id = ? AND DATE(sale_datetime) >= DATE('now', '-7 days')
+            WHERE motor_id = ? AND sale_datetime >= ?
             ORDER BY sale_datetime DESC
             LIMIT 50
-        ''', (motor_id,))
+        ''', (motor_id, since))
 
         recent_sales = cursor.fetchall()
         conn.close()
@@ -153,6 +189,74 @@ def api_motors_status():
     except Exception as e:
         return jsonify({"error": "InternalServerError", "message": str(e)}), 500
 
+@app.route('/api/motors/analytics/intervals')
+def api_motors_intervals():
+    """API endpoint per distribuzione degli intervalli tra vendite di tutti i motori"""
+    try:
+        if not motor_analytics:
+            return jsonify({"error": "Analytics engine not initialized"}), 500
+
+        return jsonify(motor_analytics.get_fleet_interval_report())
+
+    except Exception as e:
+        return jsonify({"error": "InternalServerError", "message": str(e)}), 500
+
+@app.route('/api/motors/<int:motor_id>/heatmap')
+def api_motor_heatmap(motor_id):
+    """API endpoint per la heatmap ora x giorno della settimana (vendite e incasso) di un motore"""
+    try:
+        if motor_id < 1 or motor_id > 70:
+            return jsonify({"error": "NotFound", "message": f"Motor {motor_id} not found"}), 404
+
+        return jsonify(analyzer.get_sales_heatmap(motor_id))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/motors/intervals/quantiles')
+def api_motors_interval_quantiles():
+    """API endpoint per i quantili degli intervalli tra vendite di ogni motore nel periodo
+
+    Parametri opzionali: date_from, date_to, motor_id
+    """
+    try:
+        date_from, date_to = date_range_args()
+        motor_id = request.args.get('motor_id', type=int)
+
+        return jsonify(analyzer.get_interval_quantiles(date_from, date_to, motor_id))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/motors/stock')
+def api_motors_stock():
+    """API endpoint per scorte dei motori (vendite dall'ultima ricarica, esaurimenti), dai più vicini all'esaurimento"""
+    try:
+        return jsonify({
+            "motors": analyzer.get_motor_stock(),
+            "last_updated": datetime.now().isoformat()
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/motors/refill-forecast')
+def api_motors_refill_forecast():
+    """API endpoint per previsioni di esaurimento e motori da ricaricare alla prossima visita
+
+    Parametro opzionale visit_days: giorni alla prossima visita (default: intervallo tipico tra ricariche)
+    """
+    try:
+        if not refill_forecaster:
+            return jsonify({"error": "Refill forecaster not initialized"}), 500
+
+        visit_days = request.args.get('visit_days', type=float)
+        if visit_days is not None and visit_days < 0:
+            return jsonify({"error": "visit_days deve essere positivo"}), 400
+
+        return jsonify(refill_forecaster.get_forecast(visit_days))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/analytics/refresh', methods=['POST'])
 def api_analytics_refresh():
     """API endpoint per triggerare il refresh dei calcoli analytics"""
@@ -212,11 +316,12 @@ def api_analytics_cache_cleanup():
 def api_statistics_overview():
     """API endpoint per statistiche generali con filtri opzionali"""
     try:
-        date_from = request.args.get('date_from')
-        date_to = request.args.get('date_to')
+        date_from, date_to = date_range_args()
 
         stats = analyzer.get_statistics_overview(date_from, date_to)
         return jsonify(stats)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -224,11 +329,12 @@ def api_statistics_overview():
 def api_statistics_by_brand():
     """API endpoint per statistiche dettagliate per marca"""
     try:
-        date_from = request.args.get('date_from')
-        date_to = request.args.get('date_to')
+        date_from, date_to = date_range_args()
 
         brands_stats = analyzer.get_statistics_by_brand(date_from, date_to)
         return jsonify(brands_stats)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -236,11 +342,70 @@ def api_statistics_by_brand():
 def api_statistics_by_package_type():
     """API endpoint per statistiche dettagliate per tipologia di pacchetto"""
     try:
-        date_from = request.args.get('date_from')
-        date_to = request.args.get('date_to')
+        date_from, date_to = date_range_args()
 
         package_stats = analyzer.get_statistics_by_package_type(date_from, date_to)
         return jsonify(package_stats)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/statistics/quantiles')
+def api_statistics_quantiles():
+    """API endpoint per i quantili (p50/p90/p99) di valore delle transazioni e intervalli tra vendite"""
+    try:
+        date_from, date_to = date_range_args()
+
+        return jsonify({
+            'transactions': analyzer.get_transaction_quantiles(date_from, date_to),
+            'intervals_hours': analyzer.get_interval_quantiles(date_from, date_to)['fleet']
+        })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/statistics/baskets')
+def api_statistics_baskets():
+    """API endpoint per statistiche dei carrelli (dimensioni e prodotti acquistati insieme)"""
+    try:
+        date_from, date_to = date_range_args()
+        limit = request.args.get('limit', 20, type=int)
+        if limit < 1 or limit > 500:
+            return jsonify({"error": "limit deve essere tra 1 e 500"}), 400
+
+        return jsonify(analyzer.get_basket_statistics(date_from, date_to, limit))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/statistics/heatmap')
+def api_statistics_heatmap():
+    """API endpoint per la heatmap ora x giorno della settimana di tutti i motori"""
+    try:
+        return jsonify(analyzer.get_sales_heatmap())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/statistics/query')
+def api_statistics_query():
+    """API endpoint per statistiche libere: dimensioni e metriche separate da virgola
+
+    Parametri: group (es. brand,day), metric (count, revenue, avg_price), from, to (YYYY-MM-DD), limit
+    """
+    try:
+        group = [name.strip() for name in request.args.get('group', '').split(',') if name.strip()]
+        metrics = [name.strip() for name in request.args.get('metric', '').split(',') if name.strip()]
+        date_from = request.args.get('from') or request.args.get('date_from')
+        date_to = request.args.get('to') or request.args.get('date_to')
+        limit = request.args.get('limit', DEFAULT_LIMIT, type=int)
+
+        result = StatisticsQuery(analyzer.db_path).run(group, metrics, date_from, date_to, limit)
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -248,8 +413,7 @@ def api_statistics_by_package_type():
 def api_statistics_transactions():
     """API endpoint per lista transazioni con filtri"""
     try:
-        date_from = request.args.get('date_from')
-        date_to = request.args.get('date_to')
+        date_from, date_to = date_range_args()
         payment_method = request.args.get('payment_method')
         limit = request.args.get('limit', 100, type=int)
 
@@ -260,12 +424,14 @@ def api_statistics_transactions():
         where_conditions = []
         params = []
 
-        if date_from:
-            where_conditions.append("DATE(start_datetime) >= ?")
-            params.append(date_from)
-        if date_to:
-            where_conditions.append("DATE(start_datetime) <= ?")
-            params.append(date_to)
+        # Range semiaperto sul timestamp normalizzato (usa l'indice su start_ts)
+        start_ts, end_ts = date_range_to_ts(date_from, date_to)
+        if start_ts is not None:
+            where_conditions.append("start_ts >= ?")
+            params.append(start_ts)
+        if end_ts is not None:
+            where_conditions.append("start_ts < ?")
+            params.append(end_ts)
         if payment_method:
             where_conditions.append("payment_method = ?")
             params.append(payment_method)
@@ -276,7 +442,7 @@ def api_statistics_transactions():
             SELECT id, start_datetime, payment_method, total_paid, total_change, net_revenue
             FROM transactions
             {where_clause}
-            ORDER BY start_datetime DESC
+            ORDER BY start_ts DESC
             LIMIT ?
         ''', params + [limit])
 
@@ -294,6 +460,8 @@ def api_statistics_transactions():
         conn.close()
         return jsonify(transactions)
 
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -307,19 +475,21 @@ def api_statistics_daily_summary():
         conn = sqlite3.connect(analyzer.db_path)
         cursor = conn.cursor()
 
-        # Statistiche giornaliere aggregate
-        cursor.execute('''
+        # Statistiche giornaliere dagli aggregati mantenuti all'import
+        conditions, params = sale_datetime_conditions((datetime.now() - timedelta(days=days_back)).strftime('%Y-%m-%d'),
+                                                      column='day')
+        cursor.execute(f'''
             SELECT
-                DATE(sale_datetime) as date,
-                COUNT(*) as sales_count,
-                SUM(price) as revenue,
-                payment_method,
+                day as date,
+                SUM(sales_count) as sales_count,
+                SUM(revenue) as revenue,
+                NULLIF(payment_method, '') as payment_method,
                 COUNT(DISTINCT motor_id) as motors_used
-            FROM sales
-            WHERE DATE(sale_datetime) >= DATE('now', ?)
-            GROUP BY DATE(sale_datetime), payment_method
+            FROM sales_daily_stats
+            WHERE {" AND ".join(conditions)}
+            GROUP BY day, payment_method
             ORDER BY date DESC, payment_method
-        ''', (f'-{days_back} days',))
+        ''', params)
 
         daily_data = {}
         for row in cursor.fetchall():
@@ -431,10 +601,73 @@ def cleanup_old_events():
     except Exception as e:
         print(f"❌ Errore durante cleanup: {e}")
 
-def perform_download():
-    """Funzione per eseguire il download in background"""
+def get_machine_client():
+    """Restituisce il client condiviso per DISTRIBUTORE_IP, creandolo al primo uso o al cambio di indirizzo"""
+    global machine_client, machine_client_timer
+
+    base_url = Config.get_distributor_url(DISTRIBUTORE_IP)
+    previous = None
+    with machine_client_lock:
+        if machine_client_timer is not None:
+            machine_client_timer.cancel()
+            machine_client_timer = None
+        if machine_client is not None and machine_client.base_url != base_url:
+            previous, machine_client = machine_client, None
+        if machine_client is None:
+            machine_client = CigaretteMachineClient(base_url=base_url, timeout=DOWNLOAD_TIMEOUT)
+        client = machine_client
+
+    if previous is not None:
+        previous.exit_programming_mode()
+    return client
+
+def release_machine_client(client=None):
+    """Chiude la sessione condivisa uscendo dalla modalità programmazione
+
+    Con client indicato la chiude solo se è ancora quello condiviso e nessun
+    download è in corso (uso dal timer di inattività).
+    """
+    global machine_client
+
+    with machine_client_lock:
+        if machine_client is None or (client is not None and
+                                      (client is not machine_client or download_status['is_running'])):
+            return
+        released, machine_client = machine_client, None
+
+    released.exit_programming_mode()
+
+def schedule_machine_client_release(client):
+    """Programma la chiusura della sessione dopo MACHINE_SESSION_IDLE_TIMEOUT secondi di inattività"""
+    global machine_client_timer
+
+    with machine_client_lock:
+        if machine_client_timer is not None:
+            machine_client_timer.cancel()
+        machine_client_timer = threading.Timer(MACHINE_SESSION_IDLE_TIMEOUT, release_machine_client, args=(client,))
+        machine_client_timer.daemon = True
+        machine_client_timer.start()
+
+# Alla chiusura del server il distributore non resta in modalità programmazione
+atexit.register(release_machine_client)
+
+def perform_download(full_resync=False):
+    """Funzione per eseguire il download in background
+
+    Scarica dal giorno dell'ultimo evento importato (con margine di sicurezza);
+    con full_resync scarica gli ultimi FULL_RESYNC_DAYS giorni e reimporta
+    anche gli eventi sotto il watermark, deduplicati dal database.
+
+    Gli eventi passano dalla risposta del distributore direttamente all'import,
+    senza processi esterni né file intermedi; una copia compatta viene scritta
+    in past_events da un thread separato. La sessione sul distributore è quella
+    condivisa di get_machine_client.
+    """
     global download_status, DISTRIBUTORE_IP
 
+    client = None
+    archive = None
+    completed = False
     try:
         download_status['is_running'] = True
         download_status['progress'] = 0
@@ -450,15 +683,13 @@ def perform_download():
         # Esegui cleanup dei file vecchi
         cleanup_old_events()
 
-        # Genera nome file con timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_file = f"events_{timestamp}.html"
-
         # Assicurati che la directory past_events esista
         os.makedirs("past_events", exist_ok=True)
 
-        # Comando per scaricare eventi
-        cmd = ["python3", "download_events.py", "--ip", DISTRIBUTORE_IP, output_file, "30"]
+        # Sessione riutilizzata dal download precedente, login solo se necessario
+        client = get_machine_client()
+        if not client.ensure_login():
+            raise RuntimeError(f'Login fallito sul distributore {DISTRIBUTORE_IP}')
 
         if Config.is_simulator_ip(DISTRIBUTORE_IP):
             download_status['message'] = 'Scaricando dal simulatore...'
@@ -473,89 +704,154 @@ def perform_download():
             'progress': 20
         })
 
-        # Esegui il download
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
-        download_status['progress'] = 60
-
-        if result.returncode == 0:
-            # Trova i file JSON degli eventi generati
-            json_file = output_file.replace('.html', '_events_only.json')
-            complete_file = output_file.replace('.html', '_complete.json')
-
-            # Prova prima _complete.json, poi _events_only.json se il primo non esiste
-            if os.path.exists(complete_file):
-                target_file = complete_file
-            elif os.path.exists(json_file):
-                target_file = json_file
-                download_status['message'] = 'Usando file events-only...'
+        # Solo i giorni non ancora importati
+        start_date = analyzer.get_download_start_date(full_resync=full_resync)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        archive = EventArchiveWriter(os.path.join("past_events", f"events_{timestamp}_complete.json"), {
+            'timestamp': datetime.now().isoformat(),
+            'source_url': f"{client.base_url}/events2_query",
+            'days_searched': (datetime.now().date() - start_date).days,
+            'start_date': start_date.isoformat(),
+            'full_resync': full_resync
+        })
+
+        # Download e import procedono insieme, evento per evento
+        stats = analyzer.ingest_events(archive.tee(client.iter_events(start_date=start_date)),
+                                       use_watermark=not full_resync)
+        download_status['progress'] = 80
+        download_status['message'] = 'Archiviando eventi...'
+
+        archived_file = archive.close()
+        archive = None
+        if archived_file is None:
+            print("⚠️  Archivio eventi non salvato")
+
+        # Aggiorna stato sistema (IP distributore)
+        analyzer.update_system_status('distributore_ip', DISTRIBUTORE_IP)
+
+        download_status['progress'] = 100
+        download_status['message'] = (f"Download completato! {stats['new_events']} nuovi eventi"
+                                      + (f", file archiviato: {archived_file}" if archived_file else ''))
+
+        # Invia evento SSE di completamento con successo
+        send_sse_event('download_completed', {
+            'message': 'Download completato con successo!',
+            'progress': 100,
+            'success': True,
+            'last_download': datetime.now().isoformat(),
+            'new_events': stats['new_events']
+        })
+        completed = True
+
+    except requests.Timeout:
+        download_status['error'] = f'Timeout nel download ({DOWNLOAD_TIMEOUT}s)'
+        # Invia evento SSE di timeout
+        send_sse_event('download_error', {
+            'message': 'Timeout nel download',
+            'error': f'Operazione interrotta per timeout ({DOWNLOAD_TIMEOUT}s)',
+            'success': False
+        })
+    except Exception as e:
+        download_status['error'] = str(e)
+        # Invia evento SSE di errore generico
+        send_sse_event('download_error', {
+            'message': 'Errore imprevisto',
+            'error': str(e),
+            'success': False
+        })
+
+    finally:
+        # Un download interrotto non lascia archivi parziali
+        if archive is not None:
+            archive.close(keep=False)
+        download_status['is_running'] = False
+        # La sessione resta aperta per i prossimi download; dopo un errore viene
+        # chiusa subito uscendo dalla modalità programmazione
+        if client is not None:
+            if completed:
+                schedule_machine_client_release(client)
             else:
-                target_file = None
+                release_machine_client()
+
+@app.route('/api/download-events', methods=['POST'])
+def api_download_events():
+    """API endpoint per avviare download manuale eventi
 
-            if target_file:
-                download_status['message'] = 'Processando eventi...'
-                download_status['progress'] = 80
+    Parametro opzionale full_resync (JSON o query string): riscarica gli ultimi
+    FULL_RESYNC_DAYS giorni invece dei soli giorni dall'ultimo evento importato
+    """
+    global download_status
+
+    if download_status['is_running']:
+        return jsonify({"error": "Download già in corso"}), 409
+
+    try:
+        data = request.get_json(silent=True) or {}
+        full_resync = bool(data.get('full_resync',
+                                    request.args.get('full_resync', '').lower() in ('1', 'true', 'yes')))
+
+        # Avvia download in background
+        thread = threading.Thread(target=perform_download, args=(full_resync,))
+        thread.daemon = True
+        thread.start()
 
-                # Sposta il file JSON nella directory past_events
-                archived_file = os.path.join("past_events", os.path.basename(target_file))
-                shutil.move(target_file, archived_file)
+        return jsonify({"success": True, "message": "Download avviato", "full_resync": full_resync})
 
-                # Rimuovi i file non necessari
-                if os.path.exists(output_file):
-                    os.remove(output_file)  # Rimuovi HTML
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-                # Rimuovi il file _events_only.json se abbiamo usato _complete.json
-                if target_file == complete_file and os.path.exists(json_file):
-                    os.remove(json_file)
+def perform_backfill(backfill, start_date, end_date, resume=True):
+    """Esegue in background il backfill a blocchi del periodo indicato"""
+    global download_status
 
-                # Rimuovi il file _complete.json se abbiamo usato _events_only.json
-                elif target_file == json_file and os.path.exists(complete_file):
-                    os.remove(complete_file)
+    completed = False
+    try:
+        download_status['is_running'] = True
+        download_status['progress'] = 0
+        download_status['message'] = f'Backfill eventi dal {start_date} al {end_date}...'
+        download_status['error'] = None
 
-                # Processa gli eventi dal file archiviato
-                analyzer.process_events_file(archived_file)
+        send_sse_event('download_started', {
+            'message': 'Backfill iniziato',
+            'progress': 0
+        })
 
-                # Aggiorna stato sistema (IP distributore)
-                analyzer.update_system_status('distributore_ip', DISTRIBUTORE_IP)
+        client = backfill.client
+        if not client.ensure_login():
+            raise RuntimeError(f'Login fallito sul distributore {DISTRIBUTORE_IP}')
 
-                download_status['progress'] = 100
-                download_status['message'] = f'Download completato! File archiviato: {archived_file}'
+        def on_progress(done, total):
+            download_status['progress'] = int(done * 100 / total)
+            download_status['message'] = f'Backfill: {done}/{total} blocchi importati'
+            send_sse_event('download_progress', {
+                'message': download_status['message'],
+                'progress': download_status['progress']
+            })
 
-                # Invia evento SSE di completamento con successo
-                send_sse_event('download_completed', {
-                    'message': 'Download completato con successo!',
-                    'progress': 100,
-                    'success': True,
-                    'last_download': datetime.now().isoformat()
-                })
+        stats = backfill.run(start_date, end_date, resume=resume, on_progress=on_progress)
 
-            else:
-                download_status['error'] = f'Nessun file JSON trovato per {output_file}'
-                # Invia evento SSE di errore
-                send_sse_event('download_error', {
-                    'message': 'Errore: Nessun file JSON trovato',
-                    'error': download_status['error'],
-                    'success': False
-                })
-        else:
-            download_status['error'] = f'Errore download: {result.stderr}'
-            # Invia evento SSE di errore
+        if stats['failed_shard']:
+            start, end = stats['failed_shard']
+            download_status['error'] = f'Backfill interrotto al blocco {start} - {end}, riavviare per riprendere'
             send_sse_event('download_error', {
-                'message': 'Errore durante il download',
+                'message': 'Backfill interrotto',
                 'error': download_status['error'],
                 'success': False
             })
+        else:
+            completed = True
+            download_status['progress'] = 100
+            download_status['message'] = f"Backfill completato! {stats['new_events']} nuovi eventi"
+            send_sse_event('download_completed', {
+                'message': 'Backfill completato con successo!',
+                'progress': 100,
+                'success': True,
+                'last_download': datetime.now().isoformat(),
+                'new_events': stats['new_events']
+            })
 
-    except subprocess.TimeoutExpired:
-        download_status['error'] = 'Timeout nel download (120s)'
-        # Invia evento SSE di timeout
-        send_sse_event('download_error', {
-            'message': 'Timeout nel download',
-            'error': 'Operazione interrotta per timeout (120s)',
-            'success': False
-        })
     except Exception as e:
         download_status['error'] = str(e)
-        # Invia evento SSE di errore generico
         send_sse_event('download_error', {
             'message': 'Errore imprevisto',
             'error': str(e),
@@ -564,25 +860,57 @@ def perform_download():
 
     finally:
         download_status['is_running'] = False
+        if completed:
+            schedule_machine_client_release(backfill.client)
+        else:
+            release_machine_client()
 
-@app.route('/api/download-events', methods=['POST'])
-def api_download_events():
-    """API endpoint per avviare download manuale eventi"""
+@app.route('/api/backfill', methods=['GET', 'POST'])
+def api_backfill():
+    """API endpoint per il backfill a blocchi di un periodo storico
+
+    GET restituisce l'avanzamento salvato dell'ultimo backfill. POST lo avvia
+    con start_date (obbligatorio), end_date (default oggi), shard (day o week),
+    concurrency e resume (default true): lo stesso periodo riparte dall'ultimo
+    blocco completato.
+    """
     global download_status
 
+    if request.method == 'GET':
+        return jsonify({"progress": get_backfill_progress(analyzer)})
+
     if download_status['is_running']:
         return jsonify({"error": "Download già in corso"}), 409
 
+    data = request.get_json(silent=True) or {}
     try:
-        # Avvia download in background
-        thread = threading.Thread(target=perform_download)
-        thread.daemon = True
-        thread.start()
+        start_date = datetime.strptime(str(data.get('start_date', '')), '%Y-%m-%d').date()
+        end_date = datetime.strptime(str(data['end_date']), '%Y-%m-%d').date() \
+            if data.get('end_date') else datetime.now().date()
+        if start_date > end_date:
+            raise ValueError('start_date successiva a end_date')
+        backfill = EventBackfill(analyzer, None, shard=data.get('shard', 'day'),
+                                 concurrency=int(data.get('concurrency', BACKFILL_CONCURRENCY)))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Parametri backfill non validi: {e}"}), 400
 
-        return jsonify({"success": True, "message": "Download avviato"})
+    # I blocchi vengono scaricati con cloni della sessione condivisa
+    backfill.client = get_machine_client()
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    resume = bool(data.get('resume', True))
+
+    thread = threading.Thread(target=perform_backfill, args=(backfill, start_date, end_date, resume))
+    thread.daemon = True
+    thread.start()
+
+    return jsonify({
+        "success": True,
+        "message": "Backfill avviato",
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "shard": backfill.shard,
+        "concurrency": backfill.concurrency
+    })
 
 @app.route('/api/download-status')
 def api_download_status():
@@ -636,10 +964,17 @@ def api_refresh():
 
 @app.route('/api/process-events', methods=['POST'])
 def api_process_events():
-    """API endpoint per processare eventi con sistema unificato"""
+    """API endpoint per processare eventi con sistema unificato
+
+    Parametri JSON opzionali: file, use_watermark (default true; false per
+    reimportare un archivio più vecchio dell'ultimo evento importato)
+    """
     try:
         data = request.get_json() or {}
         json_file = data.get('file')
+        use_watermark = data.get('use_watermark', True)
+        if not isinstance(use_watermark, bool):
+            return jsonify({"error": "use_watermark deve essere true o false"}), 400
 
         if not json_file:
             # Trova il file più recente se non specificato
@@ -649,11 +984,15 @@ def api_process_events():
             json_file = max(json_files, key=lambda f: os.path.getmtime(f))
 
         # Processa con il sistema unificato
-        analyzer.process_events_file(json_file)
+        stats = analyzer.process_events_file(json_file, use_watermark=use_watermark)
+        if stats is None:
+            return jsonify({"error": f"File non trovato: {json_file}"}), 404
 
         return jsonify({
             "success": True,
             "processed_file": json_file,
+            "new_events": stats['new_events'],
+            "skipped_events": stats['skipped_events'],
             "timestamp": datetime.now().isoformat()
         })
 
@@ -753,6 +1092,14 @@ if __name__ == '__main__':
     # Inizializza motor analytics
     motor_analytics = MotorAnalytics(args.db)
 
+    # Dopo ogni import ricalcola in background solo i motori con nuove vendite
+    analyzer.add_import_listener(motor_analytics.invalidate_motors)
+
+    # Previsioni di esaurimento: tutte all'avvio, poi solo i motori toccati dagli import
+    refill_forecaster = RefillForecaster(args.db)
+    analyzer.add_import_listener(refill_forecaster.update_in_background)
+    threading.Thread(target=refill_forecaster.update_motors, daemon=True).start()
+
     # Mostra modalità usando IP normalizzato
     mode_text = "SIMULATORE" if Config.is_simulator_ip(DISTRIBUTORE_IP) else f"DISTRIBUTORE {DISTRIBUTORE_IP}"
     if args.ip != DISTRIBUTORE_IP:
@@ -769,12 +1116,21 @@ if __name__ == '__main__':
     print("  - GET /api/dashboard - Dati dashboard completa")
     print("  - GET /api/motors - Lista motori")
     print("  - GET /api/motors/<id>/analytics - Analytics dettagliate motore")
+    print("  - GET /api/motors/<id>/heatmap - Heatmap vendite ora x giorno del motore")
     print("  - GET /api/motors/analytics/status - Status tutti i motori")
+    print("  - GET /api/motors/analytics/intervals - Intervalli tra vendite (mediana, percentili, z-score)")
+    print("  - GET /api/motors/intervals/quantiles - Quantili intervalli tra vendite per motore")
+    print("  - GET /api/motors/stock - Scorte motori (vendite da ultima ricarica, esaurimenti)")
+    print("  - GET /api/motors/refill-forecast - Previsioni esaurimento e motori da ricaricare")
     print("  - POST /api/analytics/refresh - Refresh calcoli analytics")
     print("  - GET /api/analytics/cache/stats - Statistiche cache analytics")
     print("  - POST /api/analytics/cache/cleanup - Pulizia cache scaduta")
     print("  - GET /api/statistics/overview - Statistiche generali")
     print("  - GET /api/statistics/by-brand - Statistiche per marca")
+    print("  - GET /api/statistics/query - Statistiche per dimensioni e metriche")
+    print("  - GET /api/statistics/heatmap - Heatmap vendite ora x giorno")
+    print("  - GET /api/statistics/baskets - Dimensioni carrelli e prodotti acquistati insieme")
+    print("  - GET /api/statistics/quantiles - Quantili valore transazioni e intervalli tra vendite")
     print("  - POST /api/download-events - Avvia download eventi")
     print("=" * 40)
 
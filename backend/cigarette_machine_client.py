@@ -9,18 +9,56 @@ import json
 from datetime import datetime, timedelta
 import sys
 import os
+from event_stream import iter_events_stream, READ_BLOCK_SIZE
 
 # Add parent directory to path to import shared
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from shared.config import Config
 
+# Testo della pagina mostrata dal distributore quando la sessione non è autenticata
+NOT_AUTHENTICATED_MESSAGE = "non sei connesso come amministratore"
+
+# Secondi di attesa massima per connessione e dati se il chiamante non ne indica altri:
+# un distributore che accetta la connessione e poi non risponde non blocca il client
+DEFAULT_TIMEOUT = 120
+
+
+class SessionExpiredError(requests.RequestException):
+    """La sessione sul distributore non è (più) autenticata"""
+
+
+class _ResponseTextReader:
+    """Espone i blocchi di testo di una risposta in streaming con un'interfaccia read()
+
+    Il primo blocco viene letto subito per poter riconoscere una pagina HTML
+    (es. quella di login) prima di decodificare gli eventi.
+    """
+
+    def __init__(self, response, block_size=READ_BLOCK_SIZE):
+        response.encoding = response.encoding or 'utf-8'
+        self.blocks = response.iter_content(chunk_size=block_size, decode_unicode=True)
+        self.first_block = next(self.blocks, '')
+        self.pending = self.first_block
+
+    def read(self, size=-1):
+        # Il parser accetta blocchi di qualsiasi lunghezza, '' segnala la fine
+        if self.pending:
+            block, self.pending = self.pending, ''
+            return block
+        return next(self.blocks, '')
+
 
 class CigaretteMachineClient:
     """Client per comunicare con il distributore di sigarette o simulatore"""
 
-    def __init__(self, base_url=None, password=None):
+    def __init__(self, base_url=None, password=None, timeout=None):
         self.base_url = base_url or Config.get_distributor_url()
         self.password = password or Config.DEFAULT_PASSWORD
+        # Timeout (secondi) di connessione e di attesa dei dati per ogni richiesta
+        self.timeout = timeout if timeout is not None else DEFAULT_TIMEOUT
+        # La pagina events2 va visitata una volta per login prima di events2_query
+        self.events_page_visited = False
+        self.logged_in = False
         self.session = requests.Session()
         # User-Agent necessario - il distributore blocca richieste senza browser reale
         self.session.headers.update({
@@ -34,7 +72,7 @@ class CigaretteMachineClient:
 
         try:
             # Prima ottieni la pagina di login per stabilire la sessione
-            response = self.session.get(login_page_url)
+            response = self.session.get(login_page_url, timeout=self.timeout)
             response.raise_for_status()
 
             # Headers corretti come dal DevTools
@@ -52,29 +90,51 @@ class CigaretteMachineClient:
                 'password': self.password
             }
 
+            # Una nuova sessione richiede di nuovo la visita a events2
+            self.events_page_visited = False
+
             # Tentativo di login con URL corretto
-            response = self.session.post(login_check_url, data=login_data, headers=headers)
+            response = self.session.post(login_check_url, data=login_data, headers=headers, timeout=self.timeout)
             response.raise_for_status()
 
             # Verifica se il login è riuscito controllando se non c'è il messaggio di errore
-            if "non sei connesso come amministratore" in response.text:
+            if NOT_AUTHENTICATED_MESSAGE in response.text:
                 print("❌ Login fallito: credenziali errate")
+                self.logged_in = False
                 return False
 
             print(f"✅ Login effettuato con successo")
+            self.logged_in = True
             return True
 
         except requests.RequestException as e:
             print(f"❌ Errore durante il login: {e}")
+            self.logged_in = False
             return False
 
+    def ensure_login(self):
+        """Effettua il login solo se la sessione corrente non è già autenticata"""
+        return self.logged_in or self.login()
+
+    def _check_session(self, response):
+        """Solleva SessionExpiredError se il distributore ha rifiutato o rediretto al login la richiesta"""
+        if response.status_code == 401 or response.url.rstrip('/').endswith('/login'):
+            response.close()
+            self._session_expired()
+
+    def _session_expired(self):
+        self.logged_in = False
+        self.events_page_visited = False
+        raise SessionExpiredError("Sessione sul distributore scaduta")
+
     def download_events_html(self, output_file=None):
         """Scarica la pagina degli eventi in formato HTML"""
         events_url = f"{self.base_url}/events2"
 
         try:
-            response = self.session.get(events_url)
+            response = self.session.get(events_url, timeout=self.timeout)
             response.raise_for_status()
+            self.events_page_visited = True
 
             # Genera nome file se non specificato
             if not output_file:
@@ -93,42 +153,61 @@ class CigaretteMachineClient:
             print(f"❌ Errore durante il download: {e}")
             return None
 
-    def download_events_data(self, days_back=30):
-        """Scarica i dati degli eventi in formato JSON tramite API"""
+    def _visit_events_page(self):
+        """Visita events2 se non è già stato fatto dall'ultimo login"""
+        if self.events_page_visited:
+            return
+        response = self.session.get(f"{self.base_url}/events2", headers={
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+            'Accept-Language': 'it-IT,it;q=0.9,en-US;q=0.8,en;q=0.7',
+            'Connection': 'keep-alive',
+            'DNT': '1',
+            'Upgrade-Insecure-Requests': '1'
+        }, timeout=self.timeout)
+        self._check_session(response)
+        response.raise_for_status()
+        self.events_page_visited = True
+
+    def _query_events(self, days_back, stream=False, start_date=None, end_date=None):
+        """Esegue la richiesta a events2_query dal giorno start_date (o dagli ultimi days_back giorni)
+        a end_date (default oggi), estremi inclusi"""
         events_query_url = f"{self.base_url}/events2_query"
 
-        try:
-            # Calcola range di date (ultimi X giorni)
-            today = datetime.now().date()
+        # Calcola range di date (da start_date o ultimi X giorni)
+        today = datetime.now().date()
+        if start_date is None:
             start_date = today - timedelta(days=days_back)
+        if end_date is None:
+            end_date = today
 
-            # Query per tutti gli eventi nel range
-            query_data = f"*|{start_date}|{today}"
+        # Query per tutti gli eventi nel range
+        query_data = f"*|{start_date}|{end_date}"
 
-            # Headers per richiesta JSON (esatti come dal browser)
-            headers = {
-                'Accept': 'application/json, text/plain, */*',
-                'Accept-Language': 'it-IT,it;q=0.9,en-US;q=0.8,en;q=0.7',
-                'Connection': 'keep-alive',
-                'DNT': '1',
-                'Referer': f'{self.base_url}/events2'
-            }
+        # Headers per richiesta JSON (esatti come dal browser)
+        headers = {
+            'Accept': 'application/json, text/plain, */*',
+            'Accept-Language': 'it-IT,it;q=0.9,en-US;q=0.8,en;q=0.7',
+            'Connection': 'keep-alive',
+            'DNT': '1',
+            'Referer': f'{self.base_url}/events2'
+        }
 
-            # Visita prima events2 per stabilire la sessione corretta
-            self.session.get(f"{self.base_url}/events2", headers={
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-                'Accept-Language': 'it-IT,it;q=0.9,en-US;q=0.8,en;q=0.7',
-                'Connection': 'keep-alive',
-                'DNT': '1',
-                'Upgrade-Insecure-Requests': '1'
-            })
+        # Visita prima events2 per stabilire la sessione corretta (una volta per login)
+        self._visit_events_page()
 
-            # URL con encoding corretto (| = %7C)
-            encoded_query = query_data.replace('|', '%7C')
-            full_url = f"{events_query_url}?queryData={encoded_query}"
+        # URL con encoding corretto (| = %7C)
+        encoded_query = query_data.replace('|', '%7C')
+        full_url = f"{events_query_url}?queryData={encoded_query}"
 
-            response = self.session.get(full_url, headers=headers)
-            response.raise_for_status()
+        response = self.session.get(full_url, headers=headers, stream=stream, timeout=self.timeout)
+        self._check_session(response)
+        response.raise_for_status()
+        return response
+
+    def download_events_data(self, days_back=30, start_date=None):
+        """Scarica i dati degli eventi in formato JSON tramite API (da start_date se indicato)"""
+        try:
+            response = self._query_events(days_back, start_date=start_date)
 
             # Prova a parsare come JSON
             try:
@@ -143,10 +222,71 @@ class CigaretteMachineClient:
             print(f"❌ Errore durante il download dati JSON: {e}")
             return []
 
+    def download_events_to_file(self, output_file, days_back=30, start_date=None):
+        """Scarica i dati JSON degli eventi direttamente su file, senza tenerli in memoria"""
+        try:
+            response = self._query_events(days_back, stream=True, start_date=start_date)
+
+            with open(output_file, 'wb') as f:
+                for block in response.iter_content(chunk_size=64 * 1024):
+                    f.write(block)
+            response.close()
+
+            return output_file
+
+        except requests.RequestException as e:
+            print(f"❌ Errore durante il download dati JSON: {e}")
+            return None
+
+    def iter_events(self, days_back=30, start_date=None, relogin=True, end_date=None):
+        """Genera gli eventi di events2_query man mano che arrivano dalla rete
+
+        Nessun file intermedio e nessuna copia completa in memoria: il generatore
+        può essere passato direttamente a SalesAnalyzer.ingest_events. Gli errori
+        di rete vengono propagati a chi consuma gli eventi; una risposta non JSON
+        non genera eventi. Se la sessione è scaduta (riconosciuta prima del primo
+        evento) e relogin è attivo, rifà il login e ripete la richiesta una volta.
+        """
+        try:
+            yield from self._stream_events(days_back, start_date, end_date)
+        except SessionExpiredError:
+            if not relogin or not self.login():
+                raise
+            yield from self._stream_events(days_back, start_date, end_date)
+
+    def _stream_events(self, days_back, start_date, end_date):
+        response = self._query_events(days_back, stream=True, start_date=start_date, end_date=end_date)
+        try:
+            reader = _ResponseTextReader(response)
+            if reader.first_block.lstrip().startswith('<'):
+                # Pagina HTML al posto del JSON: se è quella di login la sessione è scaduta
+                if NOT_AUTHENTICATED_MESSAGE in reader.first_block + ''.join(reader.blocks):
+                    self._session_expired()
+                return
+            yield from iter_events_stream(reader)
+        finally:
+            response.close()
+
+    def clone(self):
+        """Nuovo client con una propria requests.Session che condivide i cookie di questa
+
+        Per le richieste in parallelo (requests.Session non è garantita
+        thread-safe) senza ripetere il login sul distributore.
+        """
+        clone = CigaretteMachineClient(self.base_url, self.password, self.timeout)
+        clone.session.headers.update(self.session.headers)
+        clone.session.cookies.update(self.session.cookies)
+        clone.logged_in = self.logged_in
+        clone.events_page_visited = self.events_page_visited
+        return clone
+
     def exit_programming_mode(self):
         """Esce dalla modalità programmazione del distributore"""
+        # Dopo l'uscita la sessione va considerata chiusa
+        self.logged_in = False
+        self.events_page_visited = False
         try:
-            response = self.session.get(f"{self.base_url}/admin_index_back")
+            response = self.session.get(f"{self.base_url}/admin_index_back", timeout=self.timeout)
             response.raise_for_status()
             return True
         except requests.RequestException as e:
@@ -5,18 +5,550 @@ Analizza gli eventi di vendita e statistiche per motore
 """
 
 import json
+import bisect
+import calendar
 import sqlite3
 import re
 import os
+import time
+import queue
+import threading
 from datetime import datetime, timedelta
 from collections import defaultdict, Counter
+from itertools import groupby
+
+from event_stream import iter_events_file
+from quantile_sketch import TDigest
 import argparse
 
+# Numero massimo di eventi tenuti in memoria per blocco durante l'import
+EVENT_CHUNK_SIZE = 1000
+
+# Blocchi di eventi in attesa di essere scritti nell'archivio (limita la memoria se il disco è lento)
+ARCHIVE_QUEUE_SIZE = 8
+
+
+def sortable_datetime_sql(column):
+    """Espressione SQL che riscrive una colonna "17/09/25 19:14:15" nella forma ordinabile "2025-09-17 19:14:15" """
+    return (f"'20' || substr({column}, 7, 2) || '-' || substr({column}, 4, 2) || '-' "
+            f"|| substr({column}, 1, 2) || substr({column}, 9)")
+
+
+def epoch_sql(column):
+    """Espressione SQL del timestamp normalizzato di una colonna in formato distributore"""
+    return f"CAST(strftime('%s', {sortable_datetime_sql(column)}) AS INTEGER)"
+
+# Margine sotto il watermark entro cui gli eventi passano comunque dal vincolo UNIQUE
+WATERMARK_OVERLAP = timedelta(hours=1)
+
+# Download dal distributore: giorni richiesti senza eventi importati o con
+# risincronizzazione completa, e margine prima dell'ultimo evento importato
+# da cui riparte il download incrementale (la query è per giorni interi)
+FULL_RESYNC_DAYS = 30
+DOWNLOAD_OVERLAP = timedelta(days=1)
+
+# Chiave di system_status presente finché un import con update_rollups=False
+# non è seguito dalla ricostruzione degli aggregati (vedi rebuild_rollups)
+ROLLUPS_PENDING_KEY = 'rollups_pending'
+
+# Indici secondari gestiti da init_database: (nome, tabella, colonne).
+# Se la definizione cambia l'indice viene ricreato all'avvio.
+INDEXES = [
+    # Controllo duplicati all'import e statistiche per motore (price per coprire le somme)
+    ('idx_sales_motor_datetime', 'sales', 'motor_id, sale_datetime, price'),
+    # Filtri per periodo su statistiche e dashboard
+    ('idx_sales_datetime', 'sales', 'sale_datetime, price'),
+    ('idx_sales_brand_datetime', 'sales', 'brand_id, sale_datetime'),
+    ('idx_transactions_start_ts', 'transactions', 'start_ts'),
+    ('idx_transactions_payment_start', 'transactions', 'payment_method, start_ts'),
+    # Ricerca dell'ultima transazione incompleta
+    ('idx_transactions_complete_start', 'transactions', 'is_complete, start_ts'),
+    ('idx_events_ts', 'events', 'event_ts'),
+    # Eventi di una transazione ed eventi ancora da collegare
+    ('idx_events_transaction', 'events', 'transaction_id, event_ts'),
+    # Somme per periodo su tutti i motori
+    ('idx_motor_daily_stats_day', 'motor_daily_stats', 'day'),
+    ('idx_motor_stockouts_motor', 'motor_stockouts', 'motor_id, stockout_datetime'),
+    # Sketch degli intervalli di tutti i motori in un periodo
+    ('idx_motor_interval_sketches_day', 'motor_interval_sketches', 'day'),
+]
+
+# Colonne di transactions con uno sketch dei quantili per giorno (vedi update_transaction_sketches)
+TRANSACTION_SKETCH_METRICS = ('net_revenue', 'total_paid', 'total_change')
+
+
+def datetime_to_ts(dt):
+    """Converte un datetime naive nel timestamp normalizzato
+
+    I timestamp normalizzati (event_ts, start_ts, end_ts) sono secondi epoch
+    dell'ora locale del distributore, senza fuso orario: equivalgono a
+    strftime('%s', ...) di SQLite e restano ordinabili e confrontabili.
+    """
+    return calendar.timegm(dt.timetuple())
+
+
+def ts_to_datetime(ts):
+    """Converte un timestamp normalizzato nel datetime naive corrispondente"""
+    return datetime(1970, 1, 1) + timedelta(seconds=ts)
+
+
+def event_datetime_to_ts(datetime_str):
+    """Timestamp normalizzato di un dateTime del distributore, None se non interpretabile"""
+    # Parsing a posizioni fisse ("17/09/25 19:14:15"): molto più rapido di strptime sull'import
+    if not isinstance(datetime_str, str) or len(datetime_str) != 17 or datetime_str[2::3] != '// ::':
+        return None
+    try:
+        return calendar.timegm((
+            2000 + int(datetime_str[6:8]), int(datetime_str[3:5]), int(datetime_str[0:2]),
+            int(datetime_str[9:11]), int(datetime_str[12:14]), int(datetime_str[15:17])
+        ))
+    except ValueError:
+        return None
+
+
+def date_range_to_ts(date_from=None, date_to=None):
+    """Converte un filtro per giorni (YYYY-MM-DD, estremi inclusi) nell'intervallo [start_ts, end_ts)"""
+    start_ts = datetime_to_ts(datetime.strptime(date_from, "%Y-%m-%d")) if date_from else None
+    end_ts = datetime_to_ts(datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=1)) if date_to else None
+    return start_ts, end_ts
+
+
+def date_range_to_bounds(date_from=None, date_to=None):
+    """Converte un filtro per giorni (YYYY-MM-DD, estremi inclusi) nei limiti [inizio, fine) su sale_datetime
+
+    sale_datetime è in formato ISO ordinabile, quindi "2025-09-18" <= "2025-09-18 10:00:00"
+    e il giorno successivo a date_to fa da limite superiore escluso.
+    """
+    end = (datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d") if date_to else None
+    return date_from or None, end
+
+
+def sale_datetime_conditions(date_from=None, date_to=None, column='sale_datetime'):
+    """Condizioni semiaperte (usabili dagli indici) e parametri per filtrare le vendite per giorni"""
+    start, end = date_range_to_bounds(date_from, date_to)
+    conditions = []
+    params = []
+    if start:
+        conditions.append(f"{column} >= ?")
+        params.append(start)
+    if end:
+        conditions.append(f"{column} < ?")
+        params.append(end)
+    return conditions, params
+
+
+def sale_datetime_to_ts(datetime_str):
+    """Timestamp normalizzato di un sale_datetime ("2025-09-17 19:14:15")"""
+    return calendar.timegm((
+        int(datetime_str[0:4]), int(datetime_str[5:7]), int(datetime_str[8:10]),
+        int(datetime_str[11:13]), int(datetime_str[14:16]), int(datetime_str[17:19])
+    ))
+
+
+def welford_update(count, mean, m2, value):
+    """Aggiunge un valore a (count, media, somma dei quadrati degli scarti) con l'algoritmo di Welford"""
+    count += 1
+    delta = value - mean
+    mean += delta / count
+    m2 += delta * (value - mean)
+    return count, mean, m2
+
+
+# Notifica email di motore vuoto: "Invio mail prodotto esaurito n.35 (motore) a ..."
+STOCKOUT_PATTERN = re.compile(r'prodotto esaurito n\.\s*(\d+)\s*\(motore\)', re.IGNORECASE)
+
+
+def event_datetime_sort_value(datetime_str):
+    """Riscrive "17/09/25 19:14:15" in "2025-09-17 19:14:15", ordinabile come stringa"""
+    if not datetime_str or len(datetime_str) < 8:
+        return ''
+    return f"20{datetime_str[6:8]}-{datetime_str[3:5]}-{datetime_str[0:2]}{datetime_str[8:]}"
+
+
+def event_sort_key(event):
+    """Chiave cronologica di un evento: (data e ora ordinabili, numero evento)"""
+    try:
+        number = int(event.get('number', 0))
+    except (TypeError, ValueError):
+        number = 0
+    return event_datetime_sort_value(event.get('dateTime', '')), number
+
+
+def iter_chunks(items, chunk_size=EVENT_CHUNK_SIZE):
+    """Raggruppa un iterabile in liste di al massimo chunk_size elementi"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class EventArchiveWriter:
+    """Scrive in un thread separato una copia compatta degli eventi scaricati
+
+    Il file ha la forma _complete.json ({"download_info", "events_data",
+    "events_count"}) ed è quindi rileggibile con iter_events_file. Gli eventi
+    passano da tee() all'import senza attendere il disco; il file viene scritto
+    con un nome temporaneo e rinominato solo a scrittura completata. Un errore
+    di scrittura non interrompe l'import: viene riportato in self.error.
+    """
+
+    def __init__(self, path, download_info=None, chunk_size=EVENT_CHUNK_SIZE):
+        self.path = path
+        self.download_info = download_info or {}
+        self.chunk_size = chunk_size
+        self.events_count = 0
+        self.error = None
+        self.queue = queue.Queue(maxsize=ARCHIVE_QUEUE_SIZE)
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def tee(self, events):
+        """Restituisce gli eventi così come arrivano accodandone una copia per l'archivio"""
+        chunk = []
+        for event in events:
+            chunk.append(event)
+            yield event
+            if len(chunk) >= self.chunk_size:
+                self.queue.put(chunk)
+                chunk = []
+        if chunk:
+            self.queue.put(chunk)
+
+    def close(self, keep=True):
+        """Attende la scrittura degli eventi accodati; con keep=False scarta il file"""
+        self.queue.put(None)
+        self.thread.join()
+        temp_path = self.path + '.part'
+        if keep and not self.error:
+            os.replace(temp_path, self.path)
+            return self.path
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return None
+
+    def _write(self):
+        f = None
+        try:
+            f = open(self.path + '.part', 'w', encoding='utf-8')
+            f.write('{"download_info":' + json.dumps(self.download_info, ensure_ascii=False, separators=(',', ':'))
+                    + ',"events_data":[')
+        except OSError as e:
+            self.error = e
+
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                break
+            # Dopo un errore la coda viene comunque svuotata per non bloccare tee()
+            if self.error:
+                continue
+            try:
+                for event in chunk:
+                    f.write((',' if self.events_count else '')
+                            + json.dumps(event, ensure_ascii=False, separators=(',', ':')))
+                    self.events_count += 1
+            except OSError as e:
+                self.error = e
+
+        if f is not None:
+            try:
+                if not self.error:
+                    f.write(f'],"events_count":{self.events_count}}}')
+                f.close()
+            except OSError as e:
+                self.error = e
+
+
+class TransactionBuilder:
+    """Ricostruisce le transazioni da un flusso cronologico di eventi, anche a blocchi"""
+
+    def __init__(self, analyzer, batch=None, on_complete=None):
+        self.analyzer = analyzer
+        self.batch = batch
+        self.on_complete = on_complete
+        self.completed_count = 0
+
+        # Cerca transazione incompleta esistente
+        self.current_transaction = analyzer.get_last_incomplete_transaction(batch.cursor if batch else None)
+
+    def feed(self, events):
+        """Elabora un blocco di eventi mantenendo aperta l'ultima transazione"""
+        for event in events:
+            if self.analyzer.is_transaction_start(event):
+                # Completa transazione precedente se esiste
+                if self.current_transaction:
+                    self._complete(self.current_transaction)
+
+                # Inizia nuova transazione
+                self.current_transaction = self.analyzer.start_new_transaction(event)
+
+            elif self.current_transaction:
+                # Aggiungi evento alla transazione corrente
+                self.analyzer.add_event_to_transaction(self.current_transaction, event)
+
+    def finish(self):
+        """Chiude il flusso salvando l'eventuale transazione parziale con vendite"""
+        transaction = self.current_transaction
+        self.current_transaction = None
+
+        # Solo se è una nuova transazione con vendite
+        if transaction and transaction.get('id') is None and transaction.get('sales'):
+            self._complete(transaction)
+
+    def _complete(self, transaction):
+        transaction_id = self.analyzer.complete_transaction(transaction, self.batch)
+        self.completed_count += 1
+        if self.on_complete:
+            self.on_complete(transaction, transaction_id)
+
+
+class BasketCounts:
+    """Conteggi dei carrelli (transazioni con più vendite) per giorno, da sommare alle tabelle basket_*
+
+    Per ogni transazione: dimensione del carrello (numero di vendite) e incasso,
+    prodotti distinti e coppie di prodotti distinti acquistati insieme.
+    """
+
+    def __init__(self):
+        self.sizes = Counter()
+        self.revenue = Counter()
+        self.products = Counter()
+        self.pairs = Counter()
+
+    def add(self, day, items):
+        """Conta il carrello di una transazione: items è la lista di (prodotto, prezzo) delle vendite"""
+        if not day or not items:
+            return
+        self.sizes[(day, len(items))] += 1
+        self.revenue[(day, len(items))] += sum(price or 0 for _, price in items)
+        products = sorted({(product_name or '').strip() for product_name, _ in items})
+        for index, product_name in enumerate(products):
+            self.products[(day, product_name)] += 1
+            for other in products[index + 1:]:
+                self.pairs[(day, product_name, other)] += 1
+
+    def write(self, cursor):
+        """Somma i conteggi raccolti alle tabelle basket_* e li azzera"""
+        cursor.executemany('''
+            INSERT INTO basket_size_daily_stats (day, basket_size, transactions_count, revenue)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(day, basket_size) DO UPDATE SET
+                transactions_count = basket_size_daily_stats.transactions_count + excluded.transactions_count,
+                revenue = basket_size_daily_stats.revenue + excluded.revenue
+        ''', [key + (count, self.revenue[key]) for key, count in self.sizes.items()])
+        cursor.executemany('''
+            INSERT INTO basket_product_daily_stats (day, product_name, transactions_count)
+            VALUES (?, ?, ?)
+            ON CONFLICT(day, product_name) DO UPDATE SET
+                transactions_count = basket_product_daily_stats.transactions_count + excluded.transactions_count
+        ''', [key + (count,) for key, count in self.products.items()])
+        cursor.executemany('''
+            INSERT INTO basket_pair_daily_stats (day, product_a, product_b, transactions_count)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(day, product_a, product_b) DO UPDATE SET
+                transactions_count = basket_pair_daily_stats.transactions_count + excluded.transactions_count
+        ''', [key + (count,) for key, count in self.pairs.items()])
+        for counter in (self.sizes, self.revenue, self.products, self.pairs):
+            counter.clear()
+
+
+class IngestBatch:
+    """Raccoglie le scritture di un import e le esegue con executemany in un'unica transazione SQLite"""
+
+    def __init__(self, analyzer, conn=None):
+        self.analyzer = analyzer
+        self.own_conn = conn is None
+        self.conn = conn if conn is not None else sqlite3.connect(analyzer.db_path)
+        self.cursor = self.conn.cursor()
+
+        # Lock in scrittura da subito: gli id delle nuove transazioni sono assegnati in memoria
+        if not self.conn.in_transaction:
+            self.cursor.execute('BEGIN IMMEDIATE')
+
+        self.cursor.execute('SELECT COALESCE(MAX(id), 0) FROM transactions')
+        self.next_transaction_id = self.cursor.fetchone()[0] + 1
+
+        # Cache marche: una sola query invece di una lookup per vendita
+        self.cursor.execute('SELECT brand_name, id FROM product_brands')
+        self.brand_ids = dict(self.cursor.fetchall())
+
+        self.new_transactions = []
+        self.updated_transactions = []
+        self.sales = []
+        self.events = []
+        self.event_links = []
+        self.baskets = BasketCounts()
+        self.stats = Counter()
+
+    def get_brand_id(self, brand_name):
+        """Ottiene l'id della marca dalla cache, creandola se necessario"""
+        brand_id = self.brand_ids.get(brand_name)
+        if brand_id is None:
+            brand_id = self.analyzer.get_or_create_brand(brand_name, self.cursor)
+            self.brand_ids[brand_name] = brand_id
+        return brand_id
+
+    def add_transaction(self, transaction):
+        """Accoda una transazione completata e le sue vendite, restituisce il transaction_id"""
+        if not transaction['sales']:
+            return None  # Salta transazioni senza vendite
+
+        payment_method = self.analyzer.determine_payment_method(transaction['payments'])
+        net_revenue = transaction['total_paid'] - transaction['total_change']
+        end_datetime = transaction.get('end_datetime', transaction['start_datetime'])
+
+        if transaction.get('id'):
+            transaction_id = transaction['id']
+            self.updated_transactions.append((
+                end_datetime, event_datetime_to_ts(end_datetime), payment_method,
+                transaction['total_paid'], transaction['total_change'], net_revenue, transaction_id
+            ))
+        else:
+            transaction_id = self.next_transaction_id
+            self.next_transaction_id += 1
+            self.new_transactions.append((
+                transaction_id, transaction['start_datetime'], event_datetime_to_ts(transaction['start_datetime']),
+                end_datetime, event_datetime_to_ts(end_datetime), payment_method,
+                transaction['total_paid'], transaction['total_change'], net_revenue
+            ))
+
+        for sale in transaction['sales']:
+            brand_name = self.analyzer.extract_brand_from_product(sale['product_name'])
+            self.sales.append((
+                sale['motor_id'], sale['product_name'], sale['price'],
+                sale['sale_datetime'], sale['event_number'],
+                transaction_id, self.get_brand_id(brand_name), payment_method
+            ))
+
+        return transaction_id
+
+    def add_basket(self, transaction, transaction_id):
+        """Conta il carrello di una transazione completata (vedi BasketCounts)
+
+        Una transazione incompleta ripresa da un import precedente ha già salvato
+        parte delle vendite: si contano insieme a quelle nuove.
+        """
+        items = [(sale['product_name'], sale['price']) for sale in transaction['sales']]
+        if transaction.get('id'):
+            self.cursor.execute('SELECT product_name, price FROM sales WHERE transaction_id = ?', (transaction_id,))
+            items = self.cursor.fetchall() + items
+        start_ts = event_datetime_to_ts(transaction['start_datetime'])
+        day = ts_to_datetime(start_ts).strftime("%Y-%m-%d") if start_ts is not None else None
+        self.baskets.add(day, items)
+
+    def add_events(self, events_list, event_transaction_map=None):
+        """Accoda eventi grezzi con transaction_id opzionale"""
+        for event in events_list:
+            event_key = (event.get('number', ''), event.get('dateTime', ''))
+            transaction_id = event_transaction_map.get(event_key) if event_transaction_map else None
+            self.events.append((
+                event.get('number', ''),
+                event.get('code', ''),
+                event.get('type', ''),
+                event.get('dateTime', ''),
+                event_datetime_to_ts(event.get('dateTime', '')),
+                event.get('text', ''),
+                transaction_id
+            ))
+
+    def link_events(self, transaction_id, event_ids):
+        """Accoda il collegamento di eventi già salvati (per id) a una transazione"""
+        self.event_links.extend((transaction_id, event_id) for event_id in event_ids)
+
+    def flush(self):
+        """Scrive su database tutte le righe accodate con executemany"""
+        cursor = self.cursor
+
+        if self.new_transactions:
+            cursor.executemany('''
+                INSERT INTO transactions
+                (id, start_datetime, start_ts, end_datetime, end_ts, payment_method,
+                 total_paid, total_change, net_revenue, is_complete)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+            ''', self.new_transactions)
+            self.stats['transactions'] += len(self.new_transactions)
+            self.new_transactions = []
+
+        if self.updated_transactions:
+            cursor.executemany('''
+                UPDATE transactions
+                SET end_datetime = ?, end_ts = ?, payment_method = ?, total_paid = ?,
+                    total_change = ?, net_revenue = ?, is_complete = 1
+                WHERE id = ?
+            ''', self.updated_transactions)
+            self.stats['transactions'] += len(self.updated_transactions)
+            self.updated_transactions = []
+
+        if self.sales:
+            # Inserisce solo le vendite non ancora presenti (stessa regola di complete_transaction)
+            changes_before = self.conn.total_changes
+            cursor.executemany('''
+                INSERT INTO sales
+                (motor_id, product_name, price, sale_datetime, event_number,
+                 transaction_id, brand_id, payment_method)
+                SELECT ?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM sales
+                    WHERE motor_id = ?1 AND sale_datetime = ?4 AND event_number = ?5
+                )
+            ''', self.sales)
+            self.stats['sales'] += self.conn.total_changes - changes_before
+            self.sales = []
+
+        if self.events:
+            changes_before = self.conn.total_changes
+            cursor.executemany('''
+                INSERT OR IGNORE INTO events
+                (event_number, event_code, event_type, event_datetime, event_ts, event_text, transaction_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', self.events)
+            self.stats['events'] += self.conn.total_changes - changes_before
+            self.events = []
+
+        if self.event_links:
+            cursor.executemany('UPDATE events SET transaction_id = ? WHERE id = ?', self.event_links)
+            self.event_links = []
+
+        if self.baskets.sizes:
+            self.baskets.write(cursor)
+
+    def commit(self):
+        """Esegue il flush finale e conferma la transazione"""
+        self.flush()
+        self.conn.commit()
+        if self.own_conn:
+            self.conn.close()
+
+    def rollback(self):
+        """Annulla tutte le scritture del batch"""
+        self.conn.rollback()
+        if self.own_conn:
+            self.conn.close()
+
+
 class SalesAnalyzer:
     def __init__(self, db_path="sales_data.db"):
         self.db_path = db_path
+        self.import_listeners = []
         self.init_database()
 
+    def add_import_listener(self, listener):
+        """Registra una funzione chiamata dopo ogni import con l'insieme dei motor_id con nuove vendite
+        o con scorte cambiate (esaurimenti, finestre di ricarica chiuse)"""
+        self.import_listeners.append(listener)
+
+    def notify_import_listeners(self, motor_ids):
+        """Pubblica ai listener i motori toccati da un import già confermato"""
+        for listener in self.import_listeners:
+            try:
+                listener(motor_ids)
+            except Exception as e:
+                print(f"⚠️ Errore listener import: {e}")
+
     def init_database(self):
         """Inizializza il database SQLite per le vendite"""
         conn = sqlite3.connect(self.db_path)
@@ -98,6 +630,172 @@ class SalesAnalyzer:
             )
         ''')
 
+        # Statistiche degli intervalli tra vendite consecutive per motore (secondi),
+        # aggiornate online con welford_update: m2_interval è la somma dei quadrati degli scarti
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS motor_interval_stats (
+                motor_id INTEGER PRIMARY KEY,
+                sales_count INTEGER NOT NULL DEFAULT 0,
+                mean_interval REAL NOT NULL DEFAULT 0,
+                m2_interval REAL NOT NULL DEFAULT 0,
+                first_sale TEXT,
+                last_sale TEXT
+            )
+        ''')
+
+        # Profilo stagionale per motore: vendite e incasso per giorno della settimana
+        # (0 = domenica, come strftime('%w')) e ora del giorno
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS motor_hourly_profile (
+                motor_id INTEGER NOT NULL,
+                weekday INTEGER NOT NULL,
+                hour INTEGER NOT NULL,
+                sales_count INTEGER NOT NULL DEFAULT 0,
+                revenue REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (motor_id, weekday, hour)
+            )
+        ''')
+
+        # Aggregati giornalieri per motore, mantenuti all'import (vedi update_sales_rollups)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS motor_daily_stats (
+                motor_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                sales_count INTEGER NOT NULL DEFAULT 0,
+                revenue REAL NOT NULL DEFAULT 0,
+                first_sale TEXT,
+                last_sale TEXT,
+                PRIMARY KEY (motor_id, day)
+            )
+        ''')
+
+        # Esaurimenti motore ricavati dalle email "prodotto esaurito"
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS motor_stockouts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                motor_id INTEGER NOT NULL,
+                stockout_datetime TEXT NOT NULL,
+                event_id INTEGER UNIQUE,
+                units_since_refill INTEGER
+            )
+        ''')
+
+        # Finestre di programmazione (INGRESSO ... USCITA PROGRAMMAZIONE), trattate come ricariche
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS refill_windows (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                start_datetime TEXT NOT NULL,
+                end_datetime TEXT,
+                start_event_id INTEGER UNIQUE,
+                end_event_id INTEGER
+            )
+        ''')
+
+        # Stato scorte per motore, mantenuto all'import (vedi update_motor_stock)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS motor_stock (
+                motor_id INTEGER PRIMARY KEY,
+                last_refill TEXT,
+                sold_since_refill INTEGER NOT NULL DEFAULT 0,
+                last_stockout TEXT,
+                stockout_count INTEGER NOT NULL DEFAULT 0,
+                estimated_capacity INTEGER
+            )
+        ''')
+
+        # Aggregati vendite per ora e per giorno su tutte le dimensioni delle statistiche
+        # (NULL salvati come 0/'' perché facciano parte della chiave primaria)
+        for table, period_column in (('sales_hourly_stats', 'hour'), ('sales_daily_stats', 'day')):
+            cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS {table} (
+                    {period_column} TEXT NOT NULL,
+                    motor_id INTEGER NOT NULL,
+                    product_name TEXT NOT NULL,
+                    brand_id INTEGER NOT NULL,
+                    payment_method TEXT NOT NULL,
+                    sales_count INTEGER NOT NULL DEFAULT 0,
+                    revenue REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY ({period_column}, motor_id, product_name, brand_id, payment_method)
+                )
+            ''')
+
+        # Transazioni per giorno (di inizio) e metodo di pagamento
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS transactions_daily_stats (
+                day TEXT NOT NULL,
+                payment_method TEXT NOT NULL,
+                transactions_count INTEGER NOT NULL DEFAULT 0,
+                net_revenue REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, payment_method)
+            )
+        ''')
+
+        # Sketch dei quantili (quantile_sketch.TDigest serializzato) per giorno di inizio
+        # transazione e colonna, e per motore e giorno della vendita che chiude l'intervallo
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS transaction_value_sketches (
+                day TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                value_count INTEGER NOT NULL DEFAULT 0,
+                sketch BLOB NOT NULL,
+                PRIMARY KEY (day, metric)
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS motor_interval_sketches (
+                motor_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                interval_count INTEGER NOT NULL DEFAULT 0,
+                sketch BLOB NOT NULL,
+                PRIMARY KEY (motor_id, day)
+            )
+        ''')
+
+        # Carrelli per giorno (di inizio transazione): distribuzione delle dimensioni,
+        # transazioni per prodotto e per coppia di prodotti distinti (product_a < product_b)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS basket_size_daily_stats (
+                day TEXT NOT NULL,
+                basket_size INTEGER NOT NULL,
+                transactions_count INTEGER NOT NULL DEFAULT 0,
+                revenue REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, basket_size)
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS basket_product_daily_stats (
+                day TEXT NOT NULL,
+                product_name TEXT NOT NULL,
+                transactions_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, product_name)
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS basket_pair_daily_stats (
+                day TEXT NOT NULL,
+                product_a TEXT NOT NULL,
+                product_b TEXT NOT NULL,
+                transactions_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, product_a, product_b)
+            )
+        ''')
+
+        # Previsioni di esaurimento per motore, scritte da refill_forecast.RefillForecaster
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS motor_refill_forecast (
+                motor_id INTEGER PRIMARY KEY,
+                computed_at TEXT NOT NULL,
+                last_refill TEXT,
+                daily_rate REAL NOT NULL DEFAULT 0,
+                estimated_remaining REAL,
+                capacity_source TEXT,
+                empty_at TEXT
+            )
+        ''')
+
         # Aggiungi colonne alla tabella sales se non esistono
         try:
             cursor.execute('ALTER TABLE sales ADD COLUMN transaction_id INTEGER')
@@ -120,6 +818,22 @@ class SalesAnalyzer:
         except sqlite3.OperationalError:
             pass  # Colonna già esiste
 
+        # Timestamp normalizzati ordinabili (vedi datetime_to_ts)
+        try:
+            cursor.execute('ALTER TABLE events ADD COLUMN event_ts INTEGER')
+        except sqlite3.OperationalError:
+            pass  # Colonna già esiste
+
+        for column in ('start_ts', 'end_ts'):
+            try:
+                cursor.execute(f'ALTER TABLE transactions ADD COLUMN {column} INTEGER')
+            except sqlite3.OperationalError:
+                pass  # Colonna già esiste
+
+        self.migrate_normalized_timestamps(cursor)
+        self.ensure_indexes(cursor)
+        self.ensure_rollups(cursor)
+
         # Rimuovi tabelle inutilizzate se esistono
         try:
             cursor.execute('DROP TABLE IF EXISTS daily_stats')
@@ -166,17 +880,191 @@ class SalesAnalyzer:
         conn.close()
         print(f"✅ Database inizializzato: {self.db_path}")
 
-    def get_existing_event_keys(self):
-        """Ottiene le chiavi (number, dateTime) di tutti gli eventi già presenti nel database"""
+    def migrate_normalized_timestamps(self, cursor):
+        """Popola una tantum i timestamp normalizzati delle righe salvate senza"""
+        cursor.execute(f'''
+            UPDATE events SET event_ts = {epoch_sql('event_datetime')}
+            WHERE event_ts IS NULL
+        ''')
+        cursor.execute(f'''
+            UPDATE transactions
+            SET start_ts = {epoch_sql('start_datetime')},
+                end_ts = {epoch_sql("COALESCE(end_datetime, start_datetime)")}
+            WHERE start_ts IS NULL
+        ''')
+
+    def ensure_indexes(self, cursor):
+        """Crea gli indici di INDEXES, ricreando quelli con una definizione diversa"""
+        cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")
+        existing = dict(cursor.fetchall())
+
+        for name, table, columns in INDEXES:
+            create_sql = f'CREATE INDEX {name} ON {table}({columns})'
+            if existing.get(name) == create_sql:
+                continue
+            if name in existing:
+                cursor.execute(f'DROP INDEX {name}')
+            cursor.execute(create_sql)
+
+    def ensure_rollups(self, cursor):
+        """Popola da sales le tabelle di aggregati ancora vuote (primo avvio su un database esistente)
+
+        Se un import ha lasciato gli aggregati da ricostruire (es. backfill
+        interrotto) li ricalcola tutti.
+        """
+        if self.rollups_pending(cursor):
+            self.update_all_rollups(cursor)
+            return
+
+        cursor.execute('''
+            SELECT EXISTS(SELECT 1 FROM sales), EXISTS(SELECT 1 FROM motor_daily_stats),
+                   EXISTS(SELECT 1 FROM motor_interval_stats), EXISTS(SELECT 1 FROM motor_hourly_profile)
+        ''')
+        has_sales, has_daily_stats, has_interval_stats, has_hourly_profile = cursor.fetchone()
+        if has_sales and not has_daily_stats:
+            self.update_motor_daily_stats(cursor)
+        cursor.execute('SELECT EXISTS(SELECT 1 FROM motor_interval_sketches)')
+        if has_sales and (not has_interval_stats or not cursor.fetchone()[0]):
+            self.update_motor_interval_stats(cursor)
+        if has_sales and not has_hourly_profile:
+            self.update_motor_hourly_profile(cursor)
+
+        cursor.execute('''
+            SELECT EXISTS(SELECT 1 FROM sales_daily_stats), EXISTS(SELECT 1 FROM transactions),
+                   EXISTS(SELECT 1 FROM transactions_daily_stats)
+        ''')
+        has_sales_stats, has_transactions, has_transaction_stats = cursor.fetchone()
+        if has_sales and not has_sales_stats:
+            self.update_sales_period_stats(cursor)
+        if has_transactions and not has_transaction_stats:
+            self.update_transaction_daily_stats(cursor)
+
+        cursor.execute('SELECT EXISTS(SELECT 1 FROM transaction_value_sketches)')
+        if has_transactions and not cursor.fetchone()[0]:
+            self.update_transaction_sketches(cursor)
+
+        cursor.execute('SELECT EXISTS(SELECT 1 FROM basket_size_daily_stats)')
+        if has_transactions and has_sales and not cursor.fetchone()[0]:
+            self.update_basket_stats(cursor)
+
+        cursor.execute('SELECT EXISTS(SELECT 1 FROM events), EXISTS(SELECT 1 FROM motor_stock)')
+        has_events, has_motor_stock = cursor.fetchone()
+        if has_events and not has_motor_stock:
+            self.update_motor_stock(cursor)
+
+    def get_existing_event_keys(self, event_numbers=None):
+        """Ottiene le chiavi (number, dateTime) degli eventi già presenti nel database
+
+        Con event_numbers la ricerca è limitata a quei numeri evento (usa l'indice
+        del vincolo UNIQUE invece di leggere l'intera tabella).
+        """
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
 
-        cursor.execute('SELECT event_number, event_datetime FROM events')
-        existing_keys = set(cursor.fetchall())
+        if event_numbers is None:
+            cursor.execute('SELECT event_number, event_datetime FROM events')
+            existing_keys = set(cursor.fetchall())
+        else:
+            existing_keys = set()
+            for chunk in iter_chunks(sorted(set(event_numbers)), 500):
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(f'''
+                    SELECT event_number, event_datetime FROM events
+                    WHERE event_number IN ({placeholders})
+                ''', chunk)
+                existing_keys.update(cursor.fetchall())
 
         conn.close()
         return existing_keys
 
+    def get_event_watermark(self, cursor=None):
+        """Restituisce il watermark dell'ultimo evento importato come (datetime ordinabile, numero)
+
+        Il watermark è salvato in system_status; se manca (database importato con
+        versioni precedenti) viene ricavato una sola volta dalla tabella events.
+        """
+        close_conn = False
+        if cursor is None:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            close_conn = True
+
+        cursor.execute('''
+            SELECT key, value FROM system_status
+            WHERE key IN ('last_event_datetime', 'last_event_number')
+        ''')
+        values = dict(cursor.fetchall())
+
+        watermark = None
+        if values.get('last_event_datetime'):
+            watermark = (values['last_event_datetime'], int(values.get('last_event_number') or 0))
+        else:
+            cursor.execute('''
+                SELECT event_ts, MAX(CAST(event_number AS INTEGER))
+                FROM events
+                WHERE event_ts = (SELECT MAX(event_ts) FROM events)
+            ''')
+            row = cursor.fetchone()
+            if row and row[0] is not None:
+                watermark = (ts_to_datetime(row[0]).strftime("%Y-%m-%d %H:%M:%S"), row[1] or 0)
+
+        if close_conn:
+            conn.close()
+
+        return watermark
+
+    def update_event_watermark(self, watermark, cursor=None):
+        """Salva il watermark dell'ultimo evento importato in system_status"""
+        self.update_system_status('last_event_datetime', watermark[0], cursor)
+        self.update_system_status('last_event_number', str(watermark[1]), cursor)
+
+    def get_watermark_cutoff(self, watermark):
+        """Datetime ordinabile sotto cui gli eventi sono sicuramente già importati"""
+        if not watermark:
+            return ''
+        try:
+            mark_dt = datetime.strptime(watermark[0], "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            return ''
+        return (mark_dt - WATERMARK_OVERLAP).strftime("%Y-%m-%d %H:%M:%S")
+
+    def get_download_start_date(self, full_resync=False, days_back=FULL_RESYNC_DAYS, today=None):
+        """Primo giorno da chiedere al distributore (events2_query è per giorni, estremi inclusi)
+
+        Riparte dal giorno dell'ultimo evento importato (watermark) meno
+        DOWNLOAD_OVERLAP, anche se più vecchio di days_back per non lasciare
+        buchi. Senza eventi importati o con full_resync scarica gli ultimi days_back giorni.
+        """
+        today = today or datetime.now().date()
+        full_start = today - timedelta(days=days_back)
+        if full_resync:
+            return full_start
+
+        watermark = self.get_event_watermark()
+        if not watermark:
+            return full_start
+        try:
+            mark_dt = datetime.strptime(watermark[0], "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            return full_start
+        return min((mark_dt - DOWNLOAD_OVERLAP).date(), today)
+
+    def filter_by_watermark(self, events_list, cutoff):
+        """Scarta gli eventi sotto il watermark (meno il margine di sovrapposizione)
+
+        Gli eventi con dateTime non interpretabile vengono mantenuti e lasciati
+        alla deduplicazione del vincolo UNIQUE.
+        """
+        if not cutoff:
+            return list(events_list)
+
+        fresh_events = []
+        for event in events_list:
+            sort_value = event_datetime_sort_value(event.get('dateTime', ''))
+            if not sort_value or sort_value >= cutoff:
+                fresh_events.append(event)
+        return fresh_events
+
     def import_new_events_only(self, events_data):
         """Importa solo gli eventi non ancora presenti nel database"""
         # Estrai lista eventi dal payload
@@ -186,12 +1074,13 @@ class SalesAnalyzer:
             print("📝 Nessun evento trovato nel file")
             return []
 
-        # Ottieni eventi già presenti
-        existing_keys = self.get_existing_event_keys()
+        # Scarta subito gli eventi sotto il watermark, controlla solo la finestra di sovrapposizione
+        candidates = self.filter_by_watermark(events_list, self.get_watermark_cutoff(self.get_event_watermark()))
+        existing_keys = self.get_existing_event_keys([event.get('number', '') for event in candidates])
 
         # Filtra solo eventi nuovi
         new_events = []
-        for event in events_list:
+        for event in candidates:
             event_key = (event.get('number', ''), event.get('dateTime', ''))
             if event_key not in existing_keys:
                 new_events.append(event)
@@ -200,21 +1089,25 @@ class SalesAnalyzer:
         # in modo da poter aggiungere il transaction_id corretto
         return new_events
 
-    def get_last_incomplete_transaction(self):
+    def get_last_incomplete_transaction(self, cursor=None):
         """Ottiene l'ultima transazione incompleta dal database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        close_conn = False
+        if cursor is None:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            close_conn = True
 
         cursor.execute('''
             SELECT id, start_datetime, payment_method, total_paid, total_change, net_revenue
             FROM transactions
             WHERE is_complete = 0
-            ORDER BY start_datetime DESC
+            ORDER BY start_ts DESC
             LIMIT 1
         ''')
 
         result = cursor.fetchone()
-        conn.close()
+        if close_conn:
+            conn.close()
 
         if result:
             return {
@@ -235,46 +1128,24 @@ class SalesAnalyzer:
         event_text = event.get('text', '')
         return 'IMPRONTA VALIDA' in event_text or 'TESSERA VALIDA' in event_text
 
-    def build_transactions_from_new_events(self, new_events):
+    def build_transactions_from_new_events(self, new_events, batch=None):
         """Costruisce transazioni dai nuovi eventi con linking a transazioni incomplete"""
         if not new_events:
             return [], {}
 
-        # Cerca transazione incompleta esistente
-        current_transaction = self.get_last_incomplete_transaction()
-
         completed_transactions = []
         event_transaction_map = {}  # Mapping (event_number, dateTime) -> transaction_id
 
-        for event in new_events:
-            event_key = (event.get('number', ''), event.get('dateTime', ''))
+        def collect(transaction, transaction_id):
+            # Mappa tutti gli eventi della transazione al transaction_id
+            for tx_event in transaction['events']:
+                tx_event_key = (tx_event.get('number', ''), tx_event.get('dateTime', ''))
+                event_transaction_map[tx_event_key] = transaction_id
+            completed_transactions.append(transaction)
 
-            if self.is_transaction_start(event):
-                # Completa transazione precedente se esiste
-                if current_transaction:
-                    transaction_id = self.complete_transaction(current_transaction)
-                    # Mappa tutti gli eventi della transazione al transaction_id
-                    for tx_event in current_transaction['events']:
-                        tx_event_key = (tx_event.get('number', ''), tx_event.get('dateTime', ''))
-                        event_transaction_map[tx_event_key] = transaction_id
-                    completed_transactions.append(current_transaction)
-
-                # Inizia nuova transazione
-                current_transaction = self.start_new_transaction(event)
-
-            elif current_transaction:
-                # Aggiungi evento alla transazione corrente
-                self.add_event_to_transaction(current_transaction, event)
-
-        # Se rimane una transazione aperta, salva quella parziale
-        if current_transaction:
-            if current_transaction.get('id') is None and current_transaction.get('sales'):
-                # Solo se è una nuova transazione con vendite
-                transaction_id = self.complete_transaction(current_transaction)
-                for tx_event in current_transaction['events']:
-                    tx_event_key = (tx_event.get('number', ''), tx_event.get('dateTime', ''))
-                    event_transaction_map[tx_event_key] = transaction_id
-                completed_transactions.append(current_transaction)
+        builder = TransactionBuilder(self, batch, collect)
+        builder.feed(new_events)
+        builder.finish()
 
         return completed_transactions, event_transaction_map
 
@@ -315,80 +1186,31 @@ class SalesAnalyzer:
             if resto_info:
                 transaction['total_change'] += resto_info['amount']
 
-    def complete_transaction(self, transaction):
+    def complete_transaction(self, transaction, batch=None):
         """Completa una transazione salvandola o aggiornandola nel database"""
         if not transaction['sales']:
             return None  # Salta transazioni senza vendite
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # Determina metodo di pagamento e ricavo netto
-        payment_method = self.determine_payment_method(transaction['payments'])
-        net_revenue = transaction['total_paid'] - transaction['total_change']
-
-        if transaction.get('id'):
-            # Aggiorna transazione esistente
-            cursor.execute('''
-                UPDATE transactions
-                SET end_datetime = ?, payment_method = ?, total_paid = ?,
-                    total_change = ?, net_revenue = ?, is_complete = 1
-                WHERE id = ?
-            ''', (
-                transaction.get('end_datetime', transaction['start_datetime']),
-                payment_method,
-                transaction['total_paid'],
-                transaction['total_change'],
-                net_revenue,
-                transaction['id']
-            ))
-            transaction_id = transaction['id']
-        else:
-            # Crea nuova transazione
-            cursor.execute('''
-                INSERT INTO transactions
-                (start_datetime, end_datetime, payment_method, total_paid, total_change, net_revenue, is_complete)
-                VALUES (?, ?, ?, ?, ?, ?, 1)
-            ''', (
-                transaction['start_datetime'],
-                transaction.get('end_datetime', transaction['start_datetime']),
-                payment_method,
-                transaction['total_paid'],
-                transaction['total_change'],
-                net_revenue
-            ))
-            transaction_id = cursor.lastrowid
-
-        # Salva vendite collegate
-        new_sales = 0
-        for sale in transaction['sales']:
-            brand_name = self.extract_brand_from_product(sale['product_name'])
-            brand_id = self.get_or_create_brand(brand_name, cursor)
+        # Senza batch esterno la transazione viene scritta e confermata subito
+        own_batch = batch is None
+        if own_batch:
+            batch = IngestBatch(self)
 
-            # Controlla se vendita già esiste
-            cursor.execute('''
-                SELECT COUNT(*) FROM sales
-                WHERE motor_id = ? AND sale_datetime = ? AND event_number = ?
-            ''', (sale['motor_id'], sale['sale_datetime'], sale['event_number']))
-
-            if cursor.fetchone()[0] == 0:
-                cursor.execute('''
-                    INSERT INTO sales
-                    (motor_id, product_name, price, sale_datetime, event_number,
-                     transaction_id, brand_id, payment_method)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    sale['motor_id'], sale['product_name'], sale['price'],
-                    sale['sale_datetime'], sale['event_number'],
-                    transaction_id, brand_id, payment_method
-                ))
-                new_sales += 1
+        transaction_id = batch.add_transaction(transaction)
+        batch.add_basket(transaction, transaction_id)
 
-        conn.commit()
-        conn.close()
+        if own_batch:
+            batch.commit()
 
         return transaction_id
 
+    def parse_event_datetime(self, datetime_str):
+        """Converte il dateTime del distributore ("17/09/25 19:14:15") in datetime"""
+        try:
+            return datetime.strptime(datetime_str, "%d/%m/%y %H:%M:%S")
+        except (TypeError, ValueError):
+            return None
+
     def parse_sale_event(self, event):
         """Estrae informazioni di vendita da un evento"""
         text = event.get('text', '')
@@ -456,44 +1278,560 @@ class SalesAnalyzer:
 
         return new_sales
 
-    def update_motor_stats(self):
-        """Aggiorna le statistiche dei motori"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def update_motor_stats(self, cursor=None, after_sale_id=None):
+        """Aggiorna le statistiche dei motori
+
+        Con after_sale_id considera solo le vendite con id maggiore (quelle appena
+        importate) e le somma ai totali esistenti; senza, ricalcola tutto da sales.
+        Prodotto e prezzo sono quelli della vendita più recente del motore; le
+        altre colonne di motors (es. position) non vengono toccate.
+        """
+        close_conn = False
+        if cursor is None:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            close_conn = True
+
+        if after_sale_id is None:
+            total_sales = 'excluded.total_sales'
+            is_newer = '1'
+        else:
+            total_sales = 'motors.total_sales + excluded.total_sales'
+            is_newer = ('motors.last_sale_datetime IS NULL '
+                        'OR excluded.last_sale_datetime >= motors.last_sale_datetime')
+
+        # Con MAX() SQLite prende product_name e price dalla riga con la vendita più recente
+        cursor.execute(f'''
+            INSERT INTO motors
+            (motor_id, product_name, price, last_sale_datetime, total_sales, position)
+            SELECT motor_id, product_name, price, MAX(sale_datetime), COUNT(*), 'M' || motor_id
+            FROM sales
+            WHERE id > ? AND motor_id IS NOT NULL
+            GROUP BY motor_id
+            ON CONFLICT(motor_id) DO UPDATE SET
+                product_name = CASE WHEN {is_newer} THEN excluded.product_name ELSE motors.product_name END,
+                price = CASE WHEN {is_newer} THEN excluded.price ELSE motors.price END,
+                last_sale_datetime = CASE WHEN {is_newer}
+                    THEN excluded.last_sale_datetime ELSE motors.last_sale_datetime END,
+                total_sales = {total_sales},
+                last_updated = CURRENT_TIMESTAMP
+        ''', (after_sale_id or 0,))
+
+        if close_conn:
+            conn.commit()
+            conn.close()
+
+    def update_motor_daily_stats(self, cursor, after_sale_id=None):
+        """Aggiorna motor_daily_stats (motore x giorno: vendite, incasso, prima e ultima vendita)
+
+        Con after_sale_id somma solo le vendite con id maggiore; senza, ricostruisce la tabella.
+        """
+        if after_sale_id is None:
+            cursor.execute('DELETE FROM motor_daily_stats')
+
+        cursor.execute('''
+            INSERT INTO motor_daily_stats (motor_id, day, sales_count, revenue, first_sale, last_sale)
+            SELECT motor_id, substr(sale_datetime, 1, 10), COUNT(*), SUM(price),
+                   MIN(sale_datetime), MAX(sale_datetime)
+            FROM sales
+            WHERE id > ? AND motor_id IS NOT NULL AND sale_datetime IS NOT NULL
+            GROUP BY motor_id, substr(sale_datetime, 1, 10)
+            ON CONFLICT(motor_id, day) DO UPDATE SET
+                sales_count = motor_daily_stats.sales_count + excluded.sales_count,
+                revenue = motor_daily_stats.revenue + excluded.revenue,
+                first_sale = MIN(motor_daily_stats.first_sale, excluded.first_sale),
+                last_sale = MAX(motor_daily_stats.last_sale, excluded.last_sale)
+        ''', (after_sale_id or 0,))
+
+    def update_motor_interval_stats(self, cursor, after_sale_id=None):
+        """Aggiorna motor_interval_stats con gli intervalli introdotti dalle vendite con id > after_sale_id
+
+        Le vendite successive all'ultima già contata aggiornano i valori in O(1)
+        ciascuna. Se un import porta vendite più vecchie dell'ultima (es. recupero
+        di un periodo mancante) il motore viene ricalcolato da tutte le sue vendite.
+        Gli stessi intervalli vanno negli sketch giornalieri di motor_interval_sketches.
+        Senza after_sale_id ricostruisce le tabelle.
+        """
+        if after_sale_id is None:
+            cursor.execute('DELETE FROM motor_interval_stats')
+            cursor.execute('DELETE FROM motor_interval_sketches')
+
+        cursor.execute('''
+            SELECT motor_id, sale_datetime FROM sales
+            WHERE id > ? AND motor_id IS NOT NULL AND sale_datetime IS NOT NULL
+            ORDER BY motor_id, sale_datetime
+        ''', (after_sale_id or 0,))
+        new_sales = defaultdict(list)
+        for motor_id, sale_datetime in cursor.fetchall():
+            new_sales[motor_id].append(sale_datetime)
+        if not new_sales:
+            return
+
+        existing = {}
+        for motor_ids in iter_chunks(list(new_sales), 500):
+            placeholders = ','.join('?' * len(motor_ids))
+            cursor.execute(f'''
+                SELECT motor_id, sales_count, mean_interval, m2_interval, first_sale, last_sale
+                FROM motor_interval_stats WHERE motor_id IN ({placeholders})
+            ''', motor_ids)
+            existing.update((row[0], row[1:]) for row in cursor.fetchall())
+
+        rows = []
+        sketch_intervals = defaultdict(list)
+        for motor_id, sale_datetimes in new_sales.items():
+            count, mean, m2, first_sale, last_sale = existing.get(motor_id, (0, 0.0, 0.0, None, None))
+            if last_sale is not None and sale_datetimes[0] < last_sale:
+                # Vendite fuori ordine: ricalcolo completo del motore
+                cursor.execute('''
+                    SELECT sale_datetime FROM sales
+                    WHERE motor_id = ? AND sale_datetime IS NOT NULL
+                    ORDER BY sale_datetime
+                ''', (motor_id,))
+                sale_datetimes = [row[0] for row in cursor.fetchall()]
+                count, mean, m2, first_sale, last_sale = 0, 0.0, 0.0, None, None
+                cursor.execute('DELETE FROM motor_interval_sketches WHERE motor_id = ?', (motor_id,))
+
+            intervals = count - 1 if count else 0
+            last_ts = sale_datetime_to_ts(last_sale) if last_sale else None
+            for sale_datetime in sale_datetimes:
+                sale_ts = sale_datetime_to_ts(sale_datetime)
+                if last_ts is not None:
+                    intervals, mean, m2 = welford_update(intervals, mean, m2, sale_ts - last_ts)
+                    sketch_intervals[(motor_id, sale_datetime[:10])].append((sale_ts - last_ts) / 3600)
+                last_ts = sale_ts
+                count += 1
+            rows.append((motor_id, count, mean, m2, first_sale or sale_datetimes[0], sale_datetimes[-1]))
+
+        cursor.executemany('''
+            INSERT OR REPLACE INTO motor_interval_stats
+            (motor_id, sales_count, mean_interval, m2_interval, first_sale, last_sale)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+        self.add_interval_sketches(cursor, sketch_intervals)
+
+    def update_motor_hourly_profile(self, cursor, after_sale_id=None):
+        """Aggiorna motor_hourly_profile (vendite e incasso per motore, giorno della settimana e ora)
+
+        Con after_sale_id somma solo le vendite con id maggiore; senza, ricostruisce la tabella.
+        """
+        if after_sale_id is None:
+            cursor.execute('DELETE FROM motor_hourly_profile')
 
-        # Aggiorna statistiche per ogni motore
         cursor.execute('''
-            SELECT motor_id, product_name, price,
-                   MAX(sale_datetime) as last_sale,
-                   COUNT(*) as total_sales
+            INSERT INTO motor_hourly_profile (motor_id, weekday, hour, sales_count, revenue)
+            SELECT motor_id,
+                   CAST(strftime('%w', sale_datetime) AS INTEGER),
+                   CAST(strftime('%H', sale_datetime) AS INTEGER),
+                   COUNT(*),
+                   COALESCE(SUM(price), 0)
             FROM sales
-            GROUP BY motor_id, product_name, price
+            WHERE id > ? AND motor_id IS NOT NULL AND sale_datetime IS NOT NULL
+            GROUP BY 1, 2, 3
+            ON CONFLICT(motor_id, weekday, hour) DO UPDATE SET
+                sales_count = motor_hourly_profile.sales_count + excluded.sales_count,
+                revenue = motor_hourly_profile.revenue + excluded.revenue
+        ''', (after_sale_id or 0,))
+
+    def update_sales_period_stats(self, cursor, after_sale_id=None):
+        """Aggiorna sales_hourly_stats e sales_daily_stats (periodo x motore x prodotto x marca x pagamento)
+
+        Con after_sale_id somma solo le vendite con id maggiore; senza, ricostruisce le tabelle.
+        """
+        for table, period_column, period_length in (('sales_hourly_stats', 'hour', 13),
+                                                    ('sales_daily_stats', 'day', 10)):
+            if after_sale_id is None:
+                cursor.execute(f'DELETE FROM {table}')
+
+            cursor.execute(f'''
+                INSERT INTO {table}
+                    ({period_column}, motor_id, product_name, brand_id, payment_method, sales_count, revenue)
+                SELECT substr(sale_datetime, 1, {period_length}), COALESCE(motor_id, 0),
+                       COALESCE(TRIM(product_name), ''), COALESCE(brand_id, 0), COALESCE(payment_method, ''),
+                       COUNT(*), COALESCE(SUM(price), 0)
+                FROM sales
+                WHERE id > ? AND sale_datetime IS NOT NULL
+                GROUP BY 1, 2, 3, 4, 5
+                ON CONFLICT({period_column}, motor_id, product_name, brand_id, payment_method) DO UPDATE SET
+                    sales_count = {table}.sales_count + excluded.sales_count,
+                    revenue = {table}.revenue + excluded.revenue
+            ''', (after_sale_id or 0,))
+
+    def update_transaction_daily_stats(self, cursor, since_ts=None):
+        """Ricalcola transactions_daily_stats dal giorno di since_ts in poi (tutta la tabella senza)
+
+        Le transazioni rimaste incomplete vengono aggiornate dagli import successivi,
+        quindi i giorni toccati si ricalcolano invece di sommare.
+        """
+        params = []
+        where_clause = 'WHERE start_ts IS NOT NULL'
+        if since_ts is None:
+            cursor.execute('DELETE FROM transactions_daily_stats')
+        else:
+            day_start_ts = since_ts - since_ts % 86400
+            cursor.execute("DELETE FROM transactions_daily_stats WHERE day >= date(?, 'unixepoch')", (day_start_ts,))
+            where_clause += ' AND start_ts >= ?'
+            params.append(day_start_ts)
+
+        cursor.execute(f'''
+            INSERT INTO transactions_daily_stats (day, payment_method, transactions_count, net_revenue)
+            SELECT date(start_ts, 'unixepoch'), COALESCE(payment_method, ''), COUNT(*), COALESCE(SUM(net_revenue), 0)
+            FROM transactions
+            {where_clause}
+            GROUP BY 1, 2
+        ''', params)
+
+    def update_transaction_sketches(self, cursor, since_ts=None):
+        """Ricalcola transaction_value_sketches dal giorno di since_ts in poi (tutta la tabella senza)
+
+        Un TDigest per giorno e colonna di TRANSACTION_SKETCH_METRICS; come per
+        transactions_daily_stats i giorni toccati si ricalcolano dalle transazioni.
+        """
+        params = []
+        where_clause = 'WHERE start_ts IS NOT NULL'
+        if since_ts is None:
+            cursor.execute('DELETE FROM transaction_value_sketches')
+        else:
+            day_start_ts = since_ts - since_ts % 86400
+            cursor.execute("DELETE FROM transaction_value_sketches WHERE day >= date(?, 'unixepoch')",
+                           (day_start_ts,))
+            where_clause += ' AND start_ts >= ?'
+            params.append(day_start_ts)
+
+        cursor.execute(f'''
+            SELECT date(start_ts, 'unixepoch'), {', '.join(TRANSACTION_SKETCH_METRICS)}
+            FROM transactions
+            {where_clause}
+            ORDER BY start_ts
+        ''', params)
+
+        rows = []
+        for day, day_rows in groupby(cursor.fetchall(), key=lambda row: row[0]):
+            day_rows = list(day_rows)
+            for index, metric in enumerate(TRANSACTION_SKETCH_METRICS, start=1):
+                digest = TDigest().update(row[index] for row in day_rows if row[index] is not None)
+                if digest.count:
+                    rows.append((day, metric, int(digest.count), digest.to_bytes()))
+
+        cursor.executemany('''
+            INSERT INTO transaction_value_sketches (day, metric, value_count, sketch) VALUES (?, ?, ?, ?)
+        ''', rows)
+
+    def add_interval_sketches(self, cursor, intervals):
+        """Aggiunge intervalli (ore) agli sketch di motor_interval_sketches
+
+        intervals: {(motor_id, giorno): [intervalli]}; gli sketch esistenti vengono
+        letti, uniti ai nuovi valori e riscritti.
+        """
+        rows = []
+        for (motor_id, day), values in intervals.items():
+            cursor.execute('''
+                SELECT sketch FROM motor_interval_sketches WHERE motor_id = ? AND day = ?
+            ''', (motor_id, day))
+            existing = cursor.fetchone()
+            digest = TDigest.from_bytes(existing[0]) if existing else TDigest()
+            digest.update(values)
+            rows.append((motor_id, day, int(digest.count), digest.to_bytes()))
+
+        cursor.executemany('''
+            INSERT OR REPLACE INTO motor_interval_sketches (motor_id, day, interval_count, sketch)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
+
+    def update_basket_stats(self, cursor):
+        """Ricostruisce le tabelle basket_* dalle vendite delle transazioni complete
+
+        All'import i carrelli vengono contati in complete_transaction.
+        """
+        for table in ('basket_size_daily_stats', 'basket_product_daily_stats', 'basket_pair_daily_stats'):
+            cursor.execute(f'DELETE FROM {table}')
+
+        cursor.execute('''
+            SELECT t.id, date(t.start_ts, 'unixepoch'), s.product_name, s.price
+            FROM transactions t
+            JOIN sales s ON s.transaction_id = t.id
+            WHERE t.is_complete = 1 AND t.start_ts IS NOT NULL
+            ORDER BY t.id
         ''')
+        baskets = BasketCounts()
+        for _, rows in groupby(cursor.fetchall(), key=lambda row: row[0]):
+            rows = list(rows)
+            baskets.add(rows[0][1], [(product_name, price) for _, _, product_name, price in rows])
+        baskets.write(cursor)
+
+    def update_sales_rollups(self, cursor, after_sale_id=None):
+        """Aggiorna tutte le tabelle derivate da sales con le vendite con id > after_sale_id"""
+        self.update_motor_stats(cursor, after_sale_id=after_sale_id)
+        self.update_motor_daily_stats(cursor, after_sale_id=after_sale_id)
+        self.update_motor_interval_stats(cursor, after_sale_id=after_sale_id)
+        self.update_motor_hourly_profile(cursor, after_sale_id=after_sale_id)
+        self.update_sales_period_stats(cursor, after_sale_id=after_sale_id)
+
+    def parse_stockout_event(self, event):
+        """Motore indicato da un'email "prodotto esaurito", None per gli altri eventi"""
+        if event.get('type') != 'EMAIL':
+            return None
+        match = STOCKOUT_PATTERN.search(event.get('text', ''))
+        return int(match.group(1)) if match else None
 
-        motors_data = cursor.fetchall()
+    def update_stock_events(self, cursor, after_event_id=0):
+        """Registra esaurimenti e finestre di programmazione dagli eventi con id > after_event_id
+
+        Restituisce (motori con nuovi esaurimenti, True se si è chiusa una finestra di ricarica).
+        """
+        cursor.execute('''
+            SELECT id, event_type, event_text, event_ts, event_number
+            FROM events
+            WHERE id > ? AND event_type IN ('EMAIL', 'PROGRAMMAZIONE')
+            ORDER BY event_ts, CAST(event_number AS INTEGER)
+        ''', (after_event_id,))
+        rows = cursor.fetchall()
+
+        # Finestra rimasta aperta da un import precedente
+        cursor.execute('SELECT id FROM refill_windows WHERE end_datetime IS NULL ORDER BY start_datetime DESC LIMIT 1')
+        open_window = cursor.fetchone()
+        open_window_id = open_window[0] if open_window else None
+
+        stockout_motors = set()
+        refill_closed = False
+        for event_id, event_type, text, event_ts, _ in rows:
+            if event_ts is None:
+                continue
+            event_datetime = ts_to_datetime(event_ts).strftime("%Y-%m-%d %H:%M:%S")
+            upper_text = text.upper()
 
-        for motor_id, product_name, price, last_sale, total_sales in motors_data:
+            motor_id = self.parse_stockout_event({'type': event_type, 'text': text})
+            if motor_id is not None:
+                cursor.execute('''
+                    INSERT OR IGNORE INTO motor_stockouts (motor_id, stockout_datetime, event_id)
+                    VALUES (?, ?, ?)
+                ''', (motor_id, event_datetime, event_id))
+                stockout_motors.add(motor_id)
+            elif event_type != 'PROGRAMMAZIONE':
+                continue
+            elif upper_text.startswith('INGRESSO') and 'PROGRAMMAZIONE' in upper_text:
+                if open_window_id is None:
+                    cursor.execute('''
+                        INSERT OR IGNORE INTO refill_windows (start_datetime, start_event_id) VALUES (?, ?)
+                    ''', (event_datetime, event_id))
+                    open_window_id = cursor.lastrowid
+            elif upper_text.startswith('USCITA PROGRAMMAZIONE') and open_window_id is not None:
+                cursor.execute('''
+                    UPDATE refill_windows SET end_datetime = ?, end_event_id = ? WHERE id = ?
+                ''', (event_datetime, event_id, open_window_id))
+                open_window_id = None
+                refill_closed = True
+
+        return stockout_motors, refill_closed
+
+    def update_motor_stock(self, cursor, after_event_id=None, after_sale_id=None):
+        """Aggiorna esaurimenti, finestre di ricarica e motor_stock
+
+        Con after_event_id/after_sale_id elabora solo i nuovi eventi e ricalcola i
+        motori con nuove vendite o nuovi esaurimenti; se si chiude una finestra di
+        ricarica (o senza argomenti) ricalcola tutti i motori.
+        Restituisce l'insieme dei motori ricalcolati.
+        """
+        if after_event_id is None:
+            cursor.execute('DELETE FROM motor_stockouts')
+            cursor.execute('DELETE FROM refill_windows')
+            after_event_id = 0
+
+        stockout_motors, refill_closed = self.update_stock_events(cursor, after_event_id)
+
+        if after_sale_id is not None and not refill_closed:
+            cursor.execute('SELECT DISTINCT motor_id FROM sales WHERE id > ?', (after_sale_id,))
+            motor_ids = stockout_motors | {row[0] for row in cursor.fetchall() if row[0] is not None}
+        else:
+            cursor.execute('DELETE FROM motor_stock')
+            cursor.execute('SELECT motor_id FROM motors UNION SELECT motor_id FROM motor_stockouts')
+            motor_ids = {row[0] for row in cursor.fetchall()}
+
+        if motor_ids:
+            self.refresh_motor_stock(cursor, sorted(motor_ids))
+        return motor_ids
+
+    def refresh_motor_stock(self, cursor, motor_ids):
+        """Ricalcola motor_stock e le capacità stimate degli esaurimenti dei motori indicati
+
+        Il distributore non registra quali motori vengono riforniti: un motore si
+        considera ricaricato alla prima finestra di programmazione chiusa dopo il suo
+        esaurimento, e finché non ne ha avuti il conteggio parte dalla prima finestra
+        registrata. La capacità stimata è la media delle unità vendute tra una
+        ricarica e l'esaurimento successivo; le notifiche ripetute senza ricarica in
+        mezzo non contano. I conteggi sono ricerche su idx_sales_motor_datetime.
+        """
+        cursor.execute('''
+            SELECT end_datetime FROM refill_windows
+            WHERE end_datetime IS NOT NULL ORDER BY end_datetime
+        ''')
+        refills = [row[0] for row in cursor.fetchall()]
+
+        def next_refill(after):
+            index = bisect.bisect_right(refills, after)
+            return refills[index] if index < len(refills) else None
+
+        def count_sales(motor_id, start, end=None):
+            query = 'SELECT COUNT(*) FROM sales WHERE motor_id = ? AND sale_datetime >= ?'
+            params = [motor_id, start]
+            if end is not None:
+                query += ' AND sale_datetime <= ?'
+                params.append(end)
+            cursor.execute(query, params)
+            return cursor.fetchone()[0]
+
+        for motor_id in motor_ids:
             cursor.execute('''
-                INSERT OR REPLACE INTO motors
-                (motor_id, product_name, price, last_sale_datetime, total_sales)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (motor_id, product_name, price, last_sale, total_sales))
+                SELECT id, stockout_datetime FROM motor_stockouts
+                WHERE motor_id = ? ORDER BY stockout_datetime
+            ''', (motor_id,))
+            stockouts = cursor.fetchall()
+
+            capacities = []
+            previous = None
+            for stockout_id, stockout_datetime in stockouts:
+                units = None
+                refill = next_refill(previous) if previous else None
+                if refill and refill <= stockout_datetime:
+                    units = count_sales(motor_id, refill, stockout_datetime)
+                    capacities.append(units)
+                cursor.execute('UPDATE motor_stockouts SET units_since_refill = ? WHERE id = ?',
+                               (units, stockout_id))
+                previous = stockout_datetime
+
+            if stockouts:
+                # Senza finestre dopo l'ultimo esaurimento il motore è ancora vuoto
+                last_refill = next_refill(previous)
+                sold_since_refill = count_sales(motor_id, last_refill or previous)
+            else:
+                last_refill = refills[0] if refills else None
+                sold_since_refill = count_sales(motor_id, last_refill or '')
+
+            cursor.execute('''
+                INSERT OR REPLACE INTO motor_stock
+                    (motor_id, last_refill, sold_since_refill, last_stockout, stockout_count, estimated_capacity)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (motor_id, last_refill, sold_since_refill, previous, len(stockouts),
+                  round(sum(capacities) / len(capacities)) if capacities else None))
+
+    def get_sales_heatmap(self, motor_id=None):
+        """Matrici 24x7 di vendite e incasso per ora del giorno e giorno della settimana
+
+        Lette da motor_hourly_profile (aggiornata a ogni import), per un motore o
+        sommate su tutti i motori. Righe = ore 0-23, colonne = giorni da domenica
+        (0, come strftime('%w')) a sabato.
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        if motor_id is None:
+            cursor.execute('''
+                SELECT hour, weekday, SUM(sales_count), SUM(revenue)
+                FROM motor_hourly_profile
+                GROUP BY hour, weekday
+            ''')
+        else:
+            cursor.execute('''
+                SELECT hour, weekday, sales_count, revenue
+                FROM motor_hourly_profile
+                WHERE motor_id = ?
+            ''', (motor_id,))
+
+        sales_count = [[0] * 7 for _ in range(24)]
+        revenue = [[0.0] * 7 for _ in range(24)]
+        for hour, weekday, count, amount in cursor.fetchall():
+            sales_count[hour][weekday] = count
+            revenue[hour][weekday] = round(amount, 2)
 
-        conn.commit()
         conn.close()
 
-    def update_system_status(self, key, value):
-        """Aggiorna lo stato del sistema"""
+        total_sales = sum(map(sum, sales_count))
+        peak = None
+        if total_sales:
+            peak_hour, peak_weekday = max(((hour, weekday) for hour in range(24) for weekday in range(7)),
+                                          key=lambda cell: sales_count[cell[0]][cell[1]])
+            peak = {'hour': peak_hour, 'weekday': peak_weekday,
+                    'sales_count': sales_count[peak_hour][peak_weekday]}
+
+        return {
+            'motor_id': motor_id,
+            'weekdays': ['Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat'],
+            'hours': list(range(24)),
+            'sales_count': sales_count,
+            'revenue': revenue,
+            'total_sales': total_sales,
+            'total_revenue': round(sum(map(sum, revenue)), 2),
+            'peak': peak
+        }
+
+    def get_motor_stock(self):
+        """Scorte per motore, dai motori che si esauriranno prima
+
+        Per ogni motore: ultima ricarica, unità vendute da allora, ultimo
+        esaurimento e capacità stimata (unità vendute tra ricarica ed esaurimento),
+        da cui le unità residue stimate. I motori già esauriti dopo l'ultima
+        ricarica sono in testa.
+        """
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
 
+        cursor.execute('''
+            SELECT st.motor_id, m.position, m.product_name, st.last_refill, st.sold_since_refill,
+                   st.last_stockout, st.stockout_count, st.estimated_capacity
+            FROM motor_stock st
+            LEFT JOIN motors m ON m.motor_id = st.motor_id
+        ''')
+
+        motors = []
+        for row in cursor.fetchall():
+            motor_id, position, product_name, last_refill, sold, last_stockout, stockout_count, capacity = row
+            is_empty = bool(last_stockout) and last_refill is None
+            if is_empty:
+                remaining = 0
+            elif capacity:
+                remaining = max(capacity - sold, 0)
+            else:
+                remaining = None
+            motors.append({
+                'motor_id': motor_id,
+                'position': position or f"M{motor_id}",
+                'product_name': product_name,
+                'last_refill': last_refill,
+                'sold_since_refill': sold,
+                'last_stockout': last_stockout,
+                'stockout_count': stockout_count,
+                'estimated_capacity': capacity,
+                'estimated_remaining': remaining,
+                'is_empty': is_empty
+            })
+
+        conn.close()
+
+        # Prima i motori esauriti, poi per unità residue stimate, poi per vendite dalla ricarica
+        motors.sort(key=lambda motor: (
+            not motor['is_empty'],
+            motor['estimated_remaining'] is None,
+            motor['estimated_remaining'] or 0,
+            -motor['sold_since_refill'],
+            motor['motor_id']
+        ))
+        return motors
+
+    def update_system_status(self, key, value, cursor=None):
+        """Aggiorna lo stato del sistema"""
+        close_conn = False
+        if cursor is None:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            close_conn = True
+
         cursor.execute('''
             INSERT OR REPLACE INTO system_status (key, value, updated_at)
             VALUES (?, ?, CURRENT_TIMESTAMP)
         ''', (key, value))
 
-        conn.commit()
-        conn.close()
+        if close_conn:
+            conn.commit()
+            conn.close()
 
     def get_system_status(self, key):
         """Ottiene lo stato del sistema"""
@@ -548,11 +1886,11 @@ class SalesAnalyzer:
             })
 
         # Statistiche generali
-        cursor.execute('SELECT COUNT(*) FROM sales WHERE DATE(sale_datetime) = DATE("now")')
-        today_sales = cursor.fetchone()[0]
-
-        cursor.execute('SELECT SUM(price) FROM sales WHERE DATE(sale_datetime) = DATE("now")')
-        today_revenue = cursor.fetchone()[0] or 0
+        today = datetime.now().strftime("%Y-%m-%d")
+        conditions, params = sale_datetime_conditions(today, today)
+        cursor.execute(f'SELECT COUNT(*), SUM(price) FROM sales WHERE {" AND ".join(conditions)}', params)
+        today_sales, today_revenue = cursor.fetchone()
+        today_revenue = today_revenue or 0
 
 
         # Ottieni timestamp ultimo download
@@ -598,13 +1936,14 @@ class SalesAnalyzer:
 
                 cursor.execute('''
                     INSERT OR IGNORE INTO events
-                    (event_number, event_code, event_type, event_datetime, event_text, transaction_id)
-                    VALUES (?, ?, ?, ?, ?, ?)
+                    (event_number, event_code, event_type, event_datetime, event_ts, event_text, transaction_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
                 ''', (
                     event.get('number', ''),
                     event.get('code', ''),
                     event.get('type', ''),
                     event.get('dateTime', ''),
+                    event_datetime_to_ts(event.get('dateTime', '')),
                     event.get('text', ''),
                     transaction_id
                 ))
@@ -800,13 +2139,17 @@ class SalesAnalyzer:
             net_revenue = transaction['total_paid'] - transaction['total_change']
 
             # Salva transazione
+            end_datetime = transaction.get('end_datetime', transaction['start_datetime'])
             cursor.execute('''
                 INSERT INTO transactions
-                (start_datetime, end_datetime, payment_method, total_paid, total_change, net_revenue, is_complete)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
+                (start_datetime, start_ts, end_datetime, end_ts, payment_method,
+                 total_paid, total_change, net_revenue, is_complete)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (
                 transaction['start_datetime'],
-                transaction.get('end_datetime', transaction['start_datetime']),
+                event_datetime_to_ts(transaction['start_datetime']),
+                end_datetime,
+                event_datetime_to_ts(end_datetime),
                 payment_method,
                 transaction['total_paid'],
                 transaction['total_change'],
@@ -858,35 +2201,24 @@ class SalesAnalyzer:
         return "CASH"
 
     def get_statistics_overview(self, date_from=None, date_to=None):
-        """Ottiene statistiche generali con filtri opzionali"""
+        """Ottiene statistiche generali con filtri opzionali (dagli aggregati giornalieri)"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
 
-        where_clause = ""
-        params = []
-
-        if date_from or date_to:
-            conditions = []
-            if date_from:
-                conditions.append("DATE(sale_datetime) >= ?")
-                params.append(date_from)
-            if date_to:
-                conditions.append("DATE(sale_datetime) <= ?")
-                params.append(date_to)
-            where_clause = "WHERE " + " AND ".join(conditions)
+        conditions, params = sale_datetime_conditions(date_from, date_to, column='day')
+        where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
 
         # Totali generali
-        cursor.execute(f'SELECT COUNT(*), SUM(price) FROM sales {where_clause}', params)
+        cursor.execute(f'SELECT SUM(sales_count), SUM(revenue) FROM sales_daily_stats {where_clause}', params)
         result = cursor.fetchone()
         total_sales = result[0] or 0
         total_revenue = result[1] or 0
 
         # Statistiche per metodo pagamento dalle transazioni
-        trans_where = where_clause.replace('sale_datetime', 'start_datetime') if where_clause else ""
         cursor.execute(f'''
-            SELECT payment_method, COUNT(*), SUM(net_revenue)
-            FROM transactions
-            {trans_where}
+            SELECT NULLIF(payment_method, ''), SUM(transactions_count), SUM(net_revenue)
+            FROM transactions_daily_stats
+            {where_clause}
             GROUP BY payment_method
         ''', params)
 
@@ -906,41 +2238,42 @@ class SalesAnalyzer:
             'payment_methods': payment_stats
         }
 
-    def get_statistics_by_brand(self, date_from=None, date_to=None):
-        """Ottiene statistiche dettagliate per marca"""
+    def get_sales_breakdown(self, group_expression, join_clause='', date_from=None, date_to=None):
+        """Vendite e incasso per gruppo da sales_daily_stats, con le percentuali sul totale del periodo
+
+        Restituisce (gruppo, quantità, incasso, prezzo medio, % vendite, % incasso) ordinati per
+        incasso; i totali del periodo sono funzioni finestra sullo stesso raggruppamento.
+        """
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
 
-        where_clause = ""
-        params = []
-
-        if date_from or date_to:
-            conditions = []
-            if date_from:
-                conditions.append("DATE(s.sale_datetime) >= ?")
-                params.append(date_from)
-            if date_to:
-                conditions.append("DATE(s.sale_datetime) <= ?")
-                params.append(date_to)
-            where_clause = "WHERE " + " AND ".join(conditions)
+        conditions, params = sale_datetime_conditions(date_from, date_to, column='d.day')
+        where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
 
         cursor.execute(f'''
             SELECT
-                pb.brand_name,
-                COUNT(*) as quantity,
-                SUM(s.price) as revenue,
-                AVG(s.price) as avg_price,
-                ROUND(COUNT(*) * 100.0 / (SELECT COUNT(*) FROM sales s2 {where_clause.replace('s.', 's2.')}), 2) as sales_percentage,
-                ROUND(SUM(s.price) * 100.0 / (SELECT SUM(price) FROM sales s3 {where_clause.replace('s.', 's3.')}), 2) as revenue_percentage
-            FROM sales s
-            LEFT JOIN product_brands pb ON s.brand_id = pb.id
+                {group_expression},
+                SUM(d.sales_count) as quantity,
+                SUM(d.revenue) as revenue,
+                SUM(d.revenue) / SUM(d.sales_count) as avg_price,
+                ROUND(SUM(d.sales_count) * 100.0 / SUM(SUM(d.sales_count)) OVER (), 2) as sales_percentage,
+                ROUND(SUM(d.revenue) * 100.0 / SUM(SUM(d.revenue)) OVER (), 2) as revenue_percentage
+            FROM sales_daily_stats d
+            {join_clause}
             {where_clause}
-            GROUP BY pb.brand_name
+            GROUP BY 1
             ORDER BY revenue DESC
-        ''', params + params + params)
+        ''', params)
 
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+
+    def get_statistics_by_brand(self, date_from=None, date_to=None):
+        """Ottiene statistiche dettagliate per marca"""
         brands_stats = []
-        for row in cursor.fetchall():
+        for row in self.get_sales_breakdown('pb.brand_name', 'LEFT JOIN product_brands pb ON d.brand_id = pb.id',
+                                            date_from, date_to):
             brands_stats.append({
                 'brand_name': row[0] or 'UNKNOWN',
                 'quantity': row[1],
@@ -950,44 +2283,12 @@ class SalesAnalyzer:
                 'revenue_percentage': row[5] or 0
             })
 
-        conn.close()
         return brands_stats
 
     def get_statistics_by_package_type(self, date_from=None, date_to=None):
         """Ottiene statistiche dettagliate per tipologia di pacchetto (product_name)"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        conditions = []
-        params = []
-
-        if date_from:
-            conditions.append("DATE(s.sale_datetime) >= ?")
-            params.append(date_from)
-        if date_to:
-            conditions.append("DATE(s.sale_datetime) <= ?")
-            params.append(date_to)
-
-        where_clause = ""
-        if conditions:
-            where_clause = "WHERE " + " AND ".join(conditions)
-
-        cursor.execute(f'''
-            SELECT
-                TRIM(s.product_name) as package_type,
-                COUNT(*) as quantity,
-                SUM(s.price) as revenue,
-                AVG(s.price) as avg_price,
-                ROUND(COUNT(*) * 100.0 / (SELECT COUNT(*) FROM sales s2 {where_clause.replace('s.', 's2.')}), 2) as sales_percentage,
-                ROUND(SUM(s.price) * 100.0 / (SELECT SUM(price) FROM sales s3 {where_clause.replace('s.', 's3.')}), 2) as revenue_percentage
-            FROM sales s
-            {where_clause}
-            GROUP BY TRIM(s.product_name)
-            ORDER BY revenue DESC
-        ''', params + params + params)
-
         package_stats = []
-        for row in cursor.fetchall():
+        for row in self.get_sales_breakdown("NULLIF(d.product_name, '')", date_from=date_from, date_to=date_to):
             package_stats.append({
                 'package_type': row[0] or 'UNKNOWN',
                 'quantity': row[1],
@@ -997,53 +2298,371 @@ class SalesAnalyzer:
                 'revenue_percentage': row[5] or 0
             })
 
-        conn.close()
         return package_stats
 
-    def process_events_file(self, json_file):
-        """Processa completamente un file di eventi con import efficiente"""
+    def get_transaction_quantiles(self, date_from=None, date_to=None):
+        """Quantili (p50/p90/p99) di incasso netto, pagato e resto delle transazioni nel periodo
 
-        if not os.path.exists(json_file):
-            print(f"❌ File non trovato: {json_file}")
-            return
+        Unisce gli sketch giornalieri di transaction_value_sketches invece di
+        ordinare le transazioni.
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
 
-        with open(json_file, 'r', encoding='utf-8') as f:
-            events_data = json.load(f)
+        conditions, params = sale_datetime_conditions(date_from, date_to, column='day')
+        where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
+        cursor.execute(f'''
+            SELECT metric, sketch FROM transaction_value_sketches {where_clause}
+        ''', params)
 
-        # NUOVO: Import solo eventi non presenti (deduplicazione efficiente)
-        new_events = self.import_new_events_only(events_data)
+        digests = {metric: TDigest() for metric in TRANSACTION_SKETCH_METRICS}
+        for metric, sketch in cursor.fetchall():
+            digests[metric].merge(TDigest.from_bytes(sketch))
 
-        if not new_events:
-            # Aggiorna sempre last_download anche se non ci sono eventi nuovi
-            # Questo rappresenta l'ultima volta che il sistema ha verificato gli eventi
-            self.update_system_status('last_download', datetime.now().isoformat())
-            return
+        conn.close()
+        return {metric: digest.summary() for metric, digest in digests.items()}
+
+    def get_interval_quantiles(self, date_from=None, date_to=None, motor_id=None):
+        """Quantili degli intervalli tra vendite (ore) per motore e sull'intera flotta nel periodo
 
-        # NUOVO: Costruisci transazioni dai nuovi eventi con linking
-        transactions, event_transaction_map = self.build_transactions_from_new_events(new_events)
+        Unisce gli sketch giornalieri di motor_interval_sketches; un intervallo
+        appartiene al giorno della vendita che lo chiude.
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
 
-        # NUOVO: Salva eventi con transaction_id collegati
-        if new_events:
-            self.store_all_events(new_events, event_transaction_map)
+        conditions, params = sale_datetime_conditions(date_from, date_to, column='day')
+        if motor_id is not None:
+            conditions.append('motor_id = ?')
+            params.append(motor_id)
+        where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
+        cursor.execute(f'''
+            SELECT motor_id, sketch FROM motor_interval_sketches {where_clause} ORDER BY motor_id
+        ''', params)
+        rows = cursor.fetchall()
+        conn.close()
 
-        # Aggiorna statistiche motori se ci sono stati cambiamenti
-        if transactions:
-            self.update_motor_stats()
+        fleet = TDigest()
+        motors = []
+        for sketch_motor_id, motor_rows in groupby(rows, key=lambda row: row[0]):
+            digest = TDigest.merge_all(sketch for _, sketch in motor_rows)
+            fleet.merge(digest)
+            motors.append({'motor_id': sketch_motor_id, **digest.summary()})
 
-        # Aggiorna timestamp ultimo download SEMPRE quando processato un file
-        # Questo rappresenta l'ultima sincronizzazione del sistema
-        self.update_system_status('last_download', datetime.now().isoformat())
+        return {'fleet': fleet.summary(), 'motors': motors}
 
-        # Aggiorna data ultimo evento importato
+    def get_basket_statistics(self, date_from=None, date_to=None, limit=20):
+        """Statistiche dei carrelli: distribuzione delle dimensioni e prodotti acquistati insieme
+
+        Lette dalle tabelle basket_* aggiornate a ogni transazione completata. Per ogni
+        coppia: transazioni che contengono entrambi i prodotti, supporto (% sul totale
+        delle transazioni), confidenza nei due versi e lift.
+        """
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
-        cursor.execute('SELECT MAX(sale_datetime) FROM sales')
-        last_event = cursor.fetchone()[0]
-        if last_event:
-            self.update_system_status('last_event_date', last_event)
+
+        conditions, params = sale_datetime_conditions(date_from, date_to, column='day')
+        where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
+
+        cursor.execute(f'''
+            SELECT basket_size, SUM(transactions_count), SUM(revenue)
+            FROM basket_size_daily_stats
+            {where_clause}
+            GROUP BY basket_size
+            ORDER BY basket_size
+        ''', params)
+        sizes = cursor.fetchall()
+
+        cursor.execute(f'''
+            SELECT product_a, product_b, SUM(transactions_count) as together
+            FROM basket_pair_daily_stats
+            {where_clause}
+            GROUP BY product_a, product_b
+            ORDER BY together DESC, product_a, product_b
+            LIMIT ?
+        ''', params + [limit])
+        pairs = cursor.fetchall()
+
+        product_counts = {}
+        products = sorted({product for pair in pairs for product in pair[:2]})
+        if products:
+            placeholders = ",".join("?" * len(products))
+            product_conditions = conditions + [f"product_name IN ({placeholders})"]
+            cursor.execute(f'''
+                SELECT product_name, SUM(transactions_count)
+                FROM basket_product_daily_stats
+                WHERE {" AND ".join(product_conditions)}
+                GROUP BY product_name
+            ''', params + products)
+            product_counts = dict(cursor.fetchall())
+
         conn.close()
 
-        print(f"✅ Processamento completato: {len(new_events)} nuovi eventi processati - sincronizzazione aggiornata")
+        total_transactions = sum(count for _, count, _ in sizes)
+        total_items = sum(size * count for size, count, _ in sizes)
+        multi_item = sum(count for size, count, _ in sizes if size > 1)
+
+        def percentage(count):
+            return round(count * 100 / total_transactions, 2) if total_transactions else 0
+
+        product_pairs = []
+        for product_a, product_b, together in pairs:
+            count_a = product_counts.get(product_a) or together
+            count_b = product_counts.get(product_b) or together
+            product_pairs.append({
+                'product_a': product_a or 'UNKNOWN',
+                'product_b': product_b or 'UNKNOWN',
+                'transactions': together,
+                'support': percentage(together),
+                'confidence_a_to_b': round(together / count_a, 4),
+                'confidence_b_to_a': round(together / count_b, 4),
+                'lift': round(together * total_transactions / (count_a * count_b), 2)
+            })
+
+        return {
+            'total_transactions': total_transactions,
+            'total_items': total_items,
+            'avg_basket_size': round(total_items / total_transactions, 2) if total_transactions else 0,
+            'multi_item_transactions': multi_item,
+            'multi_item_percentage': percentage(multi_item),
+            'basket_sizes': [{
+                'basket_size': size,
+                'transactions': count,
+                'percentage': percentage(count),
+                'revenue': round(revenue, 2),
+                'avg_revenue': round(revenue / count, 2)
+            } for size, count, revenue in sizes],
+            'product_pairs': product_pairs
+        }
+
+    def iter_staged_events(self, cursor, after_id, chunk_size=EVENT_CHUNK_SIZE):
+        """Rilegge in ordine cronologico, a blocchi, gli eventi salvati con id > after_id"""
+        cursor.execute('''
+            SELECT id, event_number, event_code, event_type, event_datetime, event_text
+            FROM events
+            WHERE id > ?
+            ORDER BY event_ts, CAST(event_number AS INTEGER)
+        ''', (after_id,))
+
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield [{
+                'id': row[0],
+                'number': row[1],
+                'code': row[2],
+                'type': row[3],
+                'dateTime': row[4],
+                'text': row[5]
+            } for row in rows]
+
+    def ingest_events(self, events, chunk_size=EVENT_CHUNK_SIZE, use_watermark=True, update_rollups=True):
+        """Importa un flusso di eventi usando un'unica connessione e un'unica transazione
+
+        Accetta il payload completo ({"events_data": [...]}), una lista o un
+        generatore (es. iter_events_file). Gli eventi vengono prima salvati a
+        blocchi nella tabella events, che li deduplica tramite il vincolo UNIQUE,
+        poi riletti in ordine cronologico per ricostruire le transazioni: in
+        memoria resta al più un blocco di eventi.
+
+        Restituisce le statistiche dell'import: eventi letti e nuovi, transazioni,
+        vendite inserite, motori con nuove vendite, durata ed eventi al secondo.
+        Dopo il commit i motori toccati vengono pubblicati ai listener registrati
+        con add_import_listener. Con use_watermark=False (risincronizzazione
+        completa) anche gli eventi sotto il watermark passano dal vincolo UNIQUE.
+        Con update_rollups=False aggregati e scorte dei motori non vengono
+        aggiornati né i listener notificati: chi importa più blocchi di seguito
+        (es. il backfill) li ricalcola una sola volta alla fine con rebuild_rollups.
+        Fino ad allora ROLLUPS_PENDING_KEY resta in system_status e il primo
+        import normale (o il prossimo avvio) li ricalcola per intero.
+        """
+        started = time.perf_counter()
+        if isinstance(events, dict):
+            events = events.get('events_data', [])
+
+        batch = IngestBatch(self)
+        try:
+            cursor = batch.cursor
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM events')
+            staged_after_id = cursor.fetchone()[0]
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM sales')
+            sales_after_id = cursor.fetchone()[0]
+
+            # Gli eventi sotto il watermark vengono scartati senza toccare il database
+            watermark = self.get_event_watermark(cursor)
+            cutoff = self.get_watermark_cutoff(watermark) if use_watermark else ''
+            new_watermark = watermark
+
+            # Fase 1: salva gli eventi grezzi, i duplicati nella finestra di
+            # sovrapposizione vengono ignorati dal vincolo UNIQUE
+            events_read = 0
+            for chunk in iter_chunks(events, chunk_size):
+                events_read += len(chunk)
+                fresh_events = self.filter_by_watermark(chunk, cutoff)
+                for event in fresh_events:
+                    sort_key = event_sort_key(event)
+                    if sort_key[0] and (new_watermark is None or sort_key > new_watermark):
+                        new_watermark = sort_key
+                batch.stats['skipped_events'] += len(chunk) - len(fresh_events)
+                batch.add_events(fresh_events)
+                batch.flush()
+            new_events = batch.stats['events']
+
+            if new_watermark and new_watermark != watermark:
+                self.update_event_watermark(new_watermark, cursor)
+
+            if not events_read:
+                print("📝 Nessun evento trovato nel file")
+
+            # Fase 2: ricostruisci le transazioni in ordine cronologico
+            # (il distributore restituisce gli eventi dal più recente)
+            def link(transaction, transaction_id):
+                if transaction_id:
+                    batch.link_events(transaction_id, [e['id'] for e in transaction['events'] if 'id' in e])
+
+            # Le transazioni incomplete possono essere aggiornate da questo import
+            cursor.execute('SELECT MIN(start_ts) FROM transactions WHERE is_complete = 0')
+            incomplete_since_ts = cursor.fetchone()[0]
+            transactions_after_id = batch.next_transaction_id - 1
+
+            builder = TransactionBuilder(self, batch, link)
+            if new_events:
+                read_cursor = batch.conn.cursor()
+                for chunk in self.iter_staged_events(read_cursor, staged_after_id, chunk_size):
+                    builder.feed(chunk)
+                    batch.flush()
+                builder.finish()
+                batch.flush()
+
+            # Aggiorna gli aggregati con le sole vendite nuove, a meno che un import
+            # precedente non li abbia lasciati da ricostruire
+            incremental = update_rollups and not self.rollups_pending(cursor)
+            motor_ids = set()
+            if batch.stats['sales']:
+                if incremental:
+                    self.update_sales_rollups(cursor, after_sale_id=sales_after_id)
+                cursor.execute('SELECT DISTINCT motor_id FROM sales WHERE id > ?', (sales_after_id,))
+                motor_ids = {row[0] for row in cursor.fetchall()}
+
+            if batch.stats['transactions'] and incremental:
+                cursor.execute('SELECT MIN(start_ts) FROM transactions WHERE id > ?', (transactions_after_id,))
+                touched = [ts for ts in (cursor.fetchone()[0], incomplete_since_ts) if ts is not None]
+                if touched:
+                    self.update_transaction_daily_stats(cursor, since_ts=min(touched))
+                    self.update_transaction_sketches(cursor, since_ts=min(touched))
+
+            # Esaurimenti, ricariche e scorte per motore dai soli eventi nuovi: anche
+            # senza vendite una ricarica o un esaurimento cambiano le scorte da notificare
+            stock_motor_ids = set()
+            if new_events and incremental:
+                stock_motor_ids = self.update_motor_stock(cursor, after_event_id=staged_after_id,
+                                                          after_sale_id=sales_after_id)
+            elif not update_rollups:
+                if new_events:
+                    self.update_system_status(ROLLUPS_PENDING_KEY, '1', cursor)
+            elif not incremental:
+                stock_motor_ids = self.update_all_rollups(cursor)
+
+            # Aggiorna timestamp ultimo download SEMPRE quando processato un file
+            # Questo rappresenta l'ultima sincronizzazione del sistema
+            self.update_system_status('last_download', datetime.now().isoformat(), cursor)
+
+            # Aggiorna data ultimo evento importato
+            if new_events:
+                cursor.execute('SELECT MAX(sale_datetime) FROM sales')
+                last_event = cursor.fetchone()[0]
+                if last_event:
+                    self.update_system_status('last_event_date', last_event, cursor)
+
+            batch.commit()
+        except Exception:
+            batch.rollback()
+            raise
+
+        if update_rollups and (motor_ids or stock_motor_ids):
+            self.notify_import_listeners(motor_ids | stock_motor_ids)
+
+        elapsed = time.perf_counter() - started
+        return {
+            'events_read': events_read,
+            'new_events': new_events,
+            'skipped_events': batch.stats['skipped_events'],
+            'transactions': batch.stats['transactions'],
+            'sales': batch.stats['sales'],
+            'motor_ids': sorted(motor_ids),
+            'elapsed_seconds': round(elapsed, 3),
+            'events_per_second': round(events_read / elapsed, 1) if elapsed > 0 else 0.0
+        }
+
+    def rollups_pending(self, cursor=None):
+        """True se un import con update_rollups=False attende ancora rebuild_rollups"""
+        close_conn = False
+        if cursor is None:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            close_conn = True
+
+        cursor.execute('SELECT 1 FROM system_status WHERE key = ?', (ROLLUPS_PENDING_KEY,))
+        pending = cursor.fetchone() is not None
+
+        if close_conn:
+            conn.close()
+        return pending
+
+    def update_all_rollups(self, cursor):
+        """Ricalcola da zero aggregati, carrelli e scorte dei motori e rimuove ROLLUPS_PENDING_KEY
+
+        Restituisce l'insieme dei motori ricalcolati.
+        """
+        self.update_sales_rollups(cursor)
+        self.update_transaction_daily_stats(cursor)
+        self.update_transaction_sketches(cursor)
+        self.update_basket_stats(cursor)
+        motor_ids = self.update_motor_stock(cursor)
+        cursor.execute('DELETE FROM system_status WHERE key = ?', (ROLLUPS_PENDING_KEY,))
+        return motor_ids
+
+    def rebuild_rollups(self):
+        """Ricalcola da zero aggregati, carrelli e scorte dei motori in un'unica transazione
+
+        Serve dopo gli import con update_rollups=False: un solo passaggio su tutto
+        lo storico, corretto anche se i blocchi importati precedono dati già
+        presenti. Tutti i motori ricalcolati vengono pubblicati ai listener.
+        Restituisce l'insieme dei motori.
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            motor_ids = self.update_all_rollups(conn.cursor())
+            conn.commit()
+        finally:
+            conn.close()
+
+        if motor_ids:
+            self.notify_import_listeners(motor_ids)
+        return motor_ids
+
+    def process_events_file(self, json_file, use_watermark=True):
+        """Processa completamente un file di eventi in streaming e in un'unica transazione
+
+        Con use_watermark=False tutti gli eventi del file passano dal vincolo
+        UNIQUE: serve per reimportare un archivio più vecchio dell'ultimo evento
+        importato (es. da past_events), i cui eventi verrebbero altrimenti scartati.
+        """
+
+        if not os.path.exists(json_file):
+            print(f"❌ File non trovato: {json_file}")
+            return
+
+        stats = self.ingest_events(iter_events_file(json_file), use_watermark=use_watermark)
+
+        print(f"✅ Processamento completato: {stats['new_events']} nuovi eventi processati "
+              f"in {stats['elapsed_seconds']}s ({stats['events_per_second']} eventi/s) - sincronizzazione aggiornata")
+        if stats['skipped_events']:
+            print(f"⏭️  {stats['skipped_events']} eventi ignorati perché più vecchi dell'ultimo evento importato "
+                  f"(disattiva il watermark per reimportarli)")
+
+        return stats
 
     def update_existing_sales_brands(self):
         """Aggiorna le marche per le vendite esistenti che non le hanno"""
@@ -1062,6 +2681,10 @@ class SalesAnalyzer:
             cursor.execute('UPDATE sales SET brand_id = ? WHERE id = ?', (brand_id, sale_id))
             updated_count += 1
 
+        # Le marche fanno parte della chiave degli aggregati per periodo
+        if updated_count:
+            self.update_sales_period_stats(cursor)
+
         conn.commit()
         conn.close()
 
@@ -1075,10 +2698,10 @@ class SalesAnalyzer:
 
         # Ottieni tutti gli eventi senza transaction_id, ordinati per data
         cursor.execute('''
-            SELECT id, event_number, event_datetime, event_type, event_text
+            SELECT id, event_number, event_ts, event_type, event_text
             FROM events
-            WHERE transaction_id IS NULL
-            ORDER BY event_datetime ASC
+            WHERE transaction_id IS NULL AND event_ts IS NOT NULL
+            ORDER BY event_ts ASC
         ''')
 
         events_to_link = cursor.fetchall()
@@ -1089,41 +2712,33 @@ class SalesAnalyzer:
 
         # Ottieni tutte le transazioni ordinate per data
         cursor.execute('''
-            SELECT id, start_datetime
+            SELECT id, start_ts
             FROM transactions
-            ORDER BY start_datetime ASC
+            WHERE start_ts IS NOT NULL
+            ORDER BY start_ts ASC
         ''')
 
         transactions = cursor.fetchall()
+        transaction_starts = [tx_start for _, tx_start in transactions]
 
         # Algoritmo di matching: associa eventi a transazioni basandosi sulla cronologia
         current_transaction_id = None
         linked_events = 0
 
-        for event_id, event_number, event_datetime, event_type, event_text in events_to_link:
-            # Converte datetime per confronto
-            try:
-                # Formato evento: "17/09/25 19:14:15"
-                event_dt = datetime.strptime(event_datetime, "%d/%m/%y %H:%M:%S")
-            except:
-                continue
-
+        for event_id, event_number, event_ts, event_type, event_text in events_to_link:
             # Se è un evento di inizio transazione, trova la transazione corrispondente
             if 'IMPRONTA VALIDA' in event_text or 'TESSERA VALIDA' in event_text:
-                # Trova la transazione più vicina cronologicamente
+                # Trova la transazione più vicina cronologicamente (ricerca binaria)
                 best_match = None
                 min_diff = float('inf')
 
-                for tx_id, tx_start in transactions:
-                    try:
-                        # Formato transazione: "17/09/25 19:14:15" (stesso degli eventi)
-                        tx_dt = datetime.strptime(tx_start, "%d/%m/%y %H:%M:%S")
-                        diff = abs((event_dt - tx_dt).total_seconds())
+                position = bisect.bisect_left(transaction_starts, event_ts)
+                for index in (position - 1, position):
+                    if 0 <= index < len(transactions):
+                        diff = abs(event_ts - transaction_starts[index])
                         if diff < min_diff and diff < 300:  # Entro 5 minuti
                             min_diff = diff
-                            best_match = tx_id
-                    except:
-                        continue
+                            best_match = transactions[index][0]
 
                 current_transaction_id = best_match
 
@@ -1148,6 +2763,8 @@ def main():
     parser.add_argument('--stats', action='store_true', help='Mostra statistiche')
     parser.add_argument('--update-brands', action='store_true', help='Aggiorna marche per vendite esistenti')
     parser.add_argument('--backfill-links', action='store_true', help='Collega eventi esistenti alle transazioni')
+    parser.add_argument('--no-watermark', action='store_true',
+                        help='Importa anche gli eventi più vecchi dell\'ultimo importato (es. archivi di past_events)')
 
     args = parser.parse_args()
 
@@ -1160,7 +2777,7 @@ def main():
         analyzer.backfill_transaction_links()
 
     if args.json_file:
-        analyzer.process_events_file(args.json_file)
+        analyzer.process_events_file(args.json_file, use_watermark=not args.no_watermark)
 
     if args.dashboard_data:
         data = analyzer.get_dashboard_data()
@@ -7,56 +7,78 @@ Versione refactorizzata che usa CigaretteMachineClient
 import sys
 import os
 import json
-from datetime import datetime
+import shutil
+from datetime import datetime, timedelta
 from cigarette_machine_client import CigaretteMachineClient
+from event_stream import iter_events_file
 
 # Add parent directory to path to import shared
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from shared.config import Config
 
 
-def download_and_parse_events(client, output_file=None, days_back=30):
-    """Scarica sia la pagina HTML che i dati JSON degli eventi"""
-    # Scarica pagina HTML
-    events_file = client.download_events_html(output_file)
-    if not events_file:
-        return None
-
-    # Leggi il file HTML
-    with open(events_file, 'r', encoding='utf-8') as f:
-        html_content = f.read()
-
-    # Scarica anche i dati JSON
-    events_data = client.download_events_data(days_back)
-
-    # Salva tutto in un file JSON completo
-    json_file = events_file.replace('.html', '_complete.json')
-
-    complete_data = {
-        'download_info': {
-            'timestamp': datetime.now().isoformat(),
-            'source_url': f"{client.base_url}/events2",
-            'html_file': events_file,
-            'html_size': len(html_content),
-            'days_searched': days_back
-        },
-        'events_data': events_data,
-        'events_count': len(events_data)
+def download_and_parse_events(client, output_file=None, days_back=30, start_date=None, data_only=False):
+    """Scarica sia la pagina HTML che i dati JSON degli eventi
+
+    I dati JSON vengono scritti su disco in streaming così come arrivano dal
+    distributore: nessuna copia completa degli eventi resta in memoria.
+    Con start_date il download parte da quel giorno invece che da days_back giorni fa.
+    Con data_only la pagina HTML non viene scaricata né salvata: il nome
+    output_file serve solo da base per i file JSON.
+    """
+    if start_date is None:
+        start_date = datetime.now().date() - timedelta(days=days_back)
+
+    if data_only:
+        events_file = output_file or f"events_{datetime.now().strftime('%Y%m%d_%H%M%S')}.html"
+    else:
+        # Scarica pagina HTML (vale anche come visita di events2 per la sessione)
+        events_file = client.download_events_html(output_file)
+        if not events_file:
+            return None
+
+    # Nomi dei file JSON derivati da quello di output, qualunque sia la sua estensione
+    base_name = os.path.splitext(events_file)[0]
+    events_only_file = base_name + Config.JSON_SUFFIX
+    json_file = base_name + Config.COMPLETE_JSON_SUFFIX
+
+    # Scarica i dati JSON direttamente su file
+    events_count = 0
+    if client.download_events_to_file(events_only_file, days_back, start_date=start_date):
+        try:
+            events_count = sum(1 for _ in iter_events_file(events_only_file))
+        except ValueError as e:
+            print(f"⚠️  Risposta non JSON: {e}")
+    print(f"📊 Trovati {events_count} eventi")
+
+    # Salva tutto in un file JSON completo copiando gli eventi a blocchi
+    download_info = {
+        'timestamp': datetime.now().isoformat(),
+        'source_url': f"{client.base_url}/events2",
+        'html_file': None if data_only else events_file,
+        'html_size': None if data_only else os.path.getsize(events_file),
+        'days_searched': (datetime.now().date() - start_date).days,
+        'start_date': start_date.isoformat()
     }
 
     with open(json_file, 'w', encoding='utf-8') as f:
-        json.dump(complete_data, f, indent=2, ensure_ascii=False)
+        f.write('{"download_info": ' + json.dumps(download_info, ensure_ascii=False) + ', "events_data": ')
+        if events_count:
+            with open(events_only_file, 'r', encoding='utf-8') as events_f:
+                shutil.copyfileobj(events_f, f)
+        else:
+            f.write('[]')
+        f.write(f', "events_count": {events_count}}}')
 
     print(f"📋 Dati completi salvati in: {json_file}")
 
-    # Salva anche solo gli eventi se ce ne sono
-    if events_data:
-        events_only_file = events_file.replace('.html', '_events_only.json')
-        with open(events_only_file, 'w', encoding='utf-8') as f:
-            json.dump(events_data, f, indent=2, ensure_ascii=False)
+    # Mantieni il file con solo gli eventi se ce ne sono
+    if events_count:
         print(f"📋 Solo eventi salvati in: {events_only_file}")
+    elif os.path.exists(events_only_file):
+        os.remove(events_only_file)
 
-    return events_file
+    return json_file if data_only else events_file
 
 
 def main():
@@ -67,6 +89,10 @@ def main():
     parser = argparse.ArgumentParser(description='Download eventi distributore sigarette')
     parser.add_argument('output_file', nargs='?', help='Nome file di output (opzionale)')
     parser.add_argument('days_back', nargs='?', type=int, default=30, help='Giorni di eventi da scaricare (default: 30)')
+    parser.add_argument('--since', type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+                        help='Scarica dal giorno indicato (YYYY-MM-DD) invece che dagli ultimi days_back giorni')
+    parser.add_argument('--data-only', action='store_true',
+                        help='Scarica solo i dati JSON, senza la pagina HTML degli eventi')
     parser.add_argument('--simulator', action='store_true', help='Usa simulatore localhost (deprecato, usa --ip localhost)')
     parser.add_argument('--ip', default=Config.DEFAULT_DISTRIBUTOR_IP, help=f'Indirizzo IP del distributore (default: {Config.DEFAULT_DISTRIBUTOR_IP})')
 
@@ -98,7 +124,8 @@ def main():
     days_back = args.days_back
 
     # Scarica gli eventi
-    result = download_and_parse_events(client, output_file, days_back)
+    result = download_and_parse_events(client, output_file, days_back, start_date=args.since,
+                                       data_only=args.data_only)
 
     # Esce sempre dalla modalità programmazione, anche in caso di errore
     client.exit_programming_mode()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Backfill degli eventi storici dal distributore
+Il periodo viene diviso in blocchi di giorni o settimane scaricati in parallelo
+e importati in ordine cronologico, con avanzamento salvato in system_status
+"""
+
+import heapq
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import requests
+
+from data_processor import event_sort_key
+
+# Ampiezza dei blocchi in giorni
+SHARD_DAYS = {'day': 1, 'week': 7}
+
+# Richieste contemporanee al distributore (il suo server embedded è lento)
+DEFAULT_CONCURRENCY = 4
+MAX_CONCURRENCY = 8
+
+# Tentativi per blocco e attesa iniziale tra un tentativo e l'altro (raddoppia ad ogni errore)
+SHARD_ATTEMPTS = 3
+RETRY_DELAY = 2.0
+
+# Chiave di system_status con l'avanzamento dell'ultimo backfill
+PROGRESS_KEY = 'backfill_progress'
+
+
+def date_shards(start_date, end_date, shard='day'):
+    """Divide [start_date, end_date] in blocchi contigui (inizio, fine) estremi inclusi"""
+    if shard not in SHARD_DAYS:
+        raise ValueError(f"Blocco non valido: {shard} (valori ammessi: {', '.join(SHARD_DAYS)})")
+    if start_date > end_date:
+        raise ValueError(f"Data iniziale {start_date} successiva alla data finale {end_date}")
+
+    step = timedelta(days=SHARD_DAYS[shard])
+    shards = []
+    shard_start = start_date
+    while shard_start <= end_date:
+        shard_end = min(shard_start + step - timedelta(days=1), end_date)
+        shards.append((shard_start, shard_end))
+        shard_start = shard_end + timedelta(days=1)
+    return shards
+
+
+def merge_shards(shards):
+    """Unisce blocchi già ordinati in un unico flusso cronologico (k-way merge)
+
+    Gli eventi identici presenti in due blocchi vengono restituiti una sola
+    volta, anche se tra le due copie cadono altri eventi con la stessa chiave:
+    il confronto è sull'intero evento tra tutti quelli della stessa chiave.
+    """
+    run_key = None
+    seen = set()
+    for event in heapq.merge(*shards, key=event_sort_key):
+        key = event_sort_key(event)
+        if key != run_key:
+            run_key = key
+            seen = set()
+        identity = json.dumps(event, sort_keys=True)
+        if identity not in seen:
+            seen.add(identity)
+            yield event
+
+
+def get_backfill_progress(analyzer):
+    """Avanzamento salvato dell'ultimo backfill, None se assente"""
+    status = analyzer.get_system_status(PROGRESS_KEY)
+    if not status:
+        return None
+    try:
+        return json.loads(status['value'])
+    except (TypeError, ValueError):
+        return None
+
+
+class ShardError(Exception):
+    """Un blocco non è stato scaricato neanche dopo tutti i tentativi"""
+
+    def __init__(self, shard, cause):
+        super().__init__(f"Download del blocco {shard[0]} - {shard[1]} fallito: {cause}")
+        self.shard = shard
+
+
+class EventBackfill:
+    """Scarica e importa un periodo di eventi a blocchi
+
+    I blocchi vengono scaricati a gruppi di concurrency, ciascuno con un
+    client clonato da quello autenticato; mentre un gruppo viene importato il
+    successivo è già in download. Ogni gruppo viene unito in ordine cronologico
+    e importato con un'unica chiamata a ingest_events (senza watermark: gli
+    eventi storici sono sotto di esso), trattenendo gli eventi dell'ultima
+    transazione aperta fino al gruppo successivo; poi l'ultimo giorno
+    completato viene salvato in system_status. Ripetendo il backfill dello stesso periodo si
+    riparte dal primo blocco non completato.
+
+    Gli import dei gruppi non aggiornano aggregati e scorte dei motori: i
+    calcoli incrementali assumono eventi più recenti di quelli già presenti,
+    mentre il periodo può precedere dati già importati, e ogni gruppo
+    ricalcolerebbe i giorni fino ad oggi. Vengono ricostruiti una sola volta
+    alla fine con rebuild_rollups, anche dopo un blocco fallito; se il processo
+    si interrompe prima, ci pensano il successivo import o avvio (vedi
+    SalesAnalyzer.rollups_pending).
+    """
+
+    def __init__(self, analyzer, client, shard='day', concurrency=DEFAULT_CONCURRENCY,
+                 attempts=SHARD_ATTEMPTS, retry_delay=RETRY_DELAY):
+        if not 1 <= concurrency <= MAX_CONCURRENCY:
+            raise ValueError(f"concurrency deve essere tra 1 e {MAX_CONCURRENCY}")
+        if shard not in SHARD_DAYS:
+            raise ValueError(f"Blocco non valido: {shard} (valori ammessi: {', '.join(SHARD_DAYS)})")
+        self.analyzer = analyzer
+        self.client = client
+        self.shard = shard
+        self.concurrency = concurrency
+        self.attempts = attempts
+        self.retry_delay = retry_delay
+        self._local = threading.local()
+
+    def _worker_client(self):
+        """Un client per thread, con i cookie della sessione autenticata"""
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.client.clone()
+        return self._local.client
+
+    def fetch_shard(self, shard):
+        """Eventi di un blocco in ordine cronologico, ritentando gli errori di rete"""
+        delay = self.retry_delay
+        for attempt in range(1, self.attempts + 1):
+            try:
+                events = list(self._worker_client().iter_events(start_date=shard[0], end_date=shard[1]))
+                events.sort(key=event_sort_key)
+                return events
+            except (requests.RequestException, ValueError) as e:
+                if attempt == self.attempts:
+                    raise ShardError(shard, e)
+                print(f"⚠️  Blocco {shard[0]} - {shard[1]}: tentativo {attempt} fallito ({e}), nuovo tentativo")
+                time.sleep(delay)
+                delay *= 2
+
+    def _hold_back_open_transaction(self, events, carried):
+        """Restituisce gli eventi fino all'ultimo inizio transazione, i successivi finiscono in carried
+
+        Una transazione con il solo evento di inizio non viene salvata
+        dall'import: i suoi pagamenti e vendite del giorno dopo resterebbero
+        senza transazione.
+        """
+        pending = []
+        for event in events:
+            if self.analyzer.is_transaction_start(event):
+                yield from pending
+                pending = []
+            pending.append(event)
+        carried[:] = pending
+
+    def _save_progress(self, start_date, end_date, completed_until):
+        self.analyzer.update_system_status(PROGRESS_KEY, json.dumps({
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'shard': self.shard,
+            'completed_until': completed_until.isoformat() if completed_until else None,
+            'updated_at': datetime.now().isoformat()
+        }))
+
+    def run(self, start_date, end_date=None, resume=True, on_progress=None):
+        """Esegue il backfill di [start_date, end_date] (default oggi)
+
+        on_progress(blocchi completati, blocchi totali) viene chiamata dopo
+        l'import di ogni gruppo. Un blocco che fallisce tutti i tentativi
+        interrompe il backfill: quanto importato resta salvato e un nuovo run
+        riparte da quel blocco.
+        """
+        end_date = end_date or date.today()
+        shards = date_shards(start_date, end_date, self.shard)
+
+        # Stesso periodo di un backfill interrotto: riparte dal giorno dopo l'ultimo completato
+        completed_until = None
+        progress = get_backfill_progress(self.analyzer) if resume else None
+        if progress and (progress.get('start_date'), progress.get('end_date')) == \
+                (start_date.isoformat(), end_date.isoformat()) and progress.get('completed_until'):
+            completed_until = date.fromisoformat(progress['completed_until'])
+            shards = date_shards(completed_until + timedelta(days=1), end_date, self.shard) \
+                if completed_until < end_date else []
+
+        stats = {
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'shard': self.shard,
+            'shards_total': len(shards),
+            'shards_completed': 0,
+            'resumed_from': completed_until.isoformat() if completed_until else None,
+            'events_read': 0,
+            'new_events': 0,
+            'sales': 0,
+            'failed_shard': None
+        }
+        self._save_progress(start_date, end_date, completed_until)
+
+        groups = [shards[i:i + self.concurrency] for i in range(0, len(shards), self.concurrency)]
+        carried = []
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pending = [executor.submit(self.fetch_shard, shard) for shard in groups[0]] if groups else []
+            for index, group in enumerate(groups):
+                # Blocchi scaricati in ordine fino all'eventuale primo fallito
+                fetched = []
+                failure = None
+                for future in pending:
+                    try:
+                        fetched.append(future.result())
+                    except ShardError as e:
+                        failure = e
+                        break
+
+                # Il gruppo successivo si scarica mentre questo viene importato
+                pending = [executor.submit(self.fetch_shard, shard) for shard in groups[index + 1]] \
+                    if failure is None and index + 1 < len(groups) else []
+
+                if fetched:
+                    # L'ultima transazione del gruppo può proseguire nel successivo: i suoi
+                    # eventi vengono importati insieme al gruppo seguente
+                    last_group = failure is None and index + 1 == len(groups)
+                    merged = merge_shards([carried] + fetched)
+                    result = self.analyzer.ingest_events(
+                        merged if last_group else self._hold_back_open_transaction(merged, carried),
+                        use_watermark=False, update_rollups=False)
+                    if last_group:
+                        carried = []
+                    for key in ('events_read', 'new_events', 'sales'):
+                        stats[key] += result[key]
+                    stats['shards_completed'] += len(fetched)
+
+                    # Completato fino al giorno prima degli eventi trattenuti
+                    completed_until = group[len(fetched) - 1][1]
+                    if carried:
+                        held_since = date.fromisoformat(event_sort_key(carried[0])[0][:10])
+                        completed_until = min(completed_until, held_since - timedelta(days=1))
+                    if completed_until < start_date:
+                        completed_until = None
+                    self._save_progress(start_date, end_date, completed_until)
+                    if on_progress:
+                        on_progress(stats['shards_completed'], stats['shards_total'])
+
+                if failure is not None:
+                    print(f"❌ {failure}")
+                    stats['failed_shard'] = [day.isoformat() for day in failure.shard]
+                    break
+
+        # Aggregati e scorte ricalcolati una sola volta per tutti i gruppi importati
+        if self.analyzer.rollups_pending():
+            self.analyzer.rebuild_rollups()
+
+        return stats
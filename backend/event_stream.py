@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Lettura incrementale degli eventi in formato JSON
+Decodifica gli eventi uno alla volta da file o da risposte HTTP in arrivo,
+senza caricare l'intero documento in memoria
+"""
+
+import json
+
+# Byte letti per volta dal parser incrementale dei file eventi
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class _JSONStreamReader:
+    """Buffer di lettura per decodificare valori JSON uno alla volta da un file"""
+
+    def __init__(self, f, block_size=READ_BLOCK_SIZE):
+        self.f = f
+        self.block_size = block_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """Legge un altro blocco scartando la parte già consumata del buffer"""
+        block = self.f.read(self.block_size)
+        if not block:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + block
+        self.pos = 0
+
+    def peek(self):
+        """Restituisce il prossimo carattere non di spaziatura senza consumarlo"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return ''
+            self._fill()
+
+    def expect(self, char):
+        """Consuma il carattere atteso o solleva ValueError"""
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"JSON non valido: atteso '{char}', trovato '{found or 'EOF'}'")
+        self.pos += 1
+
+    def decode(self):
+        """Decodifica il prossimo valore JSON completo"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # Un valore che arriva a fine buffer (es. un numero) potrebbe essere troncato
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+def iter_events_file(json_file):
+    """Genera gli eventi di un file JSON senza caricarlo interamente in memoria
+
+    Supporta sia la lista semplice (_events_only.json) sia l'oggetto
+    {"events_data": [...]} (_complete.json).
+    """
+    with open(json_file, 'r', encoding='utf-8') as f:
+        yield from iter_events_stream(f)
+
+
+def iter_events_stream(f):
+    """Come iter_events_file, da un qualsiasi oggetto con read() che restituisce testo
+
+    Usato anche per decodificare la risposta di events2_query mentre arriva.
+    """
+    reader = _JSONStreamReader(f)
+    first = reader.peek()
+
+    if first == '{':
+        # Cerca la chiave events_data saltando gli altri valori (download_info, ...)
+        reader.expect('{')
+        while reader.peek() not in ('}', ''):
+            key = reader.decode()
+            reader.expect(':')
+            if key == 'events_data' and reader.peek() == '[':
+                break
+            reader.decode()
+            if reader.peek() == ',':
+                reader.expect(',')
+        else:
+            return
+    elif first != '[':
+        return
+
+    reader.expect('[')
+    if reader.peek() == ']':
+        return
+    while True:
+        yield reader.decode()
+        if reader.peek() == ',':
+            reader.expect(',')
+        else:
+            reader.expect(']')
+            return
@@ -5,120 +5,185 @@ Calculates sales patterns, timing indicators, and status for individual motors
 """
 
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import argparse
+import calendar
+import math
 import sqlite3
 import json
+import os
+import threading
+import time
 
+try:
+    import numpy as np
+except ImportError:  # Only the vectorized fleet engine needs NumPy
+    np = None
 
-class MotorAnalytics:
+from analytics_cache import AnalyticsCache
+
+# Format of sales_events.timestamp; bounds in the same format keep range filters index-friendly
+SQL_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Upper bound on cached entries (one per motor plus the aggregates)
+CACHE_MAX_ENTRIES = 256
+
+# Sales pattern parameters
+PATTERN_WINDOW_DAYS = 365
+MIN_PATTERN_SALES = 5
+
+# Calendar days before today included in each period (today is always included),
+# so every period is a whole number of motor_daily_stats rows
+PERIOD_DAYS = {'today': 0, 'week': 6, 'month': 29}
+
+
+# Percentiles of the inter-sale interval reported by the fleet engine
+FLEET_PERCENTILES = (25, 50, 75, 90)
+
+# Seasonal status: hour-of-week demand profile from motor_hourly_profile (weekday 0 = Sunday)
+HOURS_PER_WEEK = 7 * 24
+# Share of the flat rate blended into every hour, so hours without history
+# (night, closing days) still accumulate some expected demand
+SEASONAL_SMOOTHING = 0.1
+# Red when a gap this long without sales is less likely than this; exp(-2) is
+# what the 2x-mean-interval rule gives for a motor with flat demand
+RED_GAP_PROBABILITY = math.exp(-2)
+
+
+def _linear_percentile(sorted_values: Sequence[float], percentile: float) -> float:
     """
-    Motor-specific analytics calculator for sales timing and status indicators
+    Percentile with linear interpolation between closest ranks (NumPy's default method)
     """
+    position = (len(sorted_values) - 1) * percentile / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
 
-    def __init__(self, db_path: str = "sales_data.db"):
-        self.db_path = db_path
-        self.cache = {}
-        self.cache_ttl = timedelta(minutes=5)  # 5-minute cache
 
-    def get_motor_analytics(self, motor_id: int) -> Dict:
-        """
-        Get comprehensive analytics for a specific motor
-        Returns analytics data matching the API contract schema
-        """
-        # Check cache first
-        cache_key = f"motor_analytics_{motor_id}"
-        if self._is_cache_valid(cache_key):
-            return self.cache[cache_key]['data']
+def _interval_summary(sales_count: int, interval_count: int, mean: float, std: float,
+                      percentiles: Sequence[float], hours_since_last_sale: float,
+                      last_sale: datetime) -> Dict:
+    """
+    Fleet engine result for one motor (intervals in hours)
+    """
+    return {
+        "sales_count": sales_count,
+        "interval_count": interval_count,
+        "mean_interval_hours": mean,
+        "std_interval_hours": std,
+        "median_interval_hours": percentiles[FLEET_PERCENTILES.index(50)],
+        "percentiles": {f"p{q}": value for q, value in zip(FLEET_PERCENTILES, percentiles)},
+        "last_sale": last_sale.isoformat(),
+        "hours_since_last_sale": hours_since_last_sale,
+        # How unusual the current gap is for this motor, in standard deviations
+        "gap_zscore": (hours_since_last_sale - mean) / std if std > 0 else None
+    }
+
+
+def _period_bounds(now: datetime) -> Dict[str, datetime]:
+    """
+    Start (midnight) of each period in PERIOD_DAYS
+    """
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return {period: today - timedelta(days=days) for period, days in PERIOD_DAYS.items()}
 
-        try:
-            # Get motor position
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
 
-            cursor.execute("SELECT position FROM motors WHERE motor_id = ?", (motor_id,))
-            motor_row = cursor.fetchone()
-            if not motor_row:
-                conn.close()
-                raise ValueError(f"Motor {motor_id} not found")
+def _period_sum_columns(bound_column: str, count_expr: str, revenue_expr: str) -> str:
+    """
+    SELECT columns with (count, revenue) per period; bounds are the :today/:week/:month parameters
+    """
+    return ",\n".join(
+        f"COALESCE(SUM(CASE WHEN {bound_column} >= :{period} THEN {count_expr} END), 0), "
+        f"COALESCE(SUM(CASE WHEN {bound_column} >= :{period} THEN {revenue_expr} END), 0)"
+        for period in PERIOD_DAYS
+    )
 
-            position = motor_row[0]
 
-            # Calculate period metrics
-            now = datetime.now()
-            today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            week_start = now - timedelta(days=7)
-            month_start = now - timedelta(days=30)
+def _pattern_from_interval_stats(sales_count: int, mean_interval_seconds: float,
+                                 last_sale: Optional[str], now: datetime) -> Optional[Dict]:
+    """
+    Sales pattern from a motor_interval_stats row
+    Motors whose last sale is older than the pattern window have no current pattern.
+    """
+    if not last_sale or sales_count < MIN_PATTERN_SALES:
+        return None
+    if datetime.fromisoformat(last_sale) < now - timedelta(days=PATTERN_WINDOW_DAYS):
+        return None
 
-            # Get sales data for different periods
-            periods = {
-                'today': today_start,
-                'week': week_start,
-                'month': month_start
-            }
+    average_interval = mean_interval_seconds / 3600
+    return {
+        "average_interval_hours": average_interval,
+        "sales_count": sales_count,
+        "threshold_hours": average_interval * 2
+    }
 
-            period_metrics = {}
-            for period, start_date in periods.items():
-                cursor.execute("""
-                    SELECT COUNT(*), COALESCE(SUM(amount), 0)
-                    FROM sales_events
-                    WHERE motor_id = ? AND event_type = 'sale'
-                    AND datetime(timestamp) >= datetime(?)
-                """, (motor_id, start_date.isoformat()))
-
-                count, revenue = cursor.fetchone()
-                period_metrics[period] = {
-                    "sales_count": count or 0,
-                    "revenue": float(revenue or 0.0)
-                }
 
-            # Get last sale info
-            cursor.execute("""
-                SELECT timestamp FROM sales_events
-                WHERE motor_id = ? AND event_type = 'sale'
-                ORDER BY datetime(timestamp) DESC LIMIT 1
-            """, (motor_id,))
+def _hour_of_week(moment: datetime) -> int:
+    """
+    Index of the hour in the weekly profile, numbered like strftime('%w') * 24 + hour
+    """
+    return ((moment.weekday() + 1) % 7) * 24 + moment.hour
 
-            last_sale_row = cursor.fetchone()
-            last_sale = None
-            if last_sale_row:
-                last_sale_time = datetime.fromisoformat(last_sale_row[0])
-                days_ago = (now - last_sale_time).days
-                last_sale = {
-                    "timestamp": last_sale_time.isoformat(),
-                    "days_ago": days_ago
-                }
 
-            conn.close()
+def _seasonal_rates(hourly_counts: Sequence[int], first_sale: datetime, now: datetime) -> List[float]:
+    """
+    Expected sales per hour for each hour of the week
+    Each hour of the week occurred once per observed week (at least one week counted).
+    """
+    weeks = max((now - first_sale).total_seconds() / (7 * 86400), 1.0)
+    flat_rate = sum(hourly_counts) / (weeks * HOURS_PER_WEEK)
+    return [(1 - SEASONAL_SMOOTHING) * count / weeks + SEASONAL_SMOOTHING * flat_rate
+            for count in hourly_counts]
 
-            # Calculate sales pattern and status
-            sales_pattern = self.calculate_sales_pattern(motor_id)
 
-            if sales_pattern and last_sale:
-                last_sale_time = datetime.fromisoformat(last_sale['timestamp'])
-                status = self.determine_status_indicator(motor_id, last_sale_time, sales_pattern['average_interval_hours'])
-            else:
-                status = "neutral"
+def _expected_sales(rates: Sequence[float], start: datetime, end: datetime) -> float:
+    """
+    Integral of the hourly rates between start and end (whole weeks at once, then hour by hour)
+    """
+    if end <= start:
+        return 0.0
 
-            # Build result
-            result = {
-                "motor_id": motor_id,
-                "position": position,
-                "today": period_metrics['today'],
-                "week": period_metrics['week'],
-                "month": period_metrics['month'],
-                "last_sale": last_sale,
-                "status_indicator": status,
-                "sales_pattern": sales_pattern
-            }
+    weeks = int((end - start) / timedelta(weeks=1))
+    expected = weeks * sum(rates)
+    moment = start + timedelta(weeks=weeks)
+    while moment < end:
+        next_hour = min(moment.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1), end)
+        expected += rates[_hour_of_week(moment)] * (next_hour - moment).total_seconds() / 3600
+        moment = next_hour
+    return expected
 
-            # Cache result
-            self.cache[cache_key] = {
-                'data': result,
-                'timestamp': datetime.now()
-            }
 
-            return result
+def _period_metrics(values: Sequence) -> Dict[str, Dict]:
+    """
+    Turn the flat (count, revenue) columns of _period_sum_columns into period metrics
+    """
+    return {
+        period: {"sales_count": int(values[index * 2] or 0), "revenue": float(values[index * 2 + 1] or 0.0)}
+        for index, period in enumerate(PERIOD_DAYS)
+    }
+
 
+class MotorAnalytics:
+    """
+    Motor-specific analytics calculator for sales timing and status indicators
+    """
+
+    def __init__(self, db_path: str = "sales_data.db"):
+        self.db_path = db_path
+        self.cache_ttl = timedelta(minutes=5)  # 5-minute cache
+        self.cache = AnalyticsCache(max_size=CACHE_MAX_ENTRIES, ttl=self.cache_ttl)
+        self._last_cleanup = None
+        # Rollup tables maintained by the ingester; without them analytics read sales_events
+        self.tables = self._existing_tables()
+
+    def get_motor_analytics(self, motor_id: int) -> Dict:
+        """
+        Get comprehensive analytics for a specific motor
+        Returns analytics data matching the API contract schema
+        """
+        try:
+            return self.cache.get_or_compute(self._motor_cache_key(motor_id),
+                                             lambda: self._compute_motor_analytics(motor_id))
         except Exception as e:
             # Return safe default for errors
             return {
@@ -132,64 +197,357 @@ class MotorAnalytics:
                 "sales_pattern": None
             }
 
+    def _compute_motor_analytics(self, motor_id: int) -> Dict:
+        """
+        Compute analytics for one motor from the database, raising on errors
+        """
+        # Get motor position
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT position FROM motors WHERE motor_id = ?", (motor_id,))
+        motor_row = cursor.fetchone()
+        if not motor_row:
+            conn.close()
+            raise ValueError(f"Motor {motor_id} not found")
+
+        position = motor_row[0]
+
+        # Calculate period metrics
+        now = datetime.now()
+        period_metrics = self._query_period_metrics(cursor, motor_id, now)
+
+        # Get last sale info
+        cursor.execute("""
+            SELECT timestamp FROM sales_events
+            WHERE motor_id = ? AND event_type = 'sale'
+            ORDER BY timestamp DESC LIMIT 1
+        """, (motor_id,))
+
+        last_sale_row = cursor.fetchone()
+        last_sale = None
+        if last_sale_row:
+            last_sale_time = datetime.fromisoformat(last_sale_row[0])
+            days_ago = (now - last_sale_time).days
+            last_sale = {
+                "timestamp": last_sale_time.isoformat(),
+                "days_ago": days_ago
+            }
+
+        seasonal_profile = None
+        if {'motor_hourly_profile', 'motor_interval_stats'} <= self.tables:
+            seasonal_profile = self._load_seasonal_profiles(cursor, motor_id).get(motor_id)
+
+        conn.close()
+
+        # Calculate sales pattern and status
+        sales_pattern = self.calculate_sales_pattern(motor_id)
+
+        if sales_pattern and last_sale:
+            last_sale_time = datetime.fromisoformat(last_sale['timestamp'])
+            status = self._pattern_status(motor_id, last_sale_time, sales_pattern, seasonal_profile, now)
+        else:
+            status = "neutral"
+
+        return {
+            "motor_id": motor_id,
+            "position": position,
+            "today": period_metrics['today'],
+            "week": period_metrics['week'],
+            "month": period_metrics['month'],
+            "last_sale": last_sale,
+            "status_indicator": status,
+            "sales_pattern": sales_pattern
+        }
+
     def get_all_motor_status(self) -> Dict:
         """
         Get status indicators for all motors for dashboard grid
         Returns simplified status data for motor buttons
         """
-        # Check cache first
-        cache_key = "all_motor_status"
-        if self._is_cache_valid(cache_key):
-            return self.cache[cache_key]['data']
+        try:
+            return self.cache.get_or_compute("all_motor_status", self._compute_all_motor_status)
+        except Exception as e:
+            return {
+                "motors": [],
+                "last_updated": datetime.now().isoformat()
+            }
+
+    def _compute_all_motor_status(self) -> Dict:
+        """
+        Build the status grid from the bulk metrics, raising on errors
+        """
+        metrics = self.get_bulk_motor_metrics()
+        motors = [
+            {"motor_id": motor_id, "status_indicator": data["status_indicator"]}
+            for motor_id, data in metrics.items()
+        ]
 
+        return {
+            "motors": motors,
+            "last_updated": datetime.now().isoformat()
+        }
+
+    def get_bulk_motor_metrics(self) -> Dict[int, Dict]:
+        """
+        Compute period metrics, last sale and status for every motor at once
+        With the ingest rollups this is a single query: motors joined with their
+        motor_daily_stats period sums and motor_interval_stats row, plus one read of
+        motor_hourly_profile for the seasonal status of the whole grid.
+        Without them it uses two: the motor list and one aggregate over sales_events
+        grouped by motor, where the mean interval between consecutive sales is
+        (last - first) / (count - 1). Only sales inside the pattern window are read
+        there: motors without any have no last_sale, and their status is neutral either way.
+        """
+        now = datetime.now()
+        bounds = _period_bounds(now)
+        seasonal_profiles = {}
+
+        conn = sqlite3.connect(self.db_path)
         try:
-            conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
-
-            # Get all motors
-            cursor.execute("SELECT motor_id FROM motors ORDER BY motor_id")
-            motor_rows = cursor.fetchall()
+            if {'motor_daily_stats', 'motor_interval_stats'} <= self.tables:
+                # Motors with their period sums (at most 30 daily rows each) and interval statistics
+                cursor.execute(f"""
+                    SELECT m.motor_id, m.position, i.sales_count, i.mean_interval, i.last_sale,
+                           {_period_sum_columns('d.day', 'd.sales_count', 'd.revenue')}
+                    FROM motors m
+                    LEFT JOIN motor_interval_stats i ON i.motor_id = m.motor_id
+                    LEFT JOIN motor_daily_stats d ON d.motor_id = m.motor_id AND d.day >= :month
+                    GROUP BY m.motor_id
+                    ORDER BY m.motor_id
+                """, {period: bound.strftime('%Y-%m-%d') for period, bound in bounds.items()})
+                rows = cursor.fetchall()
+                motor_rows = [row[:2] for row in rows]
+                periods = {row[0]: _period_metrics(row[5:]) for row in rows}
+                last_sales = {
+                    row[0]: (row[4], _pattern_from_interval_stats(row[2], row[3], row[4], now))
+                    for row in rows if row[4]
+                }
+                if 'motor_hourly_profile' in self.tables:
+                    seasonal_profiles = self._load_seasonal_profiles(cursor)
+            else:
+                cursor.execute("SELECT motor_id, position FROM motors ORDER BY motor_id")
+                motor_rows = cursor.fetchall()
+
+                params = {period: bound.strftime(SQL_TIMESTAMP_FORMAT) for period, bound in bounds.items()}
+                params['since'] = (now - timedelta(days=PATTERN_WINDOW_DAYS)).strftime(SQL_TIMESTAMP_FORMAT)
+                cursor.execute(f"""
+                    SELECT motor_id,
+                           {_period_sum_columns('timestamp', '1', 'amount')},
+                           COUNT(*), MAX(timestamp),
+                           (julianday(MAX(timestamp)) - julianday(MIN(timestamp))) * 24
+                    FROM sales_events
+                    WHERE event_type = 'sale' AND timestamp >= :since
+                    GROUP BY motor_id
+                """, params)
+                periods = {}
+                last_sales = {}
+                for row in cursor.fetchall():
+                    sales_count, last_timestamp, span_hours = row[-3:]
+                    periods[row[0]] = _period_metrics(row[1:-3])
+                    sales_pattern = None
+                    if sales_count >= MIN_PATTERN_SALES:
+                        average_interval = span_hours / (sales_count - 1)
+                        sales_pattern = {
+                            "average_interval_hours": average_interval,
+                            "sales_count": sales_count,
+                            "threshold_hours": average_interval * 2
+                        }
+                    last_sales[row[0]] = (last_timestamp, sales_pattern)
+        finally:
             conn.close()
 
-            motors = []
-            for (motor_id,) in motor_rows:
-                # Get status for each motor
-                # Note: This could be optimized with bulk queries in production
-                motor_analytics = self.get_motor_analytics(motor_id)
-                motors.append({
-                    "motor_id": motor_id,
-                    "status_indicator": motor_analytics["status_indicator"]
-                })
-
-            result = {
-                "motors": motors,
-                "last_updated": datetime.now().isoformat()
-            }
+        empty_periods = _period_metrics([0] * len(PERIOD_DAYS) * 2)
+        metrics = {}
+        for motor_id, position in motor_rows:
+            result = {"motor_id": motor_id, "position": position}
+            result.update(periods.get(motor_id, empty_periods))
 
-            # Cache result
-            self.cache[cache_key] = {
-                'data': result,
-                'timestamp': datetime.now()
-            }
+            last_sale = None
+            sales_pattern = None
+            status = "neutral"
+            if motor_id in last_sales:
+                last_timestamp, sales_pattern = last_sales[motor_id]
+                last_sale_time = datetime.fromisoformat(last_timestamp)
+                last_sale = {
+                    "timestamp": last_sale_time.isoformat(),
+                    "days_ago": (now - last_sale_time).days
+                }
+                if sales_pattern:
+                    status = self._pattern_status(
+                        motor_id, last_sale_time, sales_pattern, seasonal_profiles.get(motor_id), now)
+
+            result.update({
+                "last_sale": last_sale,
+                "status_indicator": status,
+                "sales_pattern": sales_pattern
+            })
+            metrics[motor_id] = result
 
-            return result
+        return metrics
 
+    def get_fleet_interval_report(self) -> Dict:
+        """
+        Cached fleet-wide interval statistics for the API, as a list ordered by motor
+        """
+        try:
+            return self.cache.get_or_compute("fleet_interval_statistics", self._compute_fleet_interval_report)
         except Exception as e:
             return {
                 "motors": [],
+                "engine": None,
                 "last_updated": datetime.now().isoformat()
             }
 
+    def _compute_fleet_interval_report(self) -> Dict:
+        statistics = self.get_fleet_interval_statistics()
+        return {
+            "motors": [{"motor_id": motor_id, **data} for motor_id, data in sorted(statistics.items())],
+            "engine": "numpy" if np is not None else "python",
+            "last_updated": datetime.now().isoformat()
+        }
+
+    def get_fleet_interval_statistics(self, days_back: int = PATTERN_WINDOW_DAYS,
+                                      vectorized: bool = True) -> Dict[int, Dict]:
+        """
+        Inter-sale interval distribution for every motor with at least two sales
+        Returns mean, standard deviation, median and FLEET_PERCENTILES of the intervals
+        (hours), plus the current gap since the last sale and its z-score.
+        The vectorized engine needs NumPy; without it (or with vectorized=False)
+        the per-motor Python path computes the same values.
+        """
+        now = datetime.now().replace(microsecond=0)
+        if vectorized and np is not None:
+            return self._fleet_interval_statistics_numpy(days_back, now)
+        return self._fleet_interval_statistics_python(days_back, now)
+
+    def _fleet_interval_statistics_numpy(self, days_back: int, now: datetime) -> Dict[int, Dict]:
+        """
+        Load (motor_id, epoch) once and reduce every motor's segment with NumPy
+        """
+        since = (now - timedelta(days=days_back)).strftime(SQL_TIMESTAMP_FORMAT)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute("""
+                SELECT motor_id, CAST(strftime('%s', timestamp) AS INTEGER)
+                FROM sales_events
+                WHERE event_type = 'sale' AND timestamp >= ?
+                ORDER BY motor_id, timestamp
+            """, (since,)).fetchall()
+        finally:
+            conn.close()
+
+        if len(rows) < 2:
+            return {}
+
+        data = np.array(rows, dtype=np.int64)
+        motors, epochs = data[:, 0], data[:, 1]
+
+        # Intervals between consecutive sales of the same motor (rows are sorted by motor, time)
+        same_motor = motors[1:] == motors[:-1]
+        intervals = (np.diff(epochs)[same_motor]) / 3600.0
+        interval_motors = motors[1:][same_motor]
+        if not len(intervals):
+            return {}
+
+        # Segment reductions: one contiguous run of intervals per motor
+        motor_ids, starts, counts = np.unique(interval_motors, return_index=True, return_counts=True)
+        means = np.add.reduceat(intervals, starts) / counts
+        deviations = intervals - np.repeat(means, counts)
+        stds = np.sqrt(np.add.reduceat(deviations * deviations, starts) / counts)
+
+        # Percentiles: sort within each segment, then interpolate at the same rank in every segment
+        sorted_intervals = intervals[np.lexsort((intervals, interval_motors))]
+        percentiles = []
+        for q in FLEET_PERCENTILES:
+            position = (counts - 1) * (q / 100.0)
+            lower = np.floor(position).astype(np.int64)
+            upper = np.minimum(lower + 1, counts - 1)
+            low_values = sorted_intervals[starts + lower]
+            percentiles.append(low_values + (sorted_intervals[starts + upper] - low_values) * (position - lower))
+        percentiles = np.column_stack(percentiles)
+
+        # Sales count and last sale per motor from the full (motor, epoch) arrays
+        sale_motor_ids, sale_starts, sale_counts = np.unique(motors, return_index=True, return_counts=True)
+        last_epochs = epochs[sale_starts + sale_counts - 1]
+        sales_by_motor = dict(zip(sale_motor_ids.tolist(), zip(sale_counts.tolist(), last_epochs.tolist())))
+
+        now_epoch = calendar.timegm(now.timetuple())
+        result = {}
+        for index, motor_id in enumerate(motor_ids.tolist()):
+            sales_count, last_epoch = sales_by_motor[motor_id]
+            result[motor_id] = _interval_summary(
+                sales_count, int(counts[index]), float(means[index]), float(stds[index]),
+                percentiles[index].tolist(), (now_epoch - last_epoch) / 3600.0,
+                datetime(1970, 1, 1) + timedelta(seconds=last_epoch)
+            )
+        return result
+
+    def _fleet_interval_statistics_python(self, days_back: int, now: datetime) -> Dict[int, Dict]:
+        """
+        Per-motor path: one _get_sales_data fetch and Python list arithmetic per motor
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            motor_ids = [row[0] for row in conn.execute("SELECT motor_id FROM motors ORDER BY motor_id")]
+        finally:
+            conn.close()
+
+        result = {}
+        for motor_id in motor_ids:
+            timestamps = sorted(datetime.fromisoformat(timestamp)
+                                for timestamp, _, _ in self._get_sales_data(motor_id, days_back))
+            intervals = [(later - earlier).total_seconds() / 3600
+                         for earlier, later in zip(timestamps, timestamps[1:])]
+            if not intervals:
+                continue
+
+            mean = sum(intervals) / len(intervals)
+            std = math.sqrt(sum((interval - mean) ** 2 for interval in intervals) / len(intervals))
+            ordered = sorted(intervals)
+            result[motor_id] = _interval_summary(
+                len(timestamps), len(intervals), mean, std,
+                [_linear_percentile(ordered, q) for q in FLEET_PERCENTILES],
+                (now - timestamps[-1]).total_seconds() / 3600, timestamps[-1]
+            )
+        return result
+
+    def _query_period_metrics(self, cursor: sqlite3.Cursor, motor_id: int, now: datetime) -> Dict[str, Dict]:
+        """
+        Today/week/month sales count and revenue for one motor
+        Sums at most 30 motor_daily_stats rows, or raw sales_events without the rollup.
+        """
+        bounds = _period_bounds(now)
+        if 'motor_daily_stats' in self.tables:
+            params = {period: bound.strftime('%Y-%m-%d') for period, bound in bounds.items()}
+            cursor.execute(f"""
+                SELECT {_period_sum_columns('day', 'sales_count', 'revenue')}
+                FROM motor_daily_stats
+                WHERE motor_id = :motor_id AND day >= :month
+            """, {**params, 'motor_id': motor_id})
+        else:
+            params = {period: bound.strftime(SQL_TIMESTAMP_FORMAT) for period, bound in bounds.items()}
+            cursor.execute(f"""
+                SELECT {_period_sum_columns('timestamp', '1', 'amount')}
+                FROM sales_events
+                WHERE motor_id = :motor_id AND event_type = 'sale' AND timestamp >= :month
+            """, {**params, 'motor_id': motor_id})
+        return _period_metrics(cursor.fetchone())
+
     def calculate_sales_pattern(self, motor_id: int) -> Optional[Dict]:
         """
         Calculate sales pattern analysis for status determination
         Returns pattern data or None if insufficient data
         """
+        if 'motor_interval_stats' in self.tables:
+            return self._lookup_sales_pattern(motor_id)
+
         try:
             # Get sales timestamps for this motor
             sales_data = self._get_sales_data(motor_id)
 
-            if len(sales_data) < 5:  # Minimum 5 sales required
+            if len(sales_data) < MIN_PATTERN_SALES:
                 return None
 
             # Extract timestamps and sort chronologically
@@ -217,6 +575,24 @@ class MotorAnalytics:
         except Exception as e:
             return None
 
+    def _lookup_sales_pattern(self, motor_id: int) -> Optional[Dict]:
+        """
+        Sales pattern from the interval statistics maintained at ingest time (O(1))
+        """
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                row = conn.execute("""
+                    SELECT sales_count, mean_interval, last_sale
+                    FROM motor_interval_stats WHERE motor_id = ?
+                """, (motor_id,)).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return None
+
+        return _pattern_from_interval_stats(*row, datetime.now()) if row else None
+
     def determine_status_indicator(self, motor_id: int, last_sale: Optional[datetime],
                                  average_interval: Optional[float]) -> str:
         """
@@ -240,6 +616,83 @@ class MotorAnalytics:
         else:
             return "green"  # Normal
 
+    def determine_seasonal_status(self, last_sale: Optional[datetime], first_sale: Optional[datetime],
+                                  hourly_counts: Sequence[int], now: Optional[datetime] = None) -> Tuple[str, Optional[float]]:
+        """
+        Status from the probability of the current gap given the motor's hour-of-week profile
+        Sales are modelled as a Poisson process whose rate follows the profile, so the
+        chance of no sale since last_sale is exp(-expected sales in the gap): a quiet
+        night is expected, the same gap during the motor's busy hours is not.
+        Returns (status, probability); 'neutral' and None without data.
+        """
+        if not last_sale or not first_sale or not sum(hourly_counts):
+            return "neutral", None
+
+        now = now or datetime.now()
+        rates = _seasonal_rates(hourly_counts, first_sale, now)
+        probability = math.exp(-_expected_sales(rates, last_sale, now))
+        return ("red" if probability < RED_GAP_PROBABILITY else "green"), probability
+
+    def _pattern_status(self, motor_id: int, last_sale: datetime, sales_pattern: Dict,
+                        seasonal_profile: Optional[Tuple[datetime, List[int]]], now: datetime) -> str:
+        """
+        Seasonal status when the motor has an hourly profile, else the 2x average interval rule
+        The gap probability is added to sales_pattern.
+        """
+        if seasonal_profile:
+            status, probability = self.determine_seasonal_status(last_sale, *seasonal_profile, now=now)
+            if probability is not None:
+                sales_pattern["gap_probability"] = probability
+                return status
+        return self.determine_status_indicator(motor_id, last_sale, sales_pattern["average_interval_hours"])
+
+    def _load_seasonal_profiles(self, cursor: sqlite3.Cursor,
+                                motor_id: Optional[int] = None) -> Dict[int, Tuple[datetime, List[int]]]:
+        """
+        (first sale, sales per hour of the week) for one motor or all of them
+        """
+        condition = "WHERE p.motor_id = ?" if motor_id is not None else ""
+        cursor.execute(f"""
+            SELECT p.motor_id, i.first_sale, p.weekday, p.hour, p.sales_count
+            FROM motor_hourly_profile p
+            JOIN motor_interval_stats i ON i.motor_id = p.motor_id
+            {condition}
+        """, () if motor_id is None else (motor_id,))
+
+        profiles = {}
+        for profile_motor_id, first_sale, weekday, hour, sales_count in cursor.fetchall():
+            if profile_motor_id not in profiles:
+                profiles[profile_motor_id] = (datetime.fromisoformat(first_sale), [0] * HOURS_PER_WEEK)
+            profiles[profile_motor_id][1][weekday * 24 + hour] = sales_count
+        return profiles
+
+    def invalidate_motors(self, motor_ids: Iterable[int], recompute: bool = True) -> Optional[threading.Thread]:
+        """
+        Evict cached analytics for the given motors and the all-motor status grid
+        With recompute the fresh values are computed in a background thread, so the
+        next dashboard poll is served from cache. Returns the thread, if any.
+        """
+        motor_ids = sorted(set(motor_ids))
+        for motor_id in motor_ids:
+            self.cache.invalidate(self._motor_cache_key(motor_id))
+        self.cache.invalidate("all_motor_status")
+        self.cache.invalidate("fleet_interval_statistics")
+
+        if not recompute:
+            return None
+
+        thread = threading.Thread(target=self._recompute_motors, args=(motor_ids,), daemon=True)
+        thread.start()
+        return thread
+
+    def _recompute_motors(self, motor_ids: List[int]) -> None:
+        """
+        Repopulate the cache after an invalidation
+        """
+        for motor_id in motor_ids:
+            self.get_motor_analytics(motor_id)
+        self.get_all_motor_status()
+
     def refresh_analytics_cache(self) -> bool:
         """
         Force refresh of all analytics calculations
@@ -255,41 +708,18 @@ class MotorAnalytics:
         """
         Get cache statistics for monitoring and debugging
         """
-        now = datetime.now()
-        valid_entries = 0
-        expired_entries = 0
-
-        for key, entry in self.cache.items():
-            if entry.get('timestamp') and now - entry['timestamp'] < self.cache_ttl:
-                valid_entries += 1
-            else:
-                expired_entries += 1
-
-        return {
-            'total_entries': len(self.cache),
-            'valid_entries': valid_entries,
-            'expired_entries': expired_entries,
-            'cache_ttl_minutes': self.cache_ttl.total_seconds() / 60,
-            'last_cleanup': getattr(self, '_last_cleanup', None)
-        }
+        stats = self.cache.stats()
+        stats['last_cleanup'] = self._last_cleanup
+        return stats
 
     def cleanup_expired_cache(self) -> int:
         """
         Remove expired cache entries to prevent memory growth
         Returns number of entries removed
         """
-        now = datetime.now()
-        expired_keys = []
-
-        for key, entry in self.cache.items():
-            if not entry.get('timestamp') or now - entry['timestamp'] >= self.cache_ttl:
-                expired_keys.append(key)
-
-        for key in expired_keys:
-            del self.cache[key]
-
-        self._last_cleanup = now.isoformat()
-        return len(expired_keys)
+        removed = self.cache.cleanup_expired()
+        self._last_cleanup = datetime.now().isoformat()
+        return removed
 
     def warm_cache_for_motors(self, motor_ids: List[int]) -> Dict:
         """
@@ -309,8 +739,7 @@ class MotorAnalytics:
                 results['motors_processed'] += 1
 
                 # Check if it's now cached
-                cache_key = f"motor_analytics_{motor_id}"
-                if self._is_cache_valid(cache_key):
+                if self._is_cache_valid(self._motor_cache_key(motor_id)):
                     results['motors_cached'] += 1
 
             except Exception:
@@ -318,7 +747,7 @@ class MotorAnalytics:
 
         return results
 
-    def _get_sales_data(self, motor_id: int, days_back: int = 365) -> List[Tuple]:
+    def _get_sales_data(self, motor_id: int, days_back: int = PATTERN_WINDOW_DAYS) -> List[Tuple]:
         """
         Private method to fetch sales data from database
         Returns list of (timestamp, quantity, amount) tuples
@@ -333,9 +762,9 @@ class MotorAnalytics:
                 SELECT timestamp, quantity, amount
                 FROM sales_events
                 WHERE motor_id = ? AND event_type = 'sale'
-                AND datetime(timestamp) >= datetime(?)
-                ORDER BY datetime(timestamp) ASC
-            """, (motor_id, cutoff_date.isoformat()))
+                AND timestamp >= ?
+                ORDER BY timestamp ASC
+            """, (motor_id, cutoff_date.strftime(SQL_TIMESTAMP_FORMAT)))
 
             results = cursor.fetchall()
             conn.close()
@@ -344,15 +773,68 @@ class MotorAnalytics:
         except Exception as e:
             return []
 
+    def _existing_tables(self) -> Set[str]:
+        """
+        Names of the tables in the database (empty if it does not exist yet)
+        """
+        if not os.path.exists(self.db_path):
+            return set()
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        finally:
+            conn.close()
+
+    def _motor_cache_key(self, motor_id: int) -> str:
+        return f"motor_analytics_{motor_id}"
+
     def _is_cache_valid(self, key: str) -> bool:
         """
         Check if cached data is still valid
         """
-        if key not in self.cache:
-            return False
+        return key in self.cache
 
-        cache_time = self.cache[key].get('timestamp')
-        if not cache_time:
-            return False
 
-        return datetime.now() - cache_time < self.cache_ttl
\ No newline at end of file
+def benchmark_fleet_engine(db_path: str, repeat: int = 5) -> Dict:
+    """
+    Time the vectorized fleet engine against the per-motor Python path
+    Returns the best time of each (seconds), the speedup and the number of motors.
+    """
+    analytics = MotorAnalytics(db_path)
+    timings = {}
+    results = {}
+    for name, vectorized in (("numpy", True), ("per_motor", False)):
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            results[name] = analytics.get_fleet_interval_statistics(vectorized=vectorized)
+            best = min(best, time.perf_counter() - started)
+        timings[name] = best
+
+    return {
+        "numpy_seconds": round(timings["numpy"], 6),
+        "per_motor_seconds": round(timings["per_motor"], 6),
+        "speedup": round(timings["per_motor"] / timings["numpy"], 1) if timings["numpy"] > 0 else None,
+        "motors": len(results["numpy"])
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Motor analytics tools')
+    parser.add_argument('--db', default='sales_data.db', help='SQLite database path')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Compare the NumPy fleet engine with the per-motor path')
+    parser.add_argument('--repeat', type=int, default=5, help='Benchmark repetitions (best time is kept)')
+
+    args = parser.parse_args()
+
+    if args.benchmark:
+        if np is None:
+            parser.error('NumPy is required for the benchmark')
+        print(json.dumps(benchmark_fleet_engine(args.db, args.repeat), indent=2))
+    else:
+        print(json.dumps(MotorAnalytics(args.db).get_fleet_interval_statistics(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Quantile Sketch Module
+Mergeable t-digest for approximate quantiles over daily slices stored in SQLite
+"""
+
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import math
+
+# Centroid budget: the digest keeps roughly this many centroids (more = more accurate)
+DEFAULT_COMPRESSION = 100
+
+# Quantiles reported by summary()
+SUMMARY_QUANTILES = (0.5, 0.9, 0.99)
+
+
+class TDigest:
+    """
+    Merging t-digest (Dunning & Ertl) with the arcsine scale function
+
+    Values are buffered and merged into weighted centroids; centroids near the
+    tails stay small, so extreme quantiles (p99) keep their accuracy. Two digests
+    merge by combining their centroids, which is how daily sketches are summed
+    over a date range. Up to compression values are kept individually and
+    quantile() then equals linear interpolation between closest ranks.
+    """
+
+    def __init__(self, compression: int = DEFAULT_COMPRESSION):
+        self.compression = compression
+        self.centroids: List[Tuple[float, float]] = []  # (mean, weight) sorted by mean
+        self.buffer: List[Tuple[float, float]] = []
+        self.count = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float, weight: float = 1.0) -> None:
+        self.buffer.append((value, weight))
+        self.count += weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self.buffer) >= 5 * self.compression:
+            self._compress()
+
+    def update(self, values: Iterable[float]) -> "TDigest":
+        for value in values:
+            self.add(value)
+        return self
+
+    def merge(self, other: "TDigest") -> "TDigest":
+        """
+        Add the centroids of other to this digest
+        """
+        other._compress()
+        self.buffer.extend(other.centroids)
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _scale(self, q: float) -> float:
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _compress(self) -> None:
+        """
+        Merge buffered values into the centroids, one pass in mean order
+        A centroid grows while its quantile span stays within one unit of the scale function;
+        up to compression points are kept as they are, so small digests stay exact.
+        """
+        if not self.buffer:
+            return
+        points = sorted(self.centroids + self.buffer)
+        self.buffer = []
+        if len(points) <= self.compression:
+            self.centroids = points
+            return
+
+        merged = []
+        mean, weight = points[0]
+        cumulative = 0.0
+        limit = self._scale(0.0) + 1
+        for point_mean, point_weight in points[1:]:
+            if self._scale(min((cumulative + weight + point_weight) / self.count, 1.0)) <= limit:
+                mean += (point_mean - mean) * point_weight / (weight + point_weight)
+                weight += point_weight
+            else:
+                merged.append((mean, weight))
+                cumulative += weight
+                limit = self._scale(cumulative / self.count) + 1
+                mean, weight = point_mean, point_weight
+        merged.append((mean, weight))
+        self.centroids = merged
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimated q-quantile (0 <= q <= 1), None for an empty digest
+        """
+        self._compress()
+        if not self.centroids:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        if len(self.centroids) == 1:
+            return self.centroids[0][0]
+
+        # Rank position on the same scale as linear interpolation of n values (0.5 .. n - 0.5),
+        # min and max sit at the two ends
+        position = q * (self.count - 1) + 0.5
+        centers = []
+        cumulative = 0.0
+        for _, weight in self.centroids:
+            centers.append(cumulative + weight / 2)
+            cumulative += weight
+
+        first_mean = self.centroids[0][0]
+        if position <= centers[0]:
+            if centers[0] <= 0.5:
+                return first_mean
+            return self.min + (first_mean - self.min) * (position - 0.5) / (centers[0] - 0.5)
+
+        last_mean = self.centroids[-1][0]
+        top = self.count - 0.5
+        if position >= centers[-1]:
+            if centers[-1] >= top:
+                return last_mean
+            return last_mean + (self.max - last_mean) * (position - centers[-1]) / (top - centers[-1])
+
+        for index in range(1, len(centers)):
+            if position <= centers[index]:
+                low_mean = self.centroids[index - 1][0]
+                high_mean = self.centroids[index][0]
+                span = centers[index] - centers[index - 1]
+                return low_mean + (high_mean - low_mean) * (position - centers[index - 1]) / span
+        return last_mean
+
+    def summary(self, quantiles: Sequence[float] = SUMMARY_QUANTILES, digits: int = 2) -> Dict:
+        """
+        count, min, max and the requested quantiles as p50/p90/p99 keys
+        """
+        if not self.count:
+            return {"count": 0, "min": None, "max": None, **{_quantile_key(q): None for q in quantiles}}
+        return {
+            "count": int(self.count),
+            "min": round(self.min, digits),
+            "max": round(self.max, digits),
+            **{_quantile_key(q): round(self.quantile(q), digits) for q in quantiles}
+        }
+
+    def to_bytes(self) -> bytes:
+        """
+        Compact serialization: min, max, then (mean, weight) pairs as doubles
+        """
+        self._compress()
+        values = array("d", [self.min, self.max])
+        for mean, weight in self.centroids:
+            values.extend((mean, weight))
+        return values.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, compression: int = DEFAULT_COMPRESSION) -> "TDigest":
+        values = array("d")
+        values.frombytes(data)
+        digest = cls(compression)
+        digest.min, digest.max = values[0], values[1]
+        digest.centroids = [(values[i], values[i + 1]) for i in range(2, len(values), 2)]
+        digest.count = sum(weight for _, weight in digest.centroids)
+        return digest
+
+    @classmethod
+    def merge_all(cls, blobs: Iterable[bytes]) -> "TDigest":
+        """
+        One digest from serialized digests (e.g. the daily sketches of a date range)
+        """
+        digest = cls()
+        for blob in blobs:
+            digest.merge(cls.from_bytes(blob))
+        return digest
+
+
+def _quantile_key(q: float) -> str:
+    return f"p{q * 100:g}"
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Refill Forecast Module
+Estimates time-to-empty for every motor and the motors to refill on the next visit
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence
+import sqlite3
+import statistics
+import threading
+
+from motor_analytics import SEASONAL_SMOOTHING, SQL_TIMESTAMP_FORMAT
+
+# Sales velocity: blend of the last week and the last four weeks (units per day)
+VELOCITY_SHORT_DAYS = 7
+VELOCITY_LONG_DAYS = 28
+VELOCITY_SHORT_WEIGHT = 0.5
+
+# Forecasts further out than this are reported as "not within the horizon" (empty_at None)
+FORECAST_HORIZON_DAYS = 60
+
+# Days until the next visit when refill windows do not show a visiting pattern yet
+DEFAULT_VISIT_DAYS = 7.0
+
+# Refill windows closer than this belong to the same operator visit
+VISIT_MERGE_HOURS = 12
+
+
+def _weekday_factors(weekday_counts: Sequence[int]) -> List[float]:
+    """
+    Demand of each weekday (0 = Sunday) relative to the average day, smoothed towards 1
+    """
+    total = sum(weekday_counts)
+    if not total:
+        return [1.0] * 7
+    return [(1 - SEASONAL_SMOOTHING) * 7 * count / total + SEASONAL_SMOOTHING for count in weekday_counts]
+
+
+def _hours_to_empty(remaining: float, daily_rate: float, weekday_factors: Sequence[float],
+                    now: datetime, horizon_days: int = FORECAST_HORIZON_DAYS) -> Optional[float]:
+    """
+    Hours until remaining units are sold, walking forward one calendar day at a time
+    at daily_rate scaled by each weekday's factor. None beyond the horizon.
+    """
+    if remaining <= 0:
+        return 0.0
+    if daily_rate <= 0:
+        return None
+
+    moment = now
+    left = remaining
+    end = now + timedelta(days=horizon_days)
+    while moment < end:
+        next_day = moment.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        day_rate = daily_rate * weekday_factors[(moment.weekday() + 1) % 7]
+        expected = day_rate * (next_day - moment).total_seconds() / 86400
+        if expected >= left:
+            return (moment - now).total_seconds() / 3600 + left / day_rate * 24
+        left -= expected
+        moment = next_day
+    return None
+
+
+class RefillForecaster:
+    """
+    Time-to-empty forecasts stored in motor_refill_forecast
+
+    Remaining units come from motor_stock: estimated capacity minus units sold since
+    the last refill, zero after an unrefilled stockout. Motors that never ran out are
+    assumed topped up at the last visit and use the fleet median capacity. Units are
+    consumed at the motor's recent sales velocity, shaped by its weekday profile
+    from motor_hourly_profile.
+    """
+
+    def __init__(self, db_path: str = "sales_data.db"):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+
+    def update_in_background(self, motor_ids: Iterable[int]) -> threading.Thread:
+        """
+        Import listener: recompute the touched motors in a daemon thread
+        """
+        thread = threading.Thread(target=self.update_motors, args=(sorted(set(motor_ids)),), daemon=True)
+        thread.start()
+        return thread
+
+    def update_motors(self, motor_ids: Optional[Iterable[int]] = None,
+                      now: Optional[datetime] = None) -> int:
+        """
+        Recompute and store forecasts, returns how many motors were written
+        Besides motor_ids, motors whose last refill changed since their forecast are
+        refreshed too (a closed refill window resets every motor). None updates all motors.
+        """
+        now = (now or datetime.now()).replace(microsecond=0)
+        with self._lock:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                cursor = conn.cursor()
+                if motor_ids is None:
+                    cursor.execute("SELECT motor_id FROM motor_stock")
+                    selected = {row[0] for row in cursor.fetchall()}
+                else:
+                    cursor.execute("""
+                        SELECT s.motor_id FROM motor_stock s
+                        LEFT JOIN motor_refill_forecast f ON f.motor_id = s.motor_id
+                        WHERE f.motor_id IS NULL OR f.last_refill IS NOT s.last_refill
+                    """)
+                    selected = set(motor_ids) | {row[0] for row in cursor.fetchall()}
+
+                forecasts = self._compute_forecasts(cursor, sorted(selected), now)
+                cursor.executemany("""
+                    INSERT OR REPLACE INTO motor_refill_forecast
+                        (motor_id, computed_at, last_refill, daily_rate, estimated_remaining, capacity_source, empty_at)
+                    VALUES (:motor_id, :computed_at, :last_refill, :daily_rate, :estimated_remaining,
+                            :capacity_source, :empty_at)
+                """, forecasts)
+                conn.commit()
+                return len(forecasts)
+            finally:
+                conn.close()
+
+    def get_forecast(self, visit_days: Optional[float] = None, now: Optional[datetime] = None) -> Dict:
+        """
+        Stored forecasts ordered by expected empty time, with the motors to refill
+        on the next visit (empty before now + visit_days; by default the typical gap
+        between refill windows)
+        """
+        now = now or datetime.now()
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.cursor()
+            if visit_days is None:
+                visit_days = self._typical_visit_days(cursor)
+            cursor.execute("""
+                SELECT f.motor_id, m.position, m.product_name, f.daily_rate, f.estimated_remaining,
+                       f.capacity_source, f.empty_at, f.computed_at
+                FROM motor_refill_forecast f
+                LEFT JOIN motors m ON m.motor_id = f.motor_id
+                ORDER BY f.empty_at IS NULL, f.empty_at, f.motor_id
+            """)
+            rows = cursor.fetchall()
+        finally:
+            conn.close()
+
+        next_visit = now + timedelta(days=visit_days)
+        motors = []
+        for motor_id, position, product_name, daily_rate, remaining, source, empty_at, computed_at in rows:
+            empty_time = datetime.fromisoformat(empty_at) if empty_at else None
+            motors.append({
+                "motor_id": motor_id,
+                "position": position or f"M{motor_id}",
+                "product_name": product_name,
+                "daily_rate": daily_rate,
+                "estimated_remaining": remaining,
+                "capacity_source": source,
+                "empty_at": empty_time.isoformat() if empty_time else None,
+                "hours_to_empty": max((empty_time - now).total_seconds() / 3600, 0.0) if empty_time else None,
+                "refill_next_visit": empty_time is not None and empty_time <= next_visit,
+                "computed_at": computed_at
+            })
+
+        return {
+            "motors": motors,
+            "visit_days": visit_days,
+            "refill_next_visit": [motor["motor_id"] for motor in motors if motor["refill_next_visit"]],
+            "last_updated": now.isoformat()
+        }
+
+    def _compute_forecasts(self, cursor: sqlite3.Cursor, motor_ids: List[int], now: datetime) -> List[Dict]:
+        """
+        One forecast row per motor from motor_stock, motor_daily_stats and motor_hourly_profile
+        """
+        if not motor_ids:
+            return []
+
+        placeholders = ",".join("?" * len(motor_ids))
+        cursor.execute(f"""
+            SELECT motor_id, last_refill, sold_since_refill, last_stockout, estimated_capacity
+            FROM motor_stock WHERE motor_id IN ({placeholders})
+        """, motor_ids)
+        stock = {row[0]: row[1:] for row in cursor.fetchall()}
+
+        cursor.execute("SELECT estimated_capacity FROM motor_stock WHERE estimated_capacity IS NOT NULL")
+        capacities = [row[0] for row in cursor.fetchall()]
+        fleet_capacity = statistics.median(capacities) if capacities else None
+
+        # Units sold since the last visit, for motors without a stockout on record
+        cursor.execute("SELECT MAX(end_datetime) FROM refill_windows")
+        last_visit = cursor.fetchone()[0]
+        sold_since_visit = {}
+        if last_visit:
+            cursor.execute(f"""
+                SELECT motor_id, COUNT(*) FROM sales
+                WHERE sale_datetime >= ? AND motor_id IN ({placeholders})
+                GROUP BY motor_id
+            """, [last_visit] + motor_ids)
+            sold_since_visit = dict(cursor.fetchall())
+
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        short_start = (today - timedelta(days=VELOCITY_SHORT_DAYS - 1)).strftime("%Y-%m-%d")
+        long_start = (today - timedelta(days=VELOCITY_LONG_DAYS - 1)).strftime("%Y-%m-%d")
+        cursor.execute(f"""
+            SELECT motor_id,
+                   COALESCE(SUM(CASE WHEN day >= ? THEN sales_count END), 0),
+                   COALESCE(SUM(sales_count), 0)
+            FROM motor_daily_stats
+            WHERE motor_id IN ({placeholders}) AND day >= ?
+            GROUP BY motor_id
+        """, [short_start] + motor_ids + [long_start])
+        recent_sales = {row[0]: row[1:] for row in cursor.fetchall()}
+
+        cursor.execute(f"""
+            SELECT motor_id, weekday, SUM(sales_count)
+            FROM motor_hourly_profile
+            WHERE motor_id IN ({placeholders})
+            GROUP BY motor_id, weekday
+        """, motor_ids)
+        weekday_counts = {}
+        for motor_id, weekday, count in cursor.fetchall():
+            weekday_counts.setdefault(motor_id, [0] * 7)[weekday] = count
+
+        forecasts = []
+        for motor_id in motor_ids:
+            last_refill, sold_since_refill, last_stockout, capacity = stock.get(motor_id, (None, 0, None, None))
+            short_sales, long_sales = recent_sales.get(motor_id, (0, 0))
+            daily_rate = (VELOCITY_SHORT_WEIGHT * short_sales / VELOCITY_SHORT_DAYS
+                          + (1 - VELOCITY_SHORT_WEIGHT) * long_sales / VELOCITY_LONG_DAYS)
+
+            source = None
+            remaining = None
+            empty_at = None
+            if last_stockout and last_refill is None:
+                # Ran out and not refilled since
+                source = "stockout"
+                remaining = 0.0
+                empty_at = last_stockout
+            else:
+                if capacity is not None:
+                    source = "motor"
+                elif fleet_capacity is not None and last_visit:
+                    source, capacity = "fleet", fleet_capacity
+                    if not last_stockout:
+                        sold_since_refill = sold_since_visit.get(motor_id, 0)
+                if source:
+                    remaining = float(max(capacity - sold_since_refill, 0))
+                    hours = _hours_to_empty(remaining, daily_rate,
+                                            _weekday_factors(weekday_counts.get(motor_id, [0] * 7)), now)
+                    if hours is not None:
+                        empty_at = (now + timedelta(hours=hours)).strftime(SQL_TIMESTAMP_FORMAT)
+
+            forecasts.append({
+                "motor_id": motor_id,
+                "computed_at": now.strftime(SQL_TIMESTAMP_FORMAT),
+                "last_refill": last_refill,
+                "daily_rate": round(daily_rate, 4),
+                "estimated_remaining": remaining,
+                "capacity_source": source,
+                "empty_at": empty_at
+            })
+        return forecasts
+
+    def _typical_visit_days(self, cursor: sqlite3.Cursor, visits: int = 10) -> float:
+        """
+        Median gap in days between the last operator visits, DEFAULT_VISIT_DAYS without enough of them
+        Refill windows less than VISIT_MERGE_HOURS apart count as one visit.
+        """
+        cursor.execute("""
+            SELECT end_datetime FROM refill_windows
+            WHERE end_datetime IS NOT NULL
+            ORDER BY end_datetime DESC
+        """)
+        gaps = []
+        later = None
+        for (end_datetime,) in cursor:
+            moment = datetime.fromisoformat(end_datetime)
+            if later is None:
+                later = moment
+            elif later - moment >= timedelta(hours=VISIT_MERGE_HOURS):
+                gaps.append((later - moment).total_seconds() / 86400)
+                later = moment
+                if len(gaps) == visits:
+                    break
+            else:
+                later = moment  # same visit: measure from its first window
+        return round(statistics.median(gaps), 2) if gaps else DEFAULT_VISIT_DAYS
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Statistics Query Module
+Dimension/metric queries on sales planned against the coarsest rollup able to answer them
+"""
+
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+import sqlite3
+
+from data_processor import sale_datetime_conditions
+
+# Sources from the coarsest to raw sales: (table, alias, period column)
+SOURCES = [
+    ("sales_daily_stats", "d", "d.day"),
+    ("sales_hourly_stats", "h", "h.hour"),
+    ("sales", "s", "s.sale_datetime"),
+]
+
+# Dimension name -> SQL expression per source alias; a missing alias means the source cannot answer it.
+# Rollups store '' / 0 for missing product, payment method and brand, raw sales store NULL.
+DIMENSIONS: Dict[str, Dict[str, str]] = {
+    "day": {"d": "d.day", "h": "substr(h.hour, 1, 10)", "s": "substr(s.sale_datetime, 1, 10)"},
+    "week": {"d": "strftime('%Y-%W', d.day)", "h": "strftime('%Y-%W', substr(h.hour, 1, 10))",
+             "s": "strftime('%Y-%W', s.sale_datetime)"},
+    "month": {"d": "substr(d.day, 1, 7)", "h": "substr(h.hour, 1, 7)", "s": "substr(s.sale_datetime, 1, 7)"},
+    "weekday": {"d": "CAST(strftime('%w', d.day) AS INTEGER)",
+                "h": "CAST(strftime('%w', substr(h.hour, 1, 10)) AS INTEGER)",
+                "s": "CAST(strftime('%w', s.sale_datetime) AS INTEGER)"},
+    "hour": {"h": "h.hour || ':00'", "s": "substr(s.sale_datetime, 1, 13) || ':00'"},
+    "hour_of_day": {"h": "CAST(substr(h.hour, 12, 2) AS INTEGER)",
+                    "s": "CAST(substr(s.sale_datetime, 12, 2) AS INTEGER)"},
+    "motor": {"d": "d.motor_id", "h": "h.motor_id", "s": "s.motor_id"},
+    "product": {"d": "NULLIF(d.product_name, '')", "h": "NULLIF(h.product_name, '')",
+                "s": "NULLIF(TRIM(s.product_name), '')"},
+    "brand": {"d": "pb.brand_name", "h": "pb.brand_name", "s": "pb.brand_name"},
+    "payment_method": {"d": "NULLIF(d.payment_method, '')", "h": "NULLIF(h.payment_method, '')",
+                       "s": "s.payment_method"},
+    "price": {"s": "s.price"},
+}
+
+# Dimensions ordered chronologically instead of by the first metric
+TIME_DIMENSIONS = {"day", "week", "month", "weekday", "hour", "hour_of_day"}
+
+METRICS: Dict[str, Dict[str, str]] = {
+    "count": {"rollup": "SUM({a}.sales_count)", "s": "COUNT(*)"},
+    "revenue": {"rollup": "ROUND(SUM({a}.revenue), 2)", "s": "ROUND(SUM(s.price), 2)"},
+    "avg_price": {"rollup": "ROUND(SUM({a}.revenue) / SUM({a}.sales_count), 2)", "s": "ROUND(AVG(s.price), 2)"},
+}
+
+MAX_DIMENSIONS = 3
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 10000
+
+
+def _check_date(value: Optional[str], name: str) -> Optional[str]:
+    if value:
+        try:
+            datetime.strptime(value, "%Y-%m-%d")
+        except ValueError:
+            raise ValueError(f"{name} must be a date in YYYY-MM-DD format")
+    return value or None
+
+
+class StatisticsQuery:
+    """
+    Group-by queries over sales for the statistics view
+
+    A request names dimensions (group) and metrics over an optional day range. The
+    planner picks the first source in SOURCES exposing every requested dimension:
+    sales_daily_stats for calendar, motor, product, brand and payment slices,
+    sales_hourly_stats once an hour is involved, raw sales only for dimensions the
+    rollups do not keep (the sale price). Results are capped at limit rows.
+    """
+
+    def __init__(self, db_path: str = "sales_data.db"):
+        self.db_path = db_path
+
+    def plan(self, group: Sequence[str], metrics: Sequence[str], date_from: Optional[str] = None,
+             date_to: Optional[str] = None, limit: int = DEFAULT_LIMIT) -> Tuple[str, str, List]:
+        """
+        Validate the request and build its SQL, returns (source table, sql, params)
+        Raises ValueError on unknown dimensions or metrics and malformed dates.
+        """
+        group = list(dict.fromkeys(group))
+        metrics = list(dict.fromkeys(metrics)) or ["count"]
+        unknown = [name for name in group if name not in DIMENSIONS]
+        unknown += [name for name in metrics if name not in METRICS]
+        if unknown:
+            raise ValueError(f"Unknown dimensions or metrics: {', '.join(unknown)}")
+        if len(group) > MAX_DIMENSIONS:
+            raise ValueError(f"At most {MAX_DIMENSIONS} dimensions can be grouped at once")
+        if not 1 <= limit <= MAX_LIMIT:
+            raise ValueError(f"limit must be between 1 and {MAX_LIMIT}")
+        date_from = _check_date(date_from, "from")
+        date_to = _check_date(date_to, "to")
+
+        table, alias, period = next(source for source in SOURCES
+                                    if all(source[1] in DIMENSIONS[name] for name in group))
+
+        columns = [f"{DIMENSIONS[name][alias]} AS {name}" for name in group]
+        for name in metrics:
+            expression = METRICS[name]["s"] if alias == "s" else METRICS[name]["rollup"].format(a=alias)
+            columns.append(f"{expression} AS {name}")
+
+        join_clause = f"LEFT JOIN product_brands pb ON pb.id = {alias}.brand_id" if "brand" in group else ""
+        conditions, params = sale_datetime_conditions(date_from, date_to, column=period)
+        where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
+        group_clause = "GROUP BY " + ", ".join(str(i + 1) for i in range(len(group))) if group else ""
+        if any(name in TIME_DIMENSIONS for name in group):
+            order_clause = "ORDER BY " + ", ".join(str(i + 1) for i in range(len(group)))
+        else:
+            order_clause = f"ORDER BY {metrics[0]} DESC"
+
+        # One row past the limit tells whether the result was truncated
+        sql = f"""
+            SELECT {', '.join(columns)}
+            FROM {table} {alias}
+            {join_clause}
+            {where_clause}
+            {group_clause}
+            {order_clause}
+            LIMIT ?
+        """
+        return table, sql, params + [limit + 1]
+
+    def run(self, group: Sequence[str], metrics: Sequence[str], date_from: Optional[str] = None,
+            date_to: Optional[str] = None, limit: int = DEFAULT_LIMIT) -> Dict:
+        """
+        Execute a query, returns the rows as dicts with the source and truncation flag
+        """
+        group = list(dict.fromkeys(group))
+        source, sql, params = self.plan(group, metrics, date_from, date_to, limit)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.execute(sql, params)
+            names = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+        finally:
+            conn.close()
+
+        return {
+            "group": group,
+            "metrics": names[len(group):],
+            "source": source,
+            "rows": [dict(zip(names, row)) for row in rows[:limit]],
+            "truncated": len(rows) > limit,
+            "limit": limit
+        }
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the bounded LRU + TTL analytics cache
+"""
+
+import pytest
+import tempfile
+import threading
+import time
+from datetime import timedelta
+import os
+import sys
+
+# Add parent directory to path to import analytics_cache
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics_cache import AnalyticsCache
+
+
+class TestAnalyticsCache:
+    """Eviction, expiry, single-flight and counters"""
+
+    def test_lru_eviction(self):
+        """The least recently used entry goes when the cache is full"""
+        cache = AnalyticsCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        assert cache.get('a') == 1  # 'b' becomes least recently used
+        cache.set('c', 3)
+
+        assert 'b' not in cache
+        assert cache.get('a') == 1 and cache.get('c') == 3
+        assert cache.stats()['evictions'] == 1
+
+    def test_ttl_expiry(self):
+        """Expired entries are misses and are dropped on lookup"""
+        cache = AnalyticsCache(ttl=timedelta(milliseconds=20))
+        cache.set('a', 1)
+        time.sleep(0.03)
+
+        assert cache.get('a') is None
+        assert len(cache) == 0
+        assert cache.stats()['expirations'] == 1
+
+    def test_hit_miss_counters(self):
+        """get_or_compute counts one miss, then hits"""
+        cache = AnalyticsCache()
+        calls = []
+
+        for _ in range(3):
+            assert cache.get_or_compute('k', lambda: calls.append(1) or 42) == 42
+
+        stats = cache.stats()
+        assert len(calls) == 1
+        assert (stats['hits'], stats['misses']) == (2, 1)
+        assert stats['hit_ratio'] == pytest.approx(2 / 3, abs=1e-4)
+
+    def test_single_flight(self):
+        """Concurrent misses on one key run the computation once"""
+        cache = AnalyticsCache()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(1)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('k', compute)))
+                   for _ in range(5)]
+        threads[0].start()
+        started.wait(1)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join(1)
+
+        assert calls == [1]
+        assert results == ['value'] * 5
+        assert cache.stats()['coalesced'] == 4
+
+    def test_errors_not_cached(self):
+        """A failing computation propagates and the next call retries"""
+        cache = AnalyticsCache()
+
+        with pytest.raises(ValueError):
+            cache.get_or_compute('k', lambda: (_ for _ in ()).throw(ValueError('boom')))
+
+        assert cache.get_or_compute('k', lambda: 7) == 7
+
+    def test_invalidate_during_compute(self):
+        """A result computed before an invalidation is returned but not stored"""
+        cache = AnalyticsCache()
+
+        def compute():
+            cache.invalidate('k')
+            return 'stale'
+
+        assert cache.get_or_compute('k', compute) == 'stale'
+        assert 'k' not in cache
+
+    def test_caller_after_invalidate_not_coalesced(self):
+        """A request arriving after an invalidation computes again instead of joining the stale flight"""
+        cache = AnalyticsCache()
+        started = threading.Event()
+        release = threading.Event()
+
+        def stale_compute():
+            started.set()
+            release.wait(1)
+            return 'stale'
+
+        results = {}
+        leader = threading.Thread(target=lambda: results.update(leader=cache.get_or_compute('k', stale_compute)))
+        leader.start()
+        started.wait(1)
+        cache.invalidate('k')
+
+        assert cache.get_or_compute('k', lambda: 'fresh') == 'fresh'
+        release.set()
+        leader.join(1)
+
+        assert results['leader'] == 'stale'
+        assert cache.get('k') == 'fresh'
+        assert cache.stats()['coalesced'] == 0
+
+
+class TestImportInvalidation:
+    """The import publishes touched motors and MotorAnalytics refreshes only those"""
+
+    @pytest.fixture
+    def analyzers(self):
+        """SalesAnalyzer and MotorAnalytics on the same temporary database"""
+        from data_processor import SalesAnalyzer
+        from motor_analytics import MotorAnalytics
+
+        db_fd, db_path = tempfile.mkstemp(suffix='.db')
+        os.close(db_fd)
+
+        yield SalesAnalyzer(db_path), MotorAnalytics(db_path)
+
+        os.unlink(db_path)
+
+    def test_listener_receives_touched_motors(self, analyzers):
+        """Only imports with new sales are published, with their motor ids"""
+        from tests.test_bulk_ingestion import SAMPLE_EVENTS
+        analyzer, _ = analyzers
+        published = []
+        analyzer.add_import_listener(published.append)
+
+        stats = analyzer.ingest_events(SAMPLE_EVENTS)
+        analyzer.ingest_events(SAMPLE_EVENTS)
+
+        assert published == [{12, 80}]
+        assert stats['motor_ids'] == [12, 80]
+
+    def test_touched_motors_recomputed(self, analyzers):
+        """Touched motors and the status grid are refreshed, other entries stay cached"""
+        from tests.test_bulk_ingestion import SAMPLE_EVENTS
+        analyzer, motor_analytics = analyzers
+        analyzer.ingest_events(SAMPLE_EVENTS[5:])  # 17/09 transaction: motor 80 only
+
+        threads = []
+        analyzer.add_import_listener(lambda motor_ids: threads.append(motor_analytics.invalidate_motors(motor_ids)))
+
+        motor_analytics.get_motor_analytics(80)
+        motor_analytics.get_all_motor_status()
+        misses_before = motor_analytics.cache.stats()['misses']
+
+        analyzer.ingest_events(SAMPLE_EVENTS)  # adds the 18/09 sale on motor 12
+        for thread in threads:
+            thread.join(5)
+
+        status = motor_analytics.get_all_motor_status()
+        stats = motor_analytics.cache.stats()
+        assert [motor['motor_id'] for motor in status['motors']] == [12, 80]
+        assert 'motor_analytics_80' in motor_analytics.cache
+        assert 'motor_analytics_12' in motor_analytics.cache
+        # Recomputed in the background: one miss per touched motor plus the grid
+        assert stats['misses'] - misses_before == 2
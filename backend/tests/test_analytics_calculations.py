@@ -241,6 +241,40 @@ class TestAnalyticsCalculations:
         assert 'last_updated' in result
         assert isinstance(result['motors'], list)
 
+    def test_bulk_motor_status_matches_per_motor(self, temp_db):
+        """Bulk status agrees with per-motor analytics and uses two queries"""
+        if MotorAnalytics is None:
+            pytest.skip("MotorAnalytics module not implemented yet")
+
+        analytics = MotorAnalytics(temp_db)
+        statements = []
+        connect = sqlite3.connect
+
+        def traced_connect(*args, **kwargs):
+            conn = connect(*args, **kwargs)
+            conn.set_trace_callback(statements.append)
+            return conn
+
+        sqlite3.connect = traced_connect
+        try:
+            result = analytics.get_all_motor_status()
+        finally:
+            sqlite3.connect = connect
+
+        bulk = {motor['motor_id']: motor['status_indicator'] for motor in result['motors']}
+        assert len(statements) == 2
+        assert bulk == {
+            motor_id: analytics.get_motor_analytics(motor_id)['status_indicator']
+            for motor_id in range(1, 11)
+        }
+        assert [bulk[motor_id] for motor_id in (1, 2, 3, 4, 5)] == ['red', 'green', 'red', 'neutral', 'neutral']
+
+        metrics = analytics.get_bulk_motor_metrics()
+        pattern = analytics.calculate_sales_pattern(1)
+        assert metrics[1]['sales_pattern']['sales_count'] == pattern['sales_count']
+        assert metrics[1]['sales_pattern']['average_interval_hours'] == pytest.approx(pattern['average_interval_hours'])
+        assert metrics[2]['week'] == analytics.get_motor_analytics(2)['week']
+
     def test_analytics_caching_mechanism(self, temp_db):
         """Test that analytics caching improves performance"""
         if MotorAnalytics is None:
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Tests for the basket size and co-purchase counts maintained per completed transaction
+"""
+
+import pytest
+import sqlite3
+import os
+import sys
+
+# Add parent directory to path to import data_processor
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processor import BasketCounts
+from tests.test_statistics_rollups import DATE_RANGES, analyzer  # noqa: F401 (fixture)
+
+BASKET_TABLES = ('basket_size_daily_stats', 'basket_product_daily_stats', 'basket_pair_daily_stats')
+
+
+def transaction_filter(date_from, date_to):
+    conditions, params = ['t.is_complete = 1'], []
+    if date_from:
+        conditions.append("date(t.start_ts, 'unixepoch') >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("date(t.start_ts, 'unixepoch') <= ?")
+        params.append(date_to)
+    return ' AND '.join(conditions), params
+
+
+def raw_basket_sizes(db_path, date_from, date_to):
+    """basket size -> transactions, grouping sales by transaction"""
+    where_clause, params = transaction_filter(date_from, date_to)
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(f'''
+        SELECT size, COUNT(*) FROM (
+            SELECT COUNT(*) as size FROM transactions t JOIN sales s ON s.transaction_id = t.id
+            WHERE {where_clause} GROUP BY t.id
+        ) GROUP BY size
+    ''', params).fetchall()
+    conn.close()
+    return dict(rows)
+
+
+def raw_pairs(db_path, date_from, date_to):
+    """(product_a, product_b) -> transactions containing both, with a self-join on sales"""
+    where_clause, params = transaction_filter(date_from, date_to)
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(f'''
+        SELECT a.product_name, b.product_name, COUNT(DISTINCT t.id)
+        FROM transactions t
+        JOIN sales a ON a.transaction_id = t.id
+        JOIN sales b ON b.transaction_id = t.id AND a.product_name < b.product_name
+        WHERE {where_clause}
+        GROUP BY 1, 2
+    ''', params).fetchall()
+    conn.close()
+    return {(a, b): count for a, b, count in rows}
+
+
+def basket_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = [conn.execute(f'SELECT * FROM {table} ORDER BY 1, 2, 3').fetchall() for table in BASKET_TABLES]
+    conn.close()
+    return rows
+
+
+class TestBasketCounts:
+    """Counting of a single basket"""
+
+    def test_distinct_products(self):
+        """Repeated products count once in products and pairs, every item in the size"""
+        baskets = BasketCounts()
+        baskets.add('2025-11-10', [('CAMEL BLUE', 5.5), ('CAMEL BLUE', 5.5), ('WINSTON BLUE', 5.3)])
+        baskets.add('2025-11-10', [('WINSTON BLUE', 5.3)])
+
+        assert baskets.sizes == {('2025-11-10', 3): 1, ('2025-11-10', 1): 1}
+        assert baskets.revenue[('2025-11-10', 3)] == pytest.approx(16.3)
+        assert baskets.products == {('2025-11-10', 'CAMEL BLUE'): 1, ('2025-11-10', 'WINSTON BLUE'): 2}
+        assert baskets.pairs == {('2025-11-10', 'CAMEL BLUE', 'WINSTON BLUE'): 1}
+
+
+class TestBasketStatistics:
+    """Basket statistics served from the basket_* tables"""
+
+    @pytest.mark.parametrize('date_from,date_to', DATE_RANGES)
+    def test_matches_raw_sales(self, analyzer, date_from, date_to):
+        """Size distribution and pair counts equal grouping and self-joining sales"""
+        stats = analyzer.get_basket_statistics(date_from, date_to, limit=1000)
+        expected_sizes = raw_basket_sizes(analyzer.db_path, date_from, date_to)
+        expected_pairs = raw_pairs(analyzer.db_path, date_from, date_to)
+
+        assert {row['basket_size']: row['transactions'] for row in stats['basket_sizes']} == expected_sizes
+        assert stats['total_transactions'] == sum(expected_sizes.values())
+        assert stats['multi_item_transactions'] == sum(count for size, count in expected_sizes.items() if size > 1)
+        assert {(row['product_a'], row['product_b']): row['transactions']
+                for row in stats['product_pairs']} == expected_pairs
+
+    def test_pair_measures(self, analyzer):
+        """Pairs are ordered by co-purchases, confidence and lift come from the product counts"""
+        stats = analyzer.get_basket_statistics(limit=5)
+        pairs = stats['product_pairs']
+
+        assert len(pairs) == 5
+        assert [pair['transactions'] for pair in pairs] == sorted((pair['transactions'] for pair in pairs),
+                                                                   reverse=True)
+        conn = sqlite3.connect(analyzer.db_path)
+        top = pairs[0]
+        count_a, count_b = (conn.execute('''
+            SELECT COUNT(DISTINCT t.id) FROM transactions t JOIN sales s ON s.transaction_id = t.id
+            WHERE t.is_complete = 1 AND s.product_name = ?
+        ''', (product,)).fetchone()[0] for product in (top['product_a'], top['product_b']))
+        conn.close()
+        assert top['confidence_a_to_b'] == pytest.approx(top['transactions'] / count_a, abs=1e-4)
+        assert top['confidence_b_to_a'] == pytest.approx(top['transactions'] / count_b, abs=1e-4)
+        assert top['lift'] == pytest.approx(top['transactions'] * stats['total_transactions'] / (count_a * count_b),
+                                            abs=0.01)
+
+    def test_incremental_matches_rebuild(self, analyzer):
+        """Counts accumulated across imports equal a rebuild from sales"""
+        incremental = basket_rows(analyzer.db_path)
+
+        conn = sqlite3.connect(analyzer.db_path)
+        analyzer.update_basket_stats(conn.cursor())
+        conn.commit()
+        conn.close()
+
+        rebuilt = basket_rows(analyzer.db_path)
+        assert [len(rows) for rows in incremental] == [len(rows) for rows in rebuilt]
+        for got, expected in zip(incremental, rebuilt):
+            for got_row, expected_row in zip(got, expected):
+                assert got_row[:-1] == expected_row[:-1]
+                assert got_row[-1] == pytest.approx(expected_row[-1])
+
+    def test_baskets_endpoint(self, analyzer, monkeypatch):
+        """/api/statistics/baskets serves the maintained counts, 400 on a bad limit"""
+        import api_server
+        monkeypatch.setattr(api_server, 'analyzer', analyzer)
+
+        with api_server.app.test_client() as client:
+            response = client.get('/api/statistics/baskets?date_from=2025-11-10&limit=3')
+            invalid = client.get('/api/statistics/baskets?limit=0')
+
+        assert response.status_code == 200
+        assert response.get_json() == analyzer.get_basket_statistics('2025-11-10', None, 3)
+        assert invalid.status_code == 400
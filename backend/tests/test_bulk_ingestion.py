@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Integration tests for the single-transaction bulk ingestion path
+"""
+
+import pytest
+import sqlite3
+import tempfile
+import json
+import os
+import sys
+
+# Add parent directory to path to import data_processor
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import date, timedelta
+
+from data_processor import FULL_RESYNC_DAYS, SalesAnalyzer
+from event_stream import iter_events_file
+
+
+# Events as returned by the machine: newest first
+SAMPLE_EVENTS = [
+    {"code": "V", "dateTime": "18/09/25 10:00:21", "number": "110", "type": "RESTO", "text": "0.50 euro"},
+    {"code": "V", "dateTime": "18/09/25 10:00:15", "number": "109", "type": "EVENTO",
+     "text": "EROGAZIONE IN CORSO - MOTORE: 12 - PREZZO: 5.50 euro (CAMEL BLUE)"},
+    {"code": "V", "dateTime": "18/09/25 10:00:10", "number": "108", "type": "MONETA",
+     "text": "MONETA: 2.00 euro --- CREDITO: 6.00 euro"},
+    {"code": "V", "dateTime": "18/09/25 10:00:08", "number": "107", "type": "BANCONOTA",
+     "text": "BANCONOTA: 4.00 euro --- CREDITO: 4.00 euro"},
+    {"code": "V", "dateTime": "18/09/25 10:00:00", "number": "106", "type": "EVENTO", "text": "TESSERA VALIDA"},
+    {"code": "V", "dateTime": "17/09/25 19:14:15", "number": "105", "type": "EVENTO",
+     "text": "EROGAZIONE IN CORSO - MOTORE: 80 - PREZZO: 6.20 euro (MARLBORO GOLD TOUCH KS)"},
+    {"code": "V", "dateTime": "17/09/25 19:14:14", "number": "104", "type": "EVENTO",
+     "text": "EROGAZIONE IN CORSO - MOTORE: 80 - PREZZO: 6.20 euro (MARLBORO GOLD TOUCH KS)"},
+    {"code": "V", "dateTime": "17/09/25 19:14:10", "number": "103", "type": "POS",
+     "text": "CREDITO POS: 12.40 euro --- CREDITO: 12.40 euro"},
+    {"code": "V", "dateTime": "17/09/25 19:14:00", "number": "102", "type": "EVENTO", "text": "IMPRONTA VALIDA"},
+    {"code": "V", "dateTime": "17/09/25 08:00:00", "number": "101", "type": "PROGRAMMAZIONE",
+     "text": "INGRESSO PROGRAMMAZIONE"},
+]
+
+
+class TestBulkIngestion:
+    """Integration tests for SalesAnalyzer.ingest_events / process_events_file"""
+
+    @pytest.fixture
+    def analyzer(self):
+        """Create an analyzer backed by a temporary database"""
+        db_fd, db_path = tempfile.mkstemp(suffix='.db')
+        os.close(db_fd)
+
+        yield SalesAnalyzer(db_path)
+
+        os.unlink(db_path)
+
+    @pytest.fixture
+    def events_file(self):
+        """Write the sample events in the _complete.json shape"""
+        fd, path = tempfile.mkstemp(suffix='_complete.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'events_data': SAMPLE_EVENTS, 'events_count': len(SAMPLE_EVENTS)}, f)
+
+        yield path
+
+        os.unlink(path)
+
+    def test_transactions_rebuilt_in_chronological_order(self, analyzer):
+        """Newest-first payloads must still group sales with their own payments"""
+        stats = analyzer.ingest_events(SAMPLE_EVENTS)
+
+        assert stats['new_events'] == len(SAMPLE_EVENTS)
+        assert stats['transactions'] == 2
+        assert stats['sales'] == 3
+
+        conn = sqlite3.connect(analyzer.db_path)
+        rows = conn.execute('''
+            SELECT start_datetime, payment_method, total_paid, total_change, net_revenue
+            FROM transactions ORDER BY id
+        ''').fetchall()
+        conn.close()
+
+        assert rows == [
+            ('17/09/25 19:14:00', 'POS', 12.4, 0, 12.4),
+            ('18/09/25 10:00:00', 'CASH', 6.0, 0.5, 5.5),
+        ]
+
+    def test_events_linked_to_transactions(self, analyzer):
+        """Every event of a transaction is stored with its transaction_id"""
+        analyzer.ingest_events(SAMPLE_EVENTS)
+
+        conn = sqlite3.connect(analyzer.db_path)
+        linked = conn.execute('''
+            SELECT event_number, transaction_id FROM events
+            WHERE transaction_id IS NOT NULL ORDER BY CAST(event_number AS INTEGER)
+        ''').fetchall()
+        unlinked = conn.execute('SELECT event_number FROM events WHERE transaction_id IS NULL').fetchall()
+        conn.close()
+
+        assert [number for number, _ in linked] == [str(n) for n in range(102, 111)]
+        assert len({tx_id for number, tx_id in linked if int(number) < 106}) == 1
+        assert unlinked == [('101',)]
+
+    def test_reimport_is_idempotent(self, analyzer, events_file):
+        """Importing the same file twice does not duplicate rows"""
+        first = analyzer.process_events_file(events_file)
+        second = analyzer.process_events_file(events_file)
+
+        assert first['sales'] == 3
+        assert second['new_events'] == 0
+        assert second['sales'] == 0
+
+        conn = sqlite3.connect(analyzer.db_path)
+        counts = [conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                  for table in ('events', 'transactions', 'sales')]
+        conn.close()
+
+        assert counts == [len(SAMPLE_EVENTS), 2, 3]
+
+    def test_reports_throughput(self, analyzer, events_file):
+        """The import reports events/second"""
+        stats = analyzer.process_events_file(events_file)
+
+        assert stats['events_read'] == len(SAMPLE_EVENTS)
+        assert stats['events_per_second'] > 0
+
+    def test_replay_older_archive(self, analyzer, events_file, capsys):
+        """An archive older than the watermark is skipped with a message, or imported without the watermark"""
+        analyzer.ingest_events(SAMPLE_EVENTS[:5])
+
+        skipped = analyzer.process_events_file(events_file)
+        assert (skipped['new_events'], skipped['skipped_events']) == (0, 5)
+        assert '5 eventi ignorati' in capsys.readouterr().out
+
+        replayed = analyzer.process_events_file(events_file, use_watermark=False)
+        assert (replayed['new_events'], replayed['sales']) == (5, 2)
+
+    def test_process_events_endpoint_without_watermark(self, analyzer, events_file, monkeypatch):
+        """/api/process-events passes use_watermark through and reports skipped events"""
+        import api_server
+        monkeypatch.setattr(api_server, 'analyzer', analyzer)
+        analyzer.ingest_events(SAMPLE_EVENTS[:5])
+
+        with api_server.app.test_client() as client:
+            skipped = client.post('/api/process-events', json={'file': events_file})
+            invalid = client.post('/api/process-events', json={'file': events_file, 'use_watermark': 'no'})
+            replayed = client.post('/api/process-events', json={'file': events_file, 'use_watermark': False})
+
+        assert skipped.get_json()['skipped_events'] == 5 and skipped.get_json()['new_events'] == 0
+        assert invalid.status_code == 400
+        assert replayed.get_json()['new_events'] == 5
+
+
+class TestStreamingReader:
+    """Tests for the incremental event file reader"""
+
+    @pytest.fixture
+    def write_json(self):
+        """Write a payload to a temporary file and return its path"""
+        paths = []
+
+        def _write(payload, **dump_kwargs):
+            fd, path = tempfile.mkstemp(suffix='.json')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, **dump_kwargs)
+            paths.append(path)
+            return path
+
+        yield _write
+
+        for path in paths:
+            os.unlink(path)
+
+    def test_reads_bare_list(self, write_json):
+        """_events_only.json shape"""
+        path = write_json(SAMPLE_EVENTS, indent=2)
+
+        assert list(iter_events_file(path)) == SAMPLE_EVENTS
+
+    def test_reads_complete_payload(self, write_json):
+        """_complete.json shape, with other keys before and after events_data"""
+        path = write_json({
+            'download_info': {'html_size': 1234, 'nested': [{'x': ']'}]},
+            'events_data': SAMPLE_EVENTS,
+            'events_count': len(SAMPLE_EVENTS)
+        })
+
+        assert list(iter_events_file(path)) == SAMPLE_EVENTS
+
+    def test_empty_payloads(self, write_json):
+        """Files without events yield nothing"""
+        assert list(iter_events_file(write_json([]))) == []
+        assert list(iter_events_file(write_json({'events_data': []}))) == []
+        assert list(iter_events_file(write_json({'error': 'Non autenticato'}))) == []
+
+    def test_small_chunks_match_single_chunk(self, write_json):
+        """Chunked ingestion builds the same transactions across chunk boundaries"""
+        db_fd, db_path = tempfile.mkstemp(suffix='.db')
+        os.close(db_fd)
+
+        try:
+            analyzer = SalesAnalyzer(db_path)
+            stats = analyzer.ingest_events(iter_events_file(write_json(SAMPLE_EVENTS)), chunk_size=2)
+
+            assert stats['events_read'] == len(SAMPLE_EVENTS)
+            assert stats['transactions'] == 2
+            assert stats['sales'] == 3
+        finally:
+            os.unlink(db_path)
+
+
+class TestWatermark:
+    """Tests for the persisted import high-water mark"""
+
+    @pytest.fixture
+    def analyzer(self):
+        """Create an analyzer with the sample events already imported"""
+        db_fd, db_path = tempfile.mkstemp(suffix='.db')
+        os.close(db_fd)
+
+        analyzer = SalesAnalyzer(db_path)
+        analyzer.ingest_events(SAMPLE_EVENTS)
+
+        yield analyzer
+
+        os.unlink(db_path)
+
+    def test_watermark_persisted(self, analyzer):
+        """The last imported event is stored in system_status"""
+        assert analyzer.get_system_status('last_event_datetime')['value'] == '2025-09-18 10:00:21'
+        assert analyzer.get_system_status('last_event_number')['value'] == '110'
+
+    def test_events_below_watermark_skipped(self, analyzer):
+        """Events older than the overlap window never reach the database"""
+        stats = analyzer.ingest_events(SAMPLE_EVENTS)
+
+        # Only the 18/09 events fall inside the one-hour overlap window
+        assert stats['skipped_events'] == 5
+        assert stats['new_events'] == 0
+
+    def test_overlap_window_and_new_events(self, analyzer):
+        """Events near the mark are deduplicated, later events are imported"""
+        newer = [
+            {"code": "V", "dateTime": "18/09/25 11:00:05", "number": "112", "type": "EVENTO",
+             "text": "EROGAZIONE IN CORSO - MOTORE: 12 - PREZZO: 5.50 euro (CAMEL BLUE)"},
+            {"code": "V", "dateTime": "18/09/25 11:00:01", "number": "111", "type": "POS",
+             "text": "CREDITO POS: 5.50 euro --- CREDITO: 5.50 euro"},
+            {"code": "V", "dateTime": "18/09/25 11:00:00", "number": "110", "type": "EVENTO", "text": "TESSERA VALIDA"},
+        ] + SAMPLE_EVENTS
+
+        stats = analyzer.ingest_events(newer)
+
+        assert stats['new_events'] == 3
+        assert stats['sales'] == 1
+        assert analyzer.get_event_watermark() == ('2025-09-18 11:00:05', 112)
+
+    def test_download_window_from_watermark(self, analyzer):
+        """Downloads restart one day before the last imported event, full resync goes back 30 days"""
+        today = date(2025, 9, 25)
+
+        assert analyzer.get_download_start_date(today=today) == date(2025, 9, 17)
+        assert analyzer.get_download_start_date(full_resync=True, today=today) == date(2025, 8, 26)
+
+        db_fd, db_path = tempfile.mkstemp(suffix='.db')
+        os.close(db_fd)
+        try:
+            empty = SalesAnalyzer(db_path)
+            assert empty.get_download_start_date(today=today) == today - timedelta(days=FULL_RESYNC_DAYS)
+        finally:
+            os.unlink(db_path)
+
+    def test_full_resync_bypasses_watermark(self, analyzer):
+        """Without the watermark old events are read again and deduplicated by the database"""
+        stats = analyzer.ingest_events(SAMPLE_EVENTS, use_watermark=False)
+
+        assert stats['skipped_events'] == 0
+        assert stats['new_events'] == 0
+        assert stats['sales'] == 0
+
+
+class TestNormalizedTimestamps:
+    """Tests for the sortable epoch columns on events and transactions"""
+
+    @pytest.fixture
+    def analyzer(self):
+        """Create an analyzer with the sample events already imported"""
+        db_fd, db_path = tempfile.mkstemp(suffix='.db')
+        os.close(db_fd)
+
+        analyzer = SalesAnalyzer(db_path)
+        analyzer.ingest_events(SAMPLE_EVENTS)
+
+        yield analyzer
+
+        os.unlink(db_path)
+
+    def test_timestamps_filled_at_ingest(self, analyzer):
+        """start_ts/event_ts sort chronologically across days"""
+        conn = sqlite3.connect(analyzer.db_path)
+        starts = conn.execute('SELECT start_datetime FROM transactions ORDER BY start_ts DESC').fetchall()
+        missing = conn.execute('SELECT COUNT(*) FROM events WHERE event_ts IS NULL').fetchone()[0]
+        conn.close()
+
+        assert starts == [('18/09/25 10:00:00',), ('17/09/25 19:14:00',)]
+        assert missing == 0
+
+    def test_existing_rows_migrated(self, analyzer):
+        """Rows written without timestamps are filled when the database is opened"""
+        conn = sqlite3.connect(analyzer.db_path)
+        conn.execute('UPDATE events SET event_ts = NULL')
+        conn.execute('UPDATE transactions SET start_ts = NULL, end_ts = NULL')
+        conn.commit()
+        conn.close()
+
+        SalesAnalyzer(analyzer.db_path)
+
+        conn = sqlite3.connect(analyzer.db_path)
+        event_ts = conn.execute("SELECT event_ts FROM events WHERE event_number = '102'").fetchone()[0]
+        start_ts = conn.execute('SELECT MIN(start_ts) FROM transactions').fetchone()[0]
+        conn.close()
+
+        assert event_ts == start_ts == 1758136440  # 17/09/25 19:14:00
+
+    def test_payment_stats_filtered_by_date(self, analyzer):
+        """Transaction date filters are range scans on start_ts"""
+        overview = analyzer.get_statistics_overview('2025-09-18', '2025-09-18')
+
+        assert overview['payment_methods'] == {'CASH': {'count': 1, 'revenue': 5.5}}
+
+
+class TestMotorStats:
+    """Tests for the incremental motors table maintenance"""
+
+    @pytest.fixture
+    def analyzer(self):
+        """Create an analyzer with the sample events already imported"""
+        db_fd, db_path = tempfile.mkstemp(suffix='.db')
+        os.close(db_fd)
+
+        analyzer = SalesAnalyzer(db_path)
+        analyzer.ingest_events(SAMPLE_EVENTS)
+
+        yield analyzer
+
+        os.unlink(db_path)
+
+    def motors(self, analyzer):
+        conn = sqlite3.connect(analyzer.db_path)
+        rows = conn.execute('''
+            SELECT motor_id, product_name, price, last_sale_datetime, total_sales, position
+            FROM motors ORDER BY motor_id
+        ''').fetchall()
+        conn.close()
+        return rows
+
+    def test_stats_after_import(self, analyzer):
+        """Totals and last sale per motor, with the default position"""
+        assert self.motors(analyzer) == [
+            (12, 'CAMEL BLUE', 5.5, '2025-09-18 10:00:15', 1, 'M12'),
+            (80, 'MARLBORO GOLD TOUCH KS', 6.2, '2025-09-17 19:14:15', 2, 'M80'),
+        ]
+
+    def test_new_sales_added_and_position_kept(self, analyzer):
+        """Only the new sales are counted; product changes and position survive"""
+        conn = sqlite3.connect(analyzer.db_path)
+        conn.execute("UPDATE motors SET position = 'A1' WHERE motor_id = 12")
+        conn.commit()
+        conn.close()
+
+        analyzer.ingest_events([
+            {"code": "V", "dateTime": "18/09/25 11:00:05", "number": "113", "type": "EVENTO",
+             "text": "EROGAZIONE IN CORSO - MOTORE: 12 - PREZZO: 5.80 euro (CAMEL ORIGINAL)"},
+            {"code": "V", "dateTime": "18/09/25 11:00:01", "number": "112", "type": "POS",
+             "text": "CREDITO POS: 5.80 euro --- CREDITO: 5.80 euro"},
+            {"code": "V", "dateTime": "18/09/25 11:00:00", "number": "111", "type": "EVENTO", "text": "TESSERA VALIDA"},
+        ] + SAMPLE_EVENTS)
+
+        assert self.motors(analyzer)[0] == (12, 'CAMEL ORIGINAL', 5.8, '2025-09-18 11:00:05', 2, 'A1')
+
+        # A full rebuild agrees with the incremental totals
+        incremental = self.motors(analyzer)
+        analyzer.update_motor_stats()
+        assert self.motors(analyzer) == incremental
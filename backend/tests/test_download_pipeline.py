@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Tests for the in-process download -> ingest pipeline
+"""
+
+import pytest
+import sqlite3
+import tempfile
+import json
+import os
+import sys
+from datetime import date
+
+# Add parent directory to path to import data_processor
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cigarette_machine_client import DEFAULT_TIMEOUT, CigaretteMachineClient, SessionExpiredError
+from data_processor import EventArchiveWriter, SalesAnalyzer
+from event_stream import iter_events_file
+from download_events import download_and_parse_events
+from tests.test_bulk_ingestion import SAMPLE_EVENTS
+
+
+class FakeResponse:
+    """Streaming response returning the body in small text pieces"""
+
+    def __init__(self, body, piece_size=7):
+        self.body = body
+        self.piece_size = piece_size
+        self.encoding = None
+        self.closed = False
+        self.status_code = 200
+        self.url = ''
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for start in range(0, len(self.body), self.piece_size):
+            piece = self.body[start:start + self.piece_size]
+            yield piece if decode_unicode else piece.encode('utf-8')
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession:
+    """requests.Session stand-in recording the requested paths"""
+
+    def __init__(self, body='[]'):
+        self.body = body
+        self.paths = []
+        self.timeouts = []
+        self.headers = {}
+        # Next events2_query answer once the session expires: 'page' (login page) or 'status' (401)
+        self.expired = None
+
+    def _respond(self, url, text, status_code=200):
+        self.paths.append(url.split(':1500', 1)[1].split('?', 1)[0])
+        response = FakeResponse(text)
+        response.text = text
+        response.url = url
+        response.status_code = status_code
+        response.raise_for_status = lambda: None
+        return response
+
+    def get(self, url, **kwargs):
+        self.timeouts.append(kwargs.get('timeout'))
+        if 'events2_query' not in url:
+            return self._respond(url, '<html></html>')
+        expired, self.expired = self.expired, None
+        if expired == 'page':
+            return self._respond(url, '<html><p>Attenzione: non sei connesso come amministratore</p></html>')
+        if expired == 'status':
+            return self._respond(url, '{"error": "Non autenticato"}', status_code=401)
+        return self._respond(url, self.body)
+
+    def post(self, url, **kwargs):
+        self.timeouts.append(kwargs.get('timeout'))
+        return self._respond(url, '<html>ok</html>')
+
+
+class FakeClient:
+    """Machine client serving SAMPLE_EVENTS, recording the calls made by perform_download"""
+
+    instances = []
+
+    def __init__(self, base_url=None, password=None, timeout=None):
+        self.base_url = base_url
+        self.start_dates = []
+        self.logins = 0
+        self.exited = False
+        FakeClient.instances.append(self)
+
+    def ensure_login(self):
+        self.logins += 1 if not self.logins else 0
+        return True
+
+    def iter_events(self, days_back=30, start_date=None):
+        self.start_dates.append(start_date)
+        yield from SAMPLE_EVENTS
+
+    def exit_programming_mode(self):
+        self.exited = True
+        return True
+
+
+@pytest.fixture
+def analyzer():
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(db_fd)
+
+    yield SalesAnalyzer(db_path)
+
+    os.unlink(db_path)
+
+
+class TestEventArchiveWriter:
+    """Compact archive written beside the import"""
+
+    def test_tee_writes_readable_archive(self, tmp_path):
+        """Events pass through unchanged and the archive reads back as a _complete.json file"""
+        path = str(tmp_path / 'events_complete.json')
+        archive = EventArchiveWriter(path, {'start_date': '2025-09-17'}, chunk_size=3)
+
+        assert list(archive.tee(iter(SAMPLE_EVENTS))) == SAMPLE_EVENTS
+        assert archive.close() == path
+
+        assert list(iter_events_file(path)) == SAMPLE_EVENTS
+        with open(path, encoding='utf-8') as f:
+            content = f.read()
+        payload = json.loads(content)
+        assert payload['events_count'] == len(SAMPLE_EVENTS)
+        assert payload['download_info'] == {'start_date': '2025-09-17'}
+        assert '\n' not in content and '": ' not in content
+        assert not os.path.exists(path + '.part')
+
+    def test_discarded_archive(self, tmp_path):
+        """An interrupted download leaves no file behind"""
+        path = str(tmp_path / 'events_complete.json')
+        archive = EventArchiveWriter(path)
+        next(archive.tee(iter(SAMPLE_EVENTS)))
+
+        assert archive.close(keep=False) is None
+        assert os.listdir(tmp_path) == []
+
+
+class TestStreamingClient:
+    """Events decoded from the events2_query response as it arrives"""
+
+    def test_iter_events_across_pieces(self, monkeypatch):
+        """A body split mid-token decodes to the same events and the response is closed"""
+        response = FakeResponse(json.dumps(SAMPLE_EVENTS))
+        client = CigaretteMachineClient(base_url='http://machine:1500', password='x')
+        monkeypatch.setattr(client, '_query_events', lambda days_back, stream=False, start_date=None, end_date=None: response)
+
+        assert list(client.iter_events(start_date=date(2025, 9, 17))) == SAMPLE_EVENTS
+        assert response.closed
+
+    def test_non_json_response(self, monkeypatch):
+        """An HTML page other than the login page yields no events"""
+        response = FakeResponse('<html><body>Errore interno</body></html>')
+        client = CigaretteMachineClient(base_url='http://machine:1500', password='x')
+        monkeypatch.setattr(client, '_query_events', lambda days_back, stream=False, start_date=None, end_date=None: response)
+
+        assert list(client.iter_events()) == []
+
+
+class TestSessionWarmUp:
+    """The events2 page is visited once per login"""
+
+    @pytest.fixture
+    def client(self):
+        client = CigaretteMachineClient(base_url='http://machine:1500', password='x')
+        client.session = FakeSession(json.dumps(SAMPLE_EVENTS))
+        return client
+
+    def test_warm_up_once_per_login(self, client):
+        """Repeated queries reuse the visit, a new login visits the page again"""
+        client.login()
+        list(client.iter_events())
+        list(client.iter_events())
+        client.login()
+        list(client.iter_events())
+
+        assert client.session.paths == ['/login', '/login_check', '/events2', '/events2_query', '/events2_query',
+                                         '/login', '/login_check', '/events2', '/events2_query']
+
+    def test_html_page_counts_as_warm_up(self, client, tmp_path):
+        """Downloading the HTML page already establishes the session"""
+        client.login()
+        download_and_parse_events(client, str(tmp_path / 'events.html'), start_date=date(2025, 9, 17))
+
+        assert client.session.paths.count('/events2') == 1
+
+    def test_data_only_download(self, client, tmp_path):
+        """Data-only mode writes the JSON files without the HTML page"""
+        client.login()
+        result = download_and_parse_events(client, str(tmp_path / 'events.html'), start_date=date(2025, 9, 17),
+                                           data_only=True)
+
+        assert result == str(tmp_path / 'events_complete.json')
+        assert sorted(os.listdir(tmp_path)) == ['events_complete.json', 'events_events_only.json']
+        with open(result, encoding='utf-8') as f:
+            assert json.load(f)['download_info']['html_file'] is None
+        assert list(iter_events_file(result)) == SAMPLE_EVENTS
+        assert client.session.paths.count('/events2') == 1
+
+    @pytest.mark.parametrize('output_name', ['out.json', 'out'])
+    def test_output_name_without_html_extension(self, client, tmp_path, output_name):
+        """Derived file names never collide with each other when the output is not an .html name"""
+        client.login()
+        result = download_and_parse_events(client, str(tmp_path / output_name), start_date=date(2025, 9, 17),
+                                           data_only=True)
+
+        assert result == str(tmp_path / 'out_complete.json')
+        with open(result, encoding='utf-8') as f:
+            assert json.load(f)['events_count'] == len(SAMPLE_EVENTS)
+        assert list(iter_events_file(str(tmp_path / 'out_events_only.json'))) == SAMPLE_EVENTS
+
+    def test_every_request_has_timeout(self, client, tmp_path):
+        """Login, downloads and the exit from programming mode never wait without a limit"""
+        client.login()
+        download_and_parse_events(client, str(tmp_path / 'events.html'), start_date=date(2025, 9, 17))
+        client.exit_programming_mode()
+
+        assert client.session.paths[-1] == '/admin_index_back'
+        assert client.session.timeouts == [DEFAULT_TIMEOUT] * len(client.session.paths)
+
+    @pytest.mark.parametrize('expiry', ['page', 'status'])
+    def test_expired_session_relogin(self, client, expiry):
+        """An expired session is detected before any event, the client logs in again and retries once"""
+        client.login()
+        list(client.iter_events())
+        client.session.expired = expiry
+
+        assert list(client.iter_events()) == SAMPLE_EVENTS
+        assert client.session.paths[4:] == ['/events2_query', '/login', '/login_check', '/events2', '/events2_query']
+
+    def test_expired_session_without_relogin(self, client):
+        """With relogin disabled the expiry is raised and the session is marked as logged out"""
+        client.login()
+        client.session.expired = 'page'
+
+        with pytest.raises(SessionExpiredError):
+            list(client.iter_events(relogin=False))
+        assert not client.logged_in
+        assert client.ensure_login() and client.session.paths[-2:] == ['/login', '/login_check']
+
+
+class TestPerformDownload:
+    """perform_download imports straight from the client"""
+
+    @pytest.fixture
+    def api_server(self, analyzer, tmp_path, monkeypatch):
+        import api_server
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(api_server, 'analyzer', analyzer)
+        monkeypatch.setattr(api_server, 'CigaretteMachineClient', FakeClient)
+        monkeypatch.setattr(api_server, 'DISTRIBUTORE_IP', 'localhost')
+        monkeypatch.setattr(api_server, 'machine_client', None)
+        FakeClient.instances = []
+
+        yield api_server
+
+        api_server.release_machine_client()
+
+    def test_events_imported_and_archived(self, api_server, analyzer, tmp_path):
+        """Downloaded events reach the database and one compact archive is kept"""
+        expected_start = analyzer.get_download_start_date()
+
+        api_server.perform_download()
+
+        assert api_server.download_status['error'] is None
+        assert api_server.download_status['progress'] == 100
+        client, = FakeClient.instances
+        assert client.start_dates == [expected_start]
+
+        conn = sqlite3.connect(analyzer.db_path)
+        counts = [conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in ('events', 'sales')]
+        conn.close()
+        assert counts == [len(SAMPLE_EVENTS), 3]
+
+        archived, = os.listdir(tmp_path / 'past_events')
+        assert archived.endswith('_complete.json')
+        assert list(iter_events_file(str(tmp_path / 'past_events' / archived))) == SAMPLE_EVENTS
+
+    def test_session_reused_between_downloads(self, api_server):
+        """Consecutive downloads share one logged-in client, released on idle or shutdown"""
+        api_server.perform_download()
+        api_server.perform_download()
+
+        client, = FakeClient.instances
+        assert client.logins == 1 and len(client.start_dates) == 2
+        assert not client.exited
+        assert api_server.machine_client_timer is not None
+
+        api_server.release_machine_client(client)
+        assert client.exited and api_server.machine_client is None
+
+    def test_session_released_after_error(self, api_server, monkeypatch):
+        """A failed download leaves programming mode at once"""
+        def failing_events(days_back=30, start_date=None):
+            raise SessionExpiredError('Sessione sul distributore scaduta')
+            yield
+
+        monkeypatch.setattr(FakeClient, 'iter_events', lambda self, **kwargs: failing_events(**kwargs))
+
+        api_server.perform_download()
+
+        client, = FakeClient.instances
+        assert api_server.download_status['error'] == 'Sessione sul distributore scaduta'
+        assert client.exited and api_server.machine_client is None
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Tests for the date-sharded parallel backfill
+"""
+
+import pytest
+import sqlite3
+import tempfile
+import json
+import os
+import sys
+import threading
+from datetime import date
+
+import requests
+
+# Add parent directory to path to import event_backfill
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processor import SalesAnalyzer, event_sort_key
+from event_backfill import EventBackfill, date_shards, get_backfill_progress, merge_shards
+from tests.test_statistics_rollups import SAMPLE_FILE
+
+START, END = date(2025, 11, 1), date(2025, 12, 1)
+
+
+def event_date(event):
+    day, month, year = event['dateTime'][:8].split('/')
+    return date(2000 + int(year), int(month), int(day))
+
+
+class FakeMachine:
+    """Client serving the simulator events by date range, with scripted shard failures"""
+
+    def __init__(self, events, failures=None, state=None):
+        self.events = events
+        # start date -> remaining failures for that shard
+        self.failures = dict(failures or {})
+        self.state = state or {'queries': [], 'clones': 0, 'lock': threading.Lock()}
+
+    def clone(self):
+        with self.state['lock']:
+            self.state['clones'] += 1
+        clone = FakeMachine(self.events, state=self.state)
+        clone.failures = self.failures
+        return clone
+
+    def ensure_login(self):
+        return True
+
+    def iter_events(self, start_date=None, end_date=None, **kwargs):
+        with self.state['lock']:
+            self.state['queries'].append(start_date)
+            if self.failures.get(start_date):
+                self.failures[start_date] -= 1
+                raise requests.ConnectionError('Connessione interrotta')
+        # Newest first, as returned by the machine
+        return iter([event for event in self.events if start_date <= event_date(event) <= end_date])
+
+
+@pytest.fixture(scope='module')
+def sample_events():
+    with open(SAMPLE_FILE, encoding='utf-8') as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope='module')
+def reference_db(sample_events):
+    """The sample events imported in a single call"""
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(db_fd)
+
+    SalesAnalyzer(db_path).ingest_events(sample_events)
+
+    yield db_path
+
+    os.unlink(db_path)
+
+
+@pytest.fixture
+def analyzer():
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(db_fd)
+
+    yield SalesAnalyzer(db_path)
+
+    os.unlink(db_path)
+
+
+def table_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = {
+        'events': conn.execute('SELECT event_number, event_datetime FROM events ORDER BY 1, 2').fetchall(),
+        'sales': conn.execute('SELECT sale_datetime, motor_id, product_name, price FROM sales ORDER BY 1, 2')
+                     .fetchall(),
+        'transactions': conn.execute('''
+            SELECT start_datetime, payment_method, total_paid, net_revenue, is_complete FROM transactions ORDER BY 1
+        ''').fetchall()
+    }
+    conn.close()
+    return rows
+
+
+# Rollups compared between databases, without ids and timestamps of the import itself
+ROLLUP_QUERIES = [
+    'SELECT motor_id, product_name, price, last_sale_datetime, total_sales FROM motors ORDER BY 1',
+    'SELECT motor_id, day, sales_count, ROUND(revenue, 6), first_sale, last_sale FROM motor_daily_stats ORDER BY 1, 2',
+    'SELECT motor_id, sales_count, ROUND(mean_interval, 6), first_sale, last_sale FROM motor_interval_stats ORDER BY 1',
+    'SELECT motor_id, weekday, hour, sales_count, ROUND(revenue, 6) FROM motor_hourly_profile ORDER BY 1, 2, 3',
+    'SELECT day, payment_method, transactions_count, ROUND(net_revenue, 6) FROM transactions_daily_stats ORDER BY 1, 2',
+    'SELECT day, basket_size, transactions_count, ROUND(revenue, 6) FROM basket_size_daily_stats ORDER BY 1, 2',
+    'SELECT day, metric, value_count FROM transaction_value_sketches ORDER BY 1, 2',
+    'SELECT motor_id, stockout_datetime, units_since_refill FROM motor_stockouts ORDER BY 1, 2',
+    'SELECT start_datetime, end_datetime FROM refill_windows ORDER BY 1',
+    '''SELECT motor_id, last_refill, sold_since_refill, last_stockout, stockout_count, ROUND(estimated_capacity, 6)
+       FROM motor_stock ORDER BY 1'''
+]
+
+
+def rollup_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = [conn.execute(query).fetchall() for query in ROLLUP_QUERIES]
+    conn.close()
+    return rows
+
+
+class TestShards:
+    """Shard boundaries and the ordered merge"""
+
+    def test_day_and_week_shards(self):
+        """Shards are contiguous, inclusive and cover the range exactly"""
+        assert date_shards(date(2025, 11, 1), date(2025, 11, 3)) == [
+            (date(2025, 11, 1), date(2025, 11, 1)),
+            (date(2025, 11, 2), date(2025, 11, 2)),
+            (date(2025, 11, 3), date(2025, 11, 3)),
+        ]
+        assert date_shards(date(2025, 11, 1), date(2025, 11, 16), 'week') == [
+            (date(2025, 11, 1), date(2025, 11, 7)),
+            (date(2025, 11, 8), date(2025, 11, 14)),
+            (date(2025, 11, 15), date(2025, 11, 16)),
+        ]
+
+    @pytest.mark.parametrize('start,end,shard', [
+        (date(2025, 11, 2), date(2025, 11, 1), 'day'),
+        (date(2025, 11, 1), date(2025, 11, 2), 'month'),
+    ])
+    def test_invalid_shards(self, start, end, shard):
+        with pytest.raises(ValueError):
+            date_shards(start, end, shard)
+
+    def test_merge_is_chronological_and_deduplicated(self, sample_events):
+        """Sorted shards merge by (timestamp, number), events repeated across shards appear once"""
+        first = sorted(sample_events[:4000], key=event_sort_key)
+        second = sorted(sample_events[3990:], key=event_sort_key)
+
+        merged = list(merge_shards([second, first]))
+
+        assert len(merged) == len(sample_events)
+        assert [event_sort_key(event) for event in merged] == sorted(event_sort_key(event) for event in merged)
+
+    def test_merge_drops_copies_not_adjacent(self):
+        """A repeated event is dropped even when another event with the same key falls between the copies"""
+        first = {'number': '7', 'dateTime': '10/11/25 08:00:00', 'type': 'VENDITA', 'text': 'A'}
+        second = {'number': '7', 'dateTime': '10/11/25 08:00:00', 'type': 'VENDITA', 'text': 'B'}
+
+        merged = list(merge_shards([[first, second], [second, first]]))
+
+        assert len(merged) == 2 and first in merged and second in merged
+
+
+class TestEventBackfill:
+    """Parallel shard download with resumable progress"""
+
+    @pytest.mark.parametrize('shard,concurrency', [('day', 4), ('week', 2), ('day', 1)])
+    def test_matches_single_import(self, analyzer, sample_events, reference_db, shard, concurrency):
+        """Backfilling by shards imports the same events, transactions and sales as one import"""
+        machine = FakeMachine(sample_events)
+        stats = EventBackfill(analyzer, machine, shard=shard, concurrency=concurrency).run(START, END)
+
+        assert stats['failed_shard'] is None
+        assert stats['shards_completed'] == stats['shards_total'] == len(date_shards(START, END, shard))
+        assert stats['new_events'] == len(sample_events)
+        assert table_rows(analyzer.db_path) == table_rows(reference_db)
+        assert rollup_rows(analyzer.db_path) == rollup_rows(reference_db)
+        assert machine.state['clones'] <= concurrency
+        assert get_backfill_progress(analyzer)['completed_until'] == END.isoformat()
+
+    def test_failed_shard_retried(self, analyzer, sample_events, reference_db):
+        """A shard failing fewer times than the attempts is retried on its own"""
+        machine = FakeMachine(sample_events, failures={date(2025, 11, 10): 2})
+        stats = EventBackfill(analyzer, machine, retry_delay=0).run(START, END)
+
+        assert stats['failed_shard'] is None
+        assert machine.state['queries'].count(date(2025, 11, 10)) == 3
+        assert machine.state['queries'].count(date(2025, 11, 11)) == 1
+        assert table_rows(analyzer.db_path) == table_rows(reference_db)
+
+    def test_resume_after_failure(self, analyzer, sample_events, reference_db):
+        """A shard failing every attempt stops the run after the shards before it; a new run resumes there"""
+        failing = FakeMachine(sample_events, failures={date(2025, 11, 10): 3})
+        stats = EventBackfill(analyzer, failing, concurrency=4, retry_delay=0).run(START, END)
+
+        assert stats['failed_shard'] == ['2025-11-10', '2025-11-10']
+        assert stats['shards_completed'] == 9
+        # The last transaction of 9/11 may continue on 10/11: its events wait for that shard
+        assert get_backfill_progress(analyzer)['completed_until'] == '2025-11-08'
+
+        machine = FakeMachine(sample_events)
+        resumed = EventBackfill(analyzer, machine, shard='week').run(START, END)
+
+        assert resumed['resumed_from'] == '2025-11-08'
+        assert min(machine.state['queries']) == date(2025, 11, 9)
+        assert table_rows(analyzer.db_path) == table_rows(reference_db)
+        assert rollup_rows(analyzer.db_path) == rollup_rows(reference_db)
+        assert not analyzer.rollups_pending()
+
+    def test_backfill_before_existing_data(self, analyzer, sample_events, reference_db):
+        """Backfilling a period older than the imported events rebuilds rollups and stock once, in order"""
+        analyzer.ingest_events([event for event in sample_events if event_date(event) > date(2025, 11, 15)])
+        notified = []
+        analyzer.add_import_listener(notified.append)
+
+        stats = EventBackfill(analyzer, FakeMachine(sample_events)).run(START, date(2025, 11, 15))
+
+        assert stats['failed_shard'] is None
+        assert table_rows(analyzer.db_path) == table_rows(reference_db)
+        assert rollup_rows(analyzer.db_path) == rollup_rows(reference_db)
+        conn = sqlite3.connect(analyzer.db_path)
+        all_motors = {row[0] for row in conn.execute('SELECT motor_id FROM motors')}
+        conn.close()
+        assert len(notified) == 1 and notified[0] >= all_motors
+
+    def interrupt_before_rebuild(self, analyzer, sample_events, monkeypatch):
+        """Runs a backfill of the first half of November that dies before the final rebuild"""
+        def interrupted():
+            raise KeyboardInterrupt
+
+        monkeypatch.setattr(analyzer, 'rebuild_rollups', interrupted)
+        with pytest.raises(KeyboardInterrupt):
+            EventBackfill(analyzer, FakeMachine(sample_events)).run(START, date(2025, 11, 15))
+        monkeypatch.undo()
+        assert analyzer.rollups_pending()
+
+    def test_ingest_after_interrupted_backfill(self, analyzer, sample_events, reference_db, monkeypatch):
+        """A regular import after an interrupted backfill rebuilds rollups and stock instead of adding to them"""
+        self.interrupt_before_rebuild(analyzer, sample_events, monkeypatch)
+        notified = []
+        analyzer.add_import_listener(notified.append)
+
+        analyzer.ingest_events([event for event in sample_events if event_date(event) > date(2025, 11, 14)])
+
+        assert not analyzer.rollups_pending()
+        assert table_rows(analyzer.db_path) == table_rows(reference_db)
+        assert rollup_rows(analyzer.db_path) == rollup_rows(reference_db)
+        assert len(notified) == 1
+
+    def test_startup_after_interrupted_backfill(self, analyzer, sample_events, monkeypatch):
+        """Opening the database again rebuilds the rollups left pending"""
+        self.interrupt_before_rebuild(analyzer, sample_events, monkeypatch)
+
+        reopened = SalesAnalyzer(analyzer.db_path)
+
+        assert not reopened.rollups_pending()
+        expected = tempfile.mkstemp(suffix='.db')
+        os.close(expected[0])
+        try:
+            SalesAnalyzer(expected[1]).ingest_events(
+                [event for event in sample_events if event_date(event) <= date(2025, 11, 15)])
+            assert rollup_rows(analyzer.db_path) == rollup_rows(expected[1])
+        finally:
+            os.unlink(expected[1])
+
+    def test_backfill_endpoint(self, analyzer, monkeypatch):
+        """/api/backfill validates its parameters and reports the saved progress"""
+        import api_server
+        monkeypatch.setattr(api_server, 'analyzer', analyzer)
+        monkeypatch.setattr(api_server, 'machine_client', None)
+
+        with api_server.app.test_client() as client:
+            invalid = [client.post('/api/backfill', json=body) for body in (
+                {},
+                {'start_date': '01/11/2025'},
+                {'start_date': '2025-11-02', 'end_date': '2025-11-01'},
+                {'start_date': '2025-11-01', 'shard': 'month'},
+                {'start_date': '2025-11-01', 'concurrency': 50},
+            )]
+            EventBackfill(analyzer, FakeMachine([])).run(START, date(2025, 11, 3))
+            progress = client.get('/api/backfill')
+
+        assert [response.status_code for response in invalid] == [400] * 5
+        assert api_server.machine_client is None
+        assert progress.get_json()['progress']['completed_until'] == '2025-11-03'
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Integration tests for the per-motor rollup tables maintained at ingest time
+"""
+
+import pytest
+import sqlite3
+import tempfile
+import os
+import sys
+import statistics
+from datetime import datetime, timedelta
+
+# Add parent directory to path to import data_processor
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processor import SalesAnalyzer
+from motor_analytics import MotorAnalytics
+
+
+def sale_events(number, when, motor_id, price, product='CAMEL BLUE'):
+    """Events of a one-sale POS transaction, newest first as the machine returns them"""
+    def stamp(seconds):
+        return (when + timedelta(seconds=seconds)).strftime('%d/%m/%y %H:%M:%S')
+
+    return [
+        {"code": "V", "dateTime": stamp(10), "number": str(number + 2), "type": "EVENTO",
+         "text": f"EROGAZIONE IN CORSO - MOTORE: {motor_id} - PREZZO: {price:.2f} euro ({product})"},
+        {"code": "V", "dateTime": stamp(5), "number": str(number + 1), "type": "POS",
+         "text": f"CREDITO POS: {price:.2f} euro --- CREDITO: {price:.2f} euro"},
+        {"code": "V", "dateTime": stamp(0), "number": str(number), "type": "EVENTO", "text": "TESSERA VALIDA"},
+    ]
+
+
+def build_events(sales):
+    """Machine payload for a list of (datetime, motor_id, price), newest first"""
+    events = []
+    for index, (when, motor_id, price) in enumerate(sorted(sales)):
+        events = sale_events(1000 + index * 3, when, motor_id, price) + events
+    return events
+
+
+@pytest.fixture
+def db_path():
+    """Path of a temporary database"""
+    db_fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(db_fd)
+
+    yield path
+
+    os.unlink(path)
+
+
+@pytest.fixture
+def recent_sales():
+    """Sales on two motors spread over the last 45 days"""
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    sales = []
+    for days_ago in (0, 1, 3, 6, 7, 12, 29, 30, 44):
+        sales.append((today - timedelta(days=days_ago, hours=-9), 7, 5.5))
+        sales.append((today - timedelta(days=days_ago, hours=-15), 7, 5.5))
+        sales.append((today - timedelta(days=days_ago, hours=-11), 21, 6.2))
+    return sales
+
+
+class TestMotorDailyStats:
+    """motor_daily_stats rollup and the period metrics read from it"""
+
+    def test_rollup_rows(self, db_path):
+        """One row per motor and day, accumulated across imports"""
+        analyzer = SalesAnalyzer(db_path)
+        day = datetime(2025, 9, 17, 10, 0, 0)
+        analyzer.ingest_events(build_events([(day, 7, 5.5)]))
+        analyzer.ingest_events(build_events([(day, 7, 5.5), (day + timedelta(hours=2), 7, 5.0)]))
+
+        conn = sqlite3.connect(db_path)
+        rows = conn.execute('SELECT * FROM motor_daily_stats').fetchall()
+        conn.close()
+
+        assert rows == [(7, '2025-09-17', 2, 10.5, '2025-09-17 10:00:10', '2025-09-17 12:00:10')]
+
+    def test_existing_sales_backfilled(self, db_path, recent_sales):
+        """Opening a database with sales and an empty rollup rebuilds it"""
+        analyzer = SalesAnalyzer(db_path)
+        analyzer.ingest_events(build_events(recent_sales))
+
+        conn = sqlite3.connect(db_path)
+        before = conn.execute('SELECT * FROM motor_daily_stats ORDER BY motor_id, day').fetchall()
+        conn.execute('DELETE FROM motor_daily_stats')
+        conn.commit()
+
+        SalesAnalyzer(db_path)
+        after = conn.execute('SELECT * FROM motor_daily_stats ORDER BY motor_id, day').fetchall()
+        conn.close()
+
+        assert len(before) == 18
+        assert after == before
+
+    def test_period_metrics_match_raw_sales(self, db_path, recent_sales):
+        """Rollup sums equal the raw sales_events computation, per motor and in bulk"""
+        analyzer = SalesAnalyzer(db_path)
+        analyzer.ingest_events(build_events(recent_sales))
+
+        rollup = MotorAnalytics(db_path)
+        raw = MotorAnalytics(db_path)
+        raw.tables = set()
+
+        for motor_id in (7, 21):
+            from_rollup = rollup.get_motor_analytics(motor_id)
+            assert {period: from_rollup[period] for period in ('today', 'week', 'month')} == \
+                {period: raw.get_motor_analytics(motor_id)[period] for period in ('today', 'week', 'month')}
+
+        motor = rollup.get_motor_analytics(7)
+        assert motor['today']['sales_count'] == 2
+        assert motor['week']['sales_count'] == 8  # days 0, 1, 3 and 6
+        assert motor['month']['sales_count'] == 14  # up to day 29
+        assert motor['month']['revenue'] == pytest.approx(77.0)
+
+        bulk = rollup.get_bulk_motor_metrics()
+        raw_bulk = raw.get_bulk_motor_metrics()
+        assert bulk[21]['week'] == rollup.get_motor_analytics(21)['week']
+        for motor_id in (7, 21):
+            for key in ('today', 'week', 'month', 'last_sale'):
+                assert bulk[motor_id][key] == raw_bulk[motor_id][key]
+            # The rollup status is seasonal (see TestSeasonalStatus), the raw one uses the 2x rule
+            assert bulk[motor_id]['status_indicator'] == rollup.get_motor_analytics(motor_id)['status_indicator']
+
+
+class TestMotorIntervalStats:
+    """motor_interval_stats maintained online with Welford's algorithm"""
+
+    def interval_stats(self, db_path, motor_id):
+        conn = sqlite3.connect(db_path)
+        row = conn.execute('''
+            SELECT sales_count, mean_interval, m2_interval, first_sale, last_sale
+            FROM motor_interval_stats WHERE motor_id = ?
+        ''', (motor_id,)).fetchone()
+        conn.close()
+        return row
+
+    def test_matches_batch_statistics(self, db_path, recent_sales):
+        """Mean and variance of the gaps between consecutive sales"""
+        analyzer = SalesAnalyzer(db_path)
+        analyzer.ingest_events(build_events(recent_sales))
+
+        times = sorted(when + timedelta(seconds=10) for when, motor_id, _ in recent_sales if motor_id == 7)
+        gaps = [(b - a).total_seconds() for a, b in zip(times, times[1:])]
+        count, mean, m2, first_sale, last_sale = self.interval_stats(db_path, 7)
+
+        assert count == len(times)
+        assert mean == pytest.approx(statistics.mean(gaps))
+        assert m2 / (count - 1) == pytest.approx(statistics.pvariance(gaps))
+        assert (first_sale, last_sale) == (str(times[0]), str(times[-1]))
+
+    def test_incremental_and_out_of_order_sales(self, db_path, recent_sales):
+        """Newer sales update online, older ones recompute the motor; both match a rebuild"""
+        analyzer = SalesAnalyzer(db_path)
+        ordered = sorted(recent_sales)
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+
+        def add_sales(sales):
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM sales')
+            after_sale_id = cursor.fetchone()[0]
+            cursor.executemany(
+                'INSERT INTO sales (motor_id, product_name, price, sale_datetime) VALUES (?, ?, ?, ?)',
+                [(motor_id, 'CAMEL BLUE', price, str(when)) for when, motor_id, price in sales])
+            analyzer.update_motor_interval_stats(cursor, after_sale_id)
+            conn.commit()
+
+        add_sales(ordered[9:18])
+        add_sales(ordered[18:])  # newer sales: online update
+        add_sales(ordered[:9])   # older sales: motor recomputed
+
+        incremental = [self.interval_stats(db_path, motor_id) for motor_id in (7, 21)]
+        analyzer.update_motor_interval_stats(cursor)
+        conn.commit()
+        conn.close()
+        rebuilt = [self.interval_stats(db_path, motor_id) for motor_id in (7, 21)]
+
+        assert [row[0] for row in rebuilt] == [18, 9]
+        for got, expected in zip(incremental, rebuilt):
+            assert got[0] == expected[0] and got[3:] == expected[3:]
+            assert got[1:3] == pytest.approx(expected[1:3])
+
+    def test_sales_pattern_lookup(self, db_path, recent_sales):
+        """calculate_sales_pattern reads the stored mean instead of a year of sales"""
+        analyzer = SalesAnalyzer(db_path)
+        analyzer.ingest_events(build_events(recent_sales))
+
+        lookup = MotorAnalytics(db_path).calculate_sales_pattern(21)
+        raw_analytics = MotorAnalytics(db_path)
+        raw_analytics.tables = set()
+        raw = raw_analytics.calculate_sales_pattern(21)
+
+        assert lookup['sales_count'] == raw['sales_count'] == 9
+        assert lookup['average_interval_hours'] == pytest.approx(raw['average_interval_hours'])
+        assert lookup['threshold_hours'] == pytest.approx(lookup['average_interval_hours'] * 2)
+
+
+class TestSeasonalStatus:
+    """Status from the hour-of-week profile in motor_hourly_profile"""
+
+    def profile(self, db_path, motor_id):
+        conn = sqlite3.connect(db_path)
+        rows = conn.execute('''
+            SELECT weekday, hour, sales_count FROM motor_hourly_profile
+            WHERE motor_id = ? ORDER BY weekday, hour
+        ''', (motor_id,)).fetchall()
+        conn.close()
+        return rows
+
+    def test_profile_rows(self, db_path, recent_sales):
+        """Sales counted per weekday (0 = Sunday) and hour, incrementally and on rebuild"""
+        analyzer = SalesAnalyzer(db_path)
+        ordered = sorted(recent_sales)
+        analyzer.ingest_events(build_events(ordered[:12]))
+        analyzer.ingest_events(build_events(ordered))
+
+        expected = {}
+        for when, motor_id, _ in recent_sales:
+            if motor_id == 7:
+                key = ((when.weekday() + 1) % 7, when.hour)
+                expected[key] = expected.get(key, 0) + 1
+        incremental = self.profile(db_path, 7)
+
+        conn = sqlite3.connect(db_path)
+        analyzer.update_motor_hourly_profile(conn.cursor())
+        conn.commit()
+        conn.close()
+
+        assert incremental == sorted((weekday, hour, count) for (weekday, hour), count in expected.items())
+        assert self.profile(db_path, 7) == incremental
+
+    def test_quiet_hours_are_not_overdue(self):
+        """A motor selling hourly 9-17 is green overnight and red when the morning stays quiet"""
+        analytics = MotorAnalytics(':memory:')
+        counts = [0] * 168
+        for weekday in range(7):
+            for hour in range(9, 18):
+                counts[weekday * 24 + hour] = 4  # four weeks of history
+        first_sale = datetime(2025, 11, 3, 9, 0, 0)
+        last_sale = datetime(2025, 11, 30, 17, 0, 0)
+
+        overnight = datetime(2025, 12, 1, 6, 0, 0)
+        late_morning = datetime(2025, 12, 1, 14, 0, 0)
+        night_status, night_probability = analytics.determine_seasonal_status(
+            last_sale, first_sale, counts, now=overnight)
+        morning_status, morning_probability = analytics.determine_seasonal_status(
+            last_sale, first_sale, counts, now=late_morning)
+
+        # The flat 2x rule (mean interval 24/9 hours) would already be red overnight
+        assert night_status == 'green' and night_probability > 0.2
+        assert morning_status == 'red' and morning_probability < 0.01
+
+    def test_flat_profile_matches_twice_the_mean(self):
+        """With uniform demand the threshold falls at twice the mean interval"""
+        analytics = MotorAnalytics(':memory:')
+        counts = [1] * 168  # one sale an hour, one week of history
+        last_sale = datetime(2025, 12, 1, 12, 0, 0)
+        first_sale = last_sale - timedelta(weeks=1)
+
+        assert analytics.determine_seasonal_status(
+            last_sale, first_sale, counts, now=last_sale + timedelta(hours=1.9))[0] == 'green'
+        assert analytics.determine_seasonal_status(
+            last_sale, first_sale, counts, now=last_sale + timedelta(hours=2.1))[0] == 'red'
+        assert analytics.determine_seasonal_status(None, first_sale, counts) == ('neutral', None)
+
+    def test_grid_uses_seasonal_status(self, db_path, recent_sales):
+        """Bulk and per-motor analytics report the same status and gap probability"""
+        SalesAnalyzer(db_path).ingest_events(build_events(recent_sales))
+        analytics = MotorAnalytics(db_path)
+
+        bulk = analytics.get_bulk_motor_metrics()
+        for motor_id in (7, 21):
+            motor = analytics.get_motor_analytics(motor_id)
+            assert bulk[motor_id]['status_indicator'] == motor['status_indicator']
+            assert bulk[motor_id]['sales_pattern']['gap_probability'] == \
+                pytest.approx(motor['sales_pattern']['gap_probability'], rel=1e-3)
+
+
+class TestFleetIntervalEngine:
+    """Vectorized interval statistics for all motors at once"""
+
+    def test_numpy_matches_per_motor_path(self, db_path, recent_sales):
+        """Both engines return the same distribution for every motor"""
+        pytest.importorskip('numpy')
+        SalesAnalyzer(db_path).ingest_events(build_events(recent_sales))
+        analytics = MotorAnalytics(db_path)
+
+        vectorized = analytics.get_fleet_interval_statistics()
+        per_motor = analytics.get_fleet_interval_statistics(vectorized=False)
+
+        assert sorted(vectorized) == sorted(per_motor) == [7, 21]
+        for motor_id, expected in per_motor.items():
+            got = vectorized[motor_id]
+            assert (got['sales_count'], got['interval_count'], got['last_sale']) == \
+                (expected['sales_count'], expected['interval_count'], expected['last_sale'])
+            for key in ('mean_interval_hours', 'std_interval_hours', 'hours_since_last_sale', 'gap_zscore'):
+                assert got[key] == pytest.approx(expected[key])
+            assert got['percentiles'] == pytest.approx(expected['percentiles'])
+
+    def test_interval_distribution(self, db_path, recent_sales):
+        """Motor 21 sells daily at 11:00 with gaps of 14, 1, 17, 5, 1, 3, 2 and 1 days"""
+        SalesAnalyzer(db_path).ingest_events(build_events(recent_sales))
+
+        stats = MotorAnalytics(db_path).get_fleet_interval_statistics()[21]
+
+        assert stats['sales_count'] == 9
+        assert stats['mean_interval_hours'] == pytest.approx(44 * 24 / 8)
+        assert stats['median_interval_hours'] == pytest.approx(2.5 * 24)
+        assert stats['percentiles']['p25'] == pytest.approx(24.0)
+
+    def test_benchmark(self, db_path, recent_sales):
+        """The benchmark times both paths on the same database"""
+        pytest.importorskip('numpy')
+        from motor_analytics import benchmark_fleet_engine
+        SalesAnalyzer(db_path).ingest_events(build_events(recent_sales))
+
+        result = benchmark_fleet_engine(db_path, repeat=1)
+
+        assert result['motors'] == 2
+        assert result['numpy_seconds'] > 0 and result['per_motor_seconds'] > 0
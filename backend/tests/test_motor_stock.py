@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Integration tests for stockout, refill window and per-motor stock tracking
+"""
+
+import pytest
+import sqlite3
+import tempfile
+import os
+import sys
+from datetime import datetime, timedelta
+
+# Add parent directory to path to import data_processor
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processor import SalesAnalyzer
+from tests.test_motor_rollups import build_events
+
+START = datetime(2025, 11, 3, 8, 0, 0)
+
+
+def machine_event(number, when, event_type, text, code='V'):
+    return {"code": code, "dateTime": when.strftime('%d/%m/%y %H:%M:%S'), "number": str(number),
+            "type": event_type, "text": text}
+
+
+def stockout_event(number, when, motor_id):
+    return machine_event(number, when, 'EMAIL',
+                         f"Invio mail prodotto esaurito n.{motor_id} (motore) a gestore@example.com", code='S')
+
+
+def refill_events(number, when):
+    """A programming window of ten minutes, newest first"""
+    return [
+        machine_event(number + 1, when + timedelta(minutes=10), 'PROGRAMMAZIONE', 'USCITA PROGRAMMAZIONE'),
+        machine_event(number, when, 'PROGRAMMAZIONE', 'INGRESSO PROGRAMMAZIONE'),
+    ]
+
+
+def newest_first(events):
+    return sorted(events, key=lambda e: (datetime.strptime(e['dateTime'], '%d/%m/%y %H:%M:%S'),
+                                         int(e['number'])), reverse=True)
+
+
+@pytest.fixture
+def history():
+    """Motor 7 runs out twice and is refilled in between, motor 21 runs out at the end
+
+    Day 0: three sales on motor 7, stockout. Day 1: refill.
+    Days 2-3: four sales on motor 7, stockout (capacity 4). Day 4: refill, then two sales.
+    Motor 21 sells once a day and its stockout on day 5 is not followed by a refill.
+    """
+    sales = [(START + timedelta(hours=hour), 7, 5.5) for hour in (1, 2, 3)]
+    sales += [(START + timedelta(days=2, hours=hour), 7, 5.5) for hour in (1, 2)]
+    sales += [(START + timedelta(days=3, hours=hour), 7, 5.5) for hour in (1, 2)]
+    sales += [(START + timedelta(days=4, hours=hour), 7, 5.5) for hour in (4, 5)]
+    sales += [(START + timedelta(days=day, hours=6), 21, 6.2) for day in range(6)]
+
+    other = [stockout_event(5000, START + timedelta(hours=4), 7)]
+    other += refill_events(5001, START + timedelta(days=1))
+    other += [stockout_event(5003, START + timedelta(days=3, hours=3), 7),
+              stockout_event(5004, START + timedelta(days=3, hours=4), 7)]  # repeated notification
+    other += refill_events(5005, START + timedelta(days=4))
+    other += [stockout_event(5007, START + timedelta(days=5, hours=7), 21)]
+
+    return newest_first(build_events(sales) + other)
+
+
+@pytest.fixture
+def analyzer():
+    """Create an analyzer on a temporary database"""
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(db_fd)
+
+    yield SalesAnalyzer(db_path)
+
+    os.unlink(db_path)
+
+
+def motor_stock_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute('SELECT * FROM motor_stock ORDER BY motor_id').fetchall()
+    conn.close()
+    return rows
+
+
+class TestMotorStock:
+    """Stockouts and refill windows parsed at import, stock counters per motor"""
+
+    def test_stockouts_and_windows(self, analyzer, history):
+        """Email notifications become stockouts, programming sessions refill windows"""
+        analyzer.ingest_events(history)
+
+        conn = sqlite3.connect(analyzer.db_path)
+        stockouts = conn.execute('''
+            SELECT motor_id, stockout_datetime, units_since_refill FROM motor_stockouts ORDER BY stockout_datetime
+        ''').fetchall()
+        windows = conn.execute('SELECT start_datetime, end_datetime FROM refill_windows').fetchall()
+        conn.close()
+
+        assert stockouts == [
+            (7, '2025-11-03 12:00:00', None),  # no refill on record before it
+            (7, '2025-11-06 11:00:00', 4),
+            (7, '2025-11-06 12:00:00', None),  # no refill since the previous notification
+            (21, '2025-11-08 15:00:00', None),
+        ]
+        assert windows == [('2025-11-04 08:00:00', '2025-11-04 08:10:00'),
+                           ('2025-11-07 08:00:00', '2025-11-07 08:10:00')]
+
+    def test_stock_ordering(self, analyzer, history):
+        """Empty motors first, then the fewest estimated units left"""
+        analyzer.ingest_events(history)
+
+        stock = analyzer.get_motor_stock()
+
+        assert [motor['motor_id'] for motor in stock] == [21, 7]
+        assert stock[0]['is_empty'] and stock[0]['estimated_remaining'] == 0
+        assert stock[1] == {
+            'motor_id': 7,
+            'position': 'M7',
+            'product_name': 'CAMEL BLUE',
+            'last_refill': '2025-11-07 08:10:00',
+            'sold_since_refill': 2,
+            'last_stockout': '2025-11-06 12:00:00',
+            'stockout_count': 3,
+            'estimated_capacity': 4,
+            'estimated_remaining': 2,
+            'is_empty': False
+        }
+
+    def test_incremental_matches_rebuild(self, analyzer, history):
+        """Importing in two parts gives the same counters as rebuilding from all events"""
+        split = newest_first(history)
+        cutoff = datetime(2025, 11, 6, 0, 0, 0)
+        older = [e for e in split if datetime.strptime(e['dateTime'], '%d/%m/%y %H:%M:%S') < cutoff]
+        newer = [e for e in split if e not in older]
+
+        analyzer.ingest_events(older)
+        after_first_import = motor_stock_rows(analyzer.db_path)
+        analyzer.ingest_events(history)
+        incremental = motor_stock_rows(analyzer.db_path)
+
+        conn = sqlite3.connect(analyzer.db_path)
+        analyzer.update_motor_stock(conn.cursor())
+        conn.commit()
+        conn.close()
+
+        assert newer and after_first_import != incremental
+        assert motor_stock_rows(analyzer.db_path) == incremental
+
+    def test_stock_endpoint(self, analyzer, history, monkeypatch):
+        """/api/motors/stock serves the ordered stock list"""
+        import api_server
+        monkeypatch.setattr(api_server, 'analyzer', analyzer)
+        analyzer.ingest_events(history)
+
+        with api_server.app.test_client() as client:
+            response = client.get('/api/motors/stock')
+
+        assert response.status_code == 200
+        assert [motor['motor_id'] for motor in response.get_json()['motors']] == [21, 7]
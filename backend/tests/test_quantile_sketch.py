@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Tests for the t-digest quantile sketches and the daily sketches stored at import
+"""
+
+import pytest
+import random
+import sqlite3
+import os
+import sys
+from bisect import bisect_left, bisect_right
+
+# Add parent directory to path to import quantile_sketch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from motor_analytics import _linear_percentile
+from quantile_sketch import TDigest
+from tests.test_statistics_rollups import DATE_RANGES, analyzer  # noqa: F401 (fixture)
+
+
+def rank_error(sorted_values, estimate, q):
+    """Distance between q and the rank range of estimate in the exact values"""
+    low = bisect_left(sorted_values, estimate) / len(sorted_values)
+    high = bisect_right(sorted_values, estimate) / len(sorted_values)
+    return 0.0 if low <= q <= high else min(abs(q - low), abs(q - high))
+
+
+class TestTDigest:
+    """Accuracy, merging and serialization of the sketch"""
+
+    def test_small_digest_is_exact(self):
+        """Up to compression values the digest interpolates like the exact percentile"""
+        values = [3, 1, 4, 1, 5, 9, 2, 6, 5, 3, 5]
+        digest = TDigest().update(values)
+
+        for q in (0, 0.1, 0.25, 0.5, 0.9, 0.99, 1):
+            assert digest.quantile(q) == pytest.approx(_linear_percentile(sorted(values), q * 100))
+        assert TDigest().quantile(0.5) is None
+        assert TDigest().summary()['p50'] is None
+
+    def test_merged_daily_digests(self):
+        """Digests merged from serialized slices stay within 1% rank error of the exact quantiles"""
+        generator = random.Random(7)
+        values = [generator.lognormvariate(1, 1) for _ in range(20000)]
+        merged = TDigest.merge_all(TDigest().update(values[start:start + 40]).to_bytes()
+                                   for start in range(0, len(values), 40))
+        ordered = sorted(values)
+
+        assert merged.count == len(values)
+        assert merged.quantile(0) == ordered[0] and merged.quantile(1) == ordered[-1]
+        assert len(merged.centroids) <= merged.compression
+        for q in (0.01, 0.1, 0.5, 0.9, 0.99, 0.999):
+            assert rank_error(ordered, merged.quantile(q), q) < 0.01
+
+    def test_serialization_round_trip(self):
+        """from_bytes restores count, extremes and quantiles"""
+        digest = TDigest().update(range(1000))
+        restored = TDigest.from_bytes(digest.to_bytes())
+
+        assert restored.count == 1000
+        assert (restored.min, restored.max) == (0, 999)
+        assert restored.summary() == digest.summary()
+
+
+class TestStoredSketches:
+    """Daily sketches maintained at import and merged for date ranges"""
+
+    @pytest.mark.parametrize('date_from,date_to', DATE_RANGES)
+    def test_transaction_quantiles(self, analyzer, date_from, date_to):
+        """Merged daily sketches match the exact quantiles of the transactions in range"""
+        quantiles = analyzer.get_transaction_quantiles(date_from, date_to)
+
+        conn = sqlite3.connect(analyzer.db_path)
+        conditions = ['start_ts IS NOT NULL']
+        params = []
+        if date_from:
+            conditions.append("date(start_ts, 'unixepoch') >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions.append("date(start_ts, 'unixepoch') <= ?")
+            params.append(date_to)
+        rows = conn.execute(f'''
+            SELECT net_revenue, total_paid, total_change FROM transactions WHERE {' AND '.join(conditions)}
+        ''', params).fetchall()
+        conn.close()
+
+        for index, metric in enumerate(('net_revenue', 'total_paid', 'total_change')):
+            ordered = sorted(row[index] for row in rows)
+            summary = quantiles[metric]
+            assert summary['count'] == len(ordered)
+            if not ordered:
+                continue
+            assert summary['min'] == pytest.approx(ordered[0]) and summary['max'] == pytest.approx(ordered[-1])
+            for q in (0.5, 0.9, 0.99):
+                # Amounts are few distinct prices: close in value or in rank
+                estimate = summary[f'p{q * 100:g}']
+                exact = _linear_percentile(ordered, q * 100)
+                assert estimate == pytest.approx(exact, rel=0.02, abs=0.01) or rank_error(ordered, estimate, q) < 0.02
+
+    def test_interval_quantiles(self, analyzer):
+        """Per-motor interval sketches count the intervals closed in range, fleet merges them"""
+        result = analyzer.get_interval_quantiles('2025-11-10', '2025-11-20')
+
+        conn = sqlite3.connect(analyzer.db_path)
+        rows = conn.execute('''
+            SELECT motor_id, sale_datetime FROM sales ORDER BY motor_id, sale_datetime
+        ''').fetchall()
+        conn.close()
+        expected = {}
+        for (motor_id, earlier), (later_motor, later) in zip(rows, rows[1:]):
+            if motor_id == later_motor and '2025-11-10' <= later[:10] <= '2025-11-20':
+                expected.setdefault(motor_id, []).append(later)
+
+        assert {motor['motor_id']: motor['count'] for motor in result['motors']} == \
+            {motor_id: len(sales) for motor_id, sales in expected.items()}
+        assert result['fleet']['count'] == sum(len(sales) for sales in expected.values())
+        assert result['fleet']['p50'] <= result['fleet']['p90'] <= result['fleet']['p99']
+
+    def test_rebuild_matches_incremental(self, analyzer):
+        """Rebuilt sketches hold the same counts and close quantiles"""
+        before = analyzer.get_interval_quantiles()
+
+        conn = sqlite3.connect(analyzer.db_path)
+        analyzer.update_motor_interval_stats(conn.cursor())
+        analyzer.update_transaction_sketches(conn.cursor())
+        conn.commit()
+        conn.close()
+
+        after = analyzer.get_interval_quantiles()
+        assert [(m['motor_id'], m['count']) for m in before['motors']] == \
+            [(m['motor_id'], m['count']) for m in after['motors']]
+        assert after['fleet']['p50'] == pytest.approx(before['fleet']['p50'], rel=0.05)
+
+    def test_quantile_endpoints(self, analyzer, monkeypatch):
+        """/api/statistics/quantiles and /api/motors/intervals/quantiles serve the merged sketches"""
+        import api_server
+        monkeypatch.setattr(api_server, 'analyzer', analyzer)
+
+        with api_server.app.test_client() as client:
+            overview = client.get('/api/statistics/quantiles?date_from=2025-11-10&date_to=2025-11-20')
+            motor = client.get('/api/motors/intervals/quantiles?motor_id=11')
+
+        assert overview.status_code == 200 and motor.status_code == 200
+        assert overview.get_json()['transactions'] == analyzer.get_transaction_quantiles('2025-11-10', '2025-11-20')
+        assert [m['motor_id'] for m in motor.get_json()['motors']] == [11]
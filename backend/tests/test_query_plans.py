@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Query plan tests: hot read paths must use index searches, not table scans
+"""
+
+import pytest
+import re
+import sqlite3
+import tempfile
+import os
+import sys
+
+# Add parent directory to path to import data_processor
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processor import SalesAnalyzer
+from motor_analytics import MotorAnalytics
+from tests.test_bulk_ingestion import SAMPLE_EVENTS
+
+# Statements reading the large tables (motors, system_status, ... are small lookups)
+HOT_TABLES = re.compile(r'\bFROM\s+(sales|sales_events|transactions|events|sales_daily_stats|transactions_daily_stats)\b',
+                        re.IGNORECASE)
+
+
+@pytest.fixture
+def analyzer():
+    """Create an analyzer with the sample events already imported"""
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(db_fd)
+
+    analyzer = SalesAnalyzer(db_path)
+    analyzer.ingest_events(SAMPLE_EVENTS)
+
+    yield analyzer
+
+    os.unlink(db_path)
+
+
+@pytest.fixture
+def traced_queries(monkeypatch):
+    """Collect every SELECT executed on the large tables through sqlite3.connect"""
+    statements = []
+    connect = sqlite3.connect
+
+    def traced_connect(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(sqlite3, 'connect', traced_connect)
+
+    def hot_queries():
+        return [sql for sql in statements
+                if sql.lstrip().upper().startswith('SELECT') and HOT_TABLES.search(sql)]
+
+    return hot_queries
+
+
+def assert_no_scans(db_path, queries):
+    """Every statement must be planned without a full SCAN of a table"""
+    assert queries
+    conn = sqlite3.connect(db_path)
+    try:
+        for sql in queries:
+            plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+            # Window functions re-read their grouped result, which is not a table
+            scans = [detail for detail in plan
+                     if detail.startswith('SCAN') and not detail.startswith('SCAN (subquery')]
+            assert not scans, f'{scans} in plan of:\n{sql}'
+    finally:
+        conn.close()
+
+
+class TestQueryPlans:
+    """EXPLAIN QUERY PLAN checks for the statistics, dashboard and motor queries"""
+
+    def test_statistics_queries(self, analyzer, traced_queries):
+        """Date-filtered statistics use range searches on sale_datetime/start_ts"""
+        analyzer.get_statistics_overview('2025-09-17', '2025-09-18')
+        analyzer.get_statistics_by_brand('2025-09-17', '2025-09-18')
+        analyzer.get_statistics_by_package_type('2025-09-17', None)
+        analyzer.get_dashboard_data()
+
+        assert_no_scans(analyzer.db_path, traced_queries())
+
+    def test_ingest_lookups(self, analyzer, traced_queries):
+        """Lookups made on every import stay index searches"""
+        analyzer.get_last_incomplete_transaction()
+        analyzer.get_event_watermark()
+
+        assert_no_scans(analyzer.db_path, traced_queries())
+
+    def test_motor_analytics_queries(self, analyzer, traced_queries):
+        """Per-motor period metrics search (motor_id, sale_datetime)"""
+        motor_analytics = MotorAnalytics(analyzer.db_path)
+        motor_analytics.get_motor_analytics(80)
+        motor_analytics.get_motor_analytics(12)
+
+        assert_no_scans(analyzer.db_path, traced_queries())
+
+    def test_api_queries(self, analyzer, traced_queries, monkeypatch):
+        """Queries written directly in the API endpoints"""
+        import api_server
+        monkeypatch.setattr(api_server, 'analyzer', analyzer)
+
+        with api_server.app.test_client() as client:
+            assert client.get('/api/motor/80').status_code == 200
+            assert client.get('/api/statistics/daily-summary?days=30').status_code == 200
+            assert client.get('/api/statistics/transactions?date_from=2025-09-17'
+                              '&date_to=2025-09-18&payment_method=POS').status_code == 200
+
+        assert_no_scans(analyzer.db_path, traced_queries())
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Tests for the refill forecaster (time-to-empty per motor)
+"""
+
+import pytest
+import sqlite3
+import tempfile
+import os
+import sys
+from datetime import datetime, timedelta
+
+# Add parent directory to path to import refill_forecast
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processor import SalesAnalyzer
+from refill_forecast import RefillForecaster, _hours_to_empty, _weekday_factors
+from tests.test_motor_stock import START, history, refill_events  # noqa: F401 (fixture)
+
+NOW = datetime(2025, 11, 9, 12, 0, 0)
+
+
+@pytest.fixture
+def db_path(history):
+    """Temporary database with the stock history of test_motor_stock imported"""
+    db_fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(db_fd)
+    SalesAnalyzer(path).ingest_events(history)
+
+    yield path
+
+    os.unlink(path)
+
+
+class TestForecastModel:
+    """Weekday shaping and the day-by-day walk to empty"""
+
+    def test_weekday_factors(self):
+        """Factors average to one and keep a floor on days without sales"""
+        factors = _weekday_factors([0, 10, 10, 10, 10, 10, 20])
+
+        assert sum(factors) == pytest.approx(7)
+        assert factors[0] > 0
+        assert factors[6] == pytest.approx(factors[1] * 2, rel=0.1)
+        assert _weekday_factors([0] * 7) == [1.0] * 7
+
+    def test_hours_to_empty(self):
+        """Flat demand of two a day empties three units in a day and a half"""
+        midnight = datetime(2025, 11, 10)
+
+        assert _hours_to_empty(3, 2.0, [1.0] * 7, midnight) == pytest.approx(36)
+        assert _hours_to_empty(0, 2.0, [1.0] * 7, midnight) == 0.0
+        assert _hours_to_empty(3, 0.0, [1.0] * 7, midnight) is None
+        assert _hours_to_empty(1000, 1.0, [1.0] * 7, midnight) is None  # beyond the horizon
+
+    def test_hours_to_empty_follows_weekdays(self):
+        """Units are not consumed on weekdays without demand"""
+        monday = datetime(2025, 11, 10)  # weekday 1
+        weekends_only = [1.0, 0, 0, 0, 0, 0, 1.0]
+
+        # Saturday (weekday 6) is the first day with demand
+        assert _hours_to_empty(1, 1.0, weekends_only, monday) == pytest.approx(5 * 24 + 24)
+
+
+class TestRefillForecaster:
+    """Forecasts stored per motor and served from motor_refill_forecast"""
+
+    def test_forecast_rows(self, db_path):
+        """Unrefilled stockouts are empty now, the others run down at their velocity"""
+        forecaster = RefillForecaster(db_path)
+        assert forecaster.update_motors(now=NOW) == 2
+
+        forecast = forecaster.get_forecast(now=NOW)
+        motors = {motor['motor_id']: motor for motor in forecast['motors']}
+
+        assert [motor['motor_id'] for motor in forecast['motors']] == [21, 7]
+        assert motors[21]['capacity_source'] == 'stockout'
+        assert motors[21]['estimated_remaining'] == 0
+        assert motors[21]['empty_at'] == '2025-11-08T15:00:00'
+        assert motors[7]['capacity_source'] == 'motor'
+        assert motors[7]['estimated_remaining'] == 2
+        # Nine sales in the last week, all of them within four weeks
+        assert motors[7]['daily_rate'] == pytest.approx(0.5 * 9 / 7 + 0.5 * 9 / 28, abs=1e-4)
+        assert 0 < motors[7]['hours_to_empty'] < 24 * 7
+
+    def test_next_visit(self, db_path):
+        """The typical visit gap comes from refill windows and selects motors to refill"""
+        forecaster = RefillForecaster(db_path)
+        forecaster.update_motors(now=NOW)
+
+        assert forecaster.get_forecast(now=NOW)['visit_days'] == 3.0
+        assert forecaster.get_forecast(visit_days=0, now=NOW)['refill_next_visit'] == [21]
+        assert forecaster.get_forecast(visit_days=30, now=NOW)['refill_next_visit'] == [21, 7]
+
+    def test_only_touched_motors_recomputed(self, db_path):
+        """An update for one motor leaves the other forecasts as they were"""
+        forecaster = RefillForecaster(db_path)
+        forecaster.update_motors(now=NOW)
+
+        assert forecaster.update_motors([7], now=datetime(2025, 11, 10)) == 1
+
+        conn = sqlite3.connect(db_path)
+        computed = dict(conn.execute('SELECT motor_id, computed_at FROM motor_refill_forecast'))
+        conn.close()
+        assert computed == {7: '2025-11-10 00:00:00', 21: '2025-11-09 12:00:00'}
+
+    def test_import_listener(self, history):
+        """Registered as import listener, the forecaster fills the table in the background"""
+        db_fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(db_fd)
+        try:
+            analyzer = SalesAnalyzer(path)
+            forecaster = RefillForecaster(path)
+            threads = []
+            analyzer.add_import_listener(lambda motor_ids: threads.append(forecaster.update_in_background(motor_ids)))
+
+            analyzer.ingest_events(history)
+            for thread in threads:
+                thread.join(5)
+
+            assert len(threads) == 1
+            assert [motor['motor_id'] for motor in forecaster.get_forecast()['motors']] == [21, 7]
+        finally:
+            os.unlink(path)
+
+    def test_refill_only_import_notifies(self, history):
+        """An import with only a refill window still refreshes the forecasts of the refilled motors"""
+        db_fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(db_fd)
+        try:
+            analyzer = SalesAnalyzer(path)
+            forecaster = RefillForecaster(path)
+            notified = []
+            analyzer.add_import_listener(lambda motor_ids: (notified.append(motor_ids),
+                                                            forecaster.update_motors(motor_ids)))
+            analyzer.ingest_events(history)
+            before = {m['motor_id']: m for m in forecaster.get_forecast()['motors']}
+
+            stats = analyzer.ingest_events(refill_events(6000, START + timedelta(days=5, hours=9)))
+            after = {m['motor_id']: m for m in forecaster.get_forecast()['motors']}
+
+            assert stats['sales'] == 0
+            assert 21 in notified[-1]
+            assert before[21]['estimated_remaining'] == 0
+            assert after[21]['estimated_remaining'] > 0
+            assert after[21]['empty_at'] != before[21]['empty_at']
+        finally:
+            os.unlink(path)
+
+    def test_forecast_endpoint(self, db_path, monkeypatch):
+        """/api/motors/refill-forecast serves the stored forecasts"""
+        import api_server
+        forecaster = RefillForecaster(db_path)
+        forecaster.update_motors(now=NOW)
+        monkeypatch.setattr(api_server, 'refill_forecaster', forecaster)
+
+        with api_server.app.test_client() as client:
+            response = client.get('/api/motors/refill-forecast?visit_days=2')
+            invalid = client.get('/api/motors/refill-forecast?visit_days=-1')
+
+        assert response.status_code == 200
+        assert response.get_json()['visit_days'] == 2
+        assert invalid.status_code == 400
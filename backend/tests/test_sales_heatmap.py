@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Tests for the hour x weekday sales heatmaps served from motor_hourly_profile
+"""
+
+import pytest
+import sqlite3
+import tempfile
+import json
+import os
+import sys
+
+# Add parent directory to path to import data_processor
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processor import SalesAnalyzer
+from tests.test_statistics_rollups import SAMPLE_FILE
+
+
+@pytest.fixture(scope='module')
+def analyzer():
+    """Simulator sample data imported in two overlapping parts (incremental profile updates)"""
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(db_fd)
+
+    with open(SAMPLE_FILE, encoding='utf-8') as f:
+        events = json.load(f)
+    analyzer = SalesAnalyzer(db_path)
+    analyzer.ingest_events(events[3000:])
+    analyzer.ingest_events(events)
+
+    yield analyzer
+
+    os.unlink(db_path)
+
+
+def raw_heatmap(db_path, motor_id=None):
+    """(hour, weekday) -> (count, revenue) grouped directly on sales"""
+    condition = 'AND motor_id = ?' if motor_id is not None else ''
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(f'''
+        SELECT CAST(strftime('%H', sale_datetime) AS INTEGER), CAST(strftime('%w', sale_datetime) AS INTEGER),
+               COUNT(*), SUM(price)
+        FROM sales WHERE motor_id IS NOT NULL {condition}
+        GROUP BY 1, 2
+    ''', () if motor_id is None else (motor_id,)).fetchall()
+    conn.close()
+    return {(hour, weekday): (count, revenue) for hour, weekday, count, revenue in rows}
+
+
+def assert_matches(heatmap, expected):
+    assert len(heatmap['sales_count']) == 24 and all(len(row) == 7 for row in heatmap['sales_count'])
+    for hour in range(24):
+        for weekday in range(7):
+            count, revenue = expected.get((hour, weekday), (0, 0))
+            assert heatmap['sales_count'][hour][weekday] == count
+            assert heatmap['revenue'][hour][weekday] == pytest.approx(revenue, abs=0.01)
+    assert heatmap['total_sales'] == sum(count for count, _ in expected.values())
+
+
+class TestSalesHeatmap:
+    """24x7 matrices maintained at import time"""
+
+    def test_fleet_heatmap(self, analyzer):
+        """The fleet matrix equals strftime grouping over all sales"""
+        heatmap = analyzer.get_sales_heatmap()
+        expected = raw_heatmap(analyzer.db_path)
+
+        assert_matches(heatmap, expected)
+        peak = max(expected, key=lambda cell: expected[cell][0])
+        assert heatmap['peak']['sales_count'] == expected[peak][0]
+
+    def test_motor_heatmap(self, analyzer):
+        """Per-motor matrices match their own sales, unknown motors are all zeros"""
+        conn = sqlite3.connect(analyzer.db_path)
+        motor_id = conn.execute('SELECT motor_id FROM sales GROUP BY 1 ORDER BY COUNT(*) DESC').fetchone()[0]
+        conn.close()
+
+        assert_matches(analyzer.get_sales_heatmap(motor_id), raw_heatmap(analyzer.db_path, motor_id))
+        empty = analyzer.get_sales_heatmap(999)
+        assert empty['total_sales'] == 0 and empty['peak'] is None
+
+    def test_heatmap_endpoints(self, analyzer, monkeypatch):
+        """/api/motors/<id>/heatmap and /api/statistics/heatmap serve the matrices"""
+        import api_server
+        monkeypatch.setattr(api_server, 'analyzer', analyzer)
+
+        with api_server.app.test_client() as client:
+            fleet = client.get('/api/statistics/heatmap')
+            motor = client.get('/api/motors/7/heatmap')
+            missing = client.get('/api/motors/99/heatmap')
+
+        assert fleet.status_code == 200 and motor.status_code == 200
+        assert fleet.get_json()['total_sales'] == analyzer.get_sales_heatmap()['total_sales']
+        assert motor.get_json()['motor_id'] == 7
+        assert missing.status_code == 404
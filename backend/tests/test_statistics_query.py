@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Tests for the dimension/metric statistics query engine
+"""
+
+import pytest
+import sqlite3
+import os
+import sys
+
+# Add parent directory to path to import statistics_query
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from statistics_query import StatisticsQuery
+from tests.test_statistics_rollups import analyzer, raw_breakdown  # noqa: F401 (fixture)
+
+
+def plan_details(db_path, sql, params):
+    conn = sqlite3.connect(db_path)
+    details = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+    conn.close()
+    return details
+
+
+class TestStatisticsQuery:
+    """Planning against rollups and results equal to raw sales"""
+
+    @pytest.mark.parametrize('group,source', [
+        (['brand', 'day'], 'sales_daily_stats'),
+        (['month', 'payment_method'], 'sales_daily_stats'),
+        ([], 'sales_daily_stats'),
+        (['motor', 'hour_of_day'], 'sales_hourly_stats'),
+        (['hour'], 'sales_hourly_stats'),
+        (['price'], 'sales'),
+    ])
+    def test_coarsest_source(self, analyzer, group, source):
+        """The first source exposing every dimension is used, through its date index"""
+        table, sql, params = StatisticsQuery(analyzer.db_path).plan(group, ['count'], '2025-11-10', '2025-11-20')
+
+        assert table == source
+        assert not [detail for detail in plan_details(analyzer.db_path, sql, params) if detail.startswith('SCAN')]
+
+    @pytest.mark.parametrize('group,expression,join_clause', [
+        (['brand'], 'pb.brand_name', 'LEFT JOIN product_brands pb ON s.brand_id = pb.id'),
+        (['product'], 'TRIM(s.product_name)', ''),
+        (['hour_of_day'], "CAST(substr(s.sale_datetime, 12, 2) AS INTEGER)", ''),
+        (['price'], 's.price', ''),
+    ])
+    def test_matches_raw_sales(self, analyzer, group, expression, join_clause):
+        """Counts and revenue per group equal the aggregation of raw sales"""
+        result = StatisticsQuery(analyzer.db_path).run(group, ['count', 'revenue'], '2025-11-10', '2025-11-20')
+        expected = raw_breakdown(analyzer.db_path, expression, join_clause, '2025-11-10', '2025-11-20')
+
+        assert not result['truncated']
+        assert {row[group[0]] or 'UNKNOWN': row['count'] for row in result['rows']} == \
+            {key: count for key, (count, _) in expected.items()}
+        for row in result['rows']:
+            assert row['revenue'] == pytest.approx(expected[row[group[0]] or 'UNKNOWN'][1], abs=0.01)
+
+    def test_ordering_and_limit(self, analyzer):
+        """Time dimensions sort chronologically, others by the first metric; limit truncates"""
+        query = StatisticsQuery(analyzer.db_path)
+
+        days = query.run(['day'], ['revenue'], limit=5)
+        brands = query.run(['brand'], ['revenue', 'count'])
+
+        assert days['truncated'] and len(days['rows']) == 5
+        assert [row['day'] for row in days['rows']] == sorted(row['day'] for row in days['rows'])
+        assert not brands['truncated']
+        assert [row['revenue'] for row in brands['rows']] == \
+            sorted((row['revenue'] for row in brands['rows']), reverse=True)
+        assert query.run([], [])['rows'][0]['count'] == sum(row['count'] for row in brands['rows'])
+
+    @pytest.mark.parametrize('group,metrics,date_from,limit', [
+        (['colour'], ['count'], None, 10),
+        (['day'], ['median'], None, 10),
+        (['day', 'motor', 'brand', 'product'], ['count'], None, 10),
+        (['day'], ['count'], '10/11/2025', 10),
+        (['day'], ['count'], None, 0),
+        (['day'], ['count'], None, 10 ** 6),
+    ])
+    def test_invalid_requests(self, analyzer, group, metrics, date_from, limit):
+        """Unknown names, too many dimensions, bad dates and limits are rejected"""
+        with pytest.raises(ValueError):
+            StatisticsQuery(analyzer.db_path).plan(group, metrics, date_from, limit=limit)
+
+    def test_query_endpoint(self, analyzer, monkeypatch):
+        """/api/statistics/query parses the comma separated lists, 400 on invalid requests"""
+        import api_server
+        monkeypatch.setattr(api_server, 'analyzer', analyzer)
+
+        with api_server.app.test_client() as client:
+            response = client.get('/api/statistics/query?group=brand,day&metric=revenue,count'
+                                  '&from=2025-11-10&to=2025-11-12')
+            invalid = client.get('/api/statistics/query?group=colour')
+
+        result = response.get_json()
+        assert response.status_code == 200
+        assert result['source'] == 'sales_daily_stats'
+        assert result['metrics'] == ['revenue', 'count']
+        assert {row['day'] for row in result['rows']} == {'2025-11-10', '2025-11-11', '2025-11-12'}
+        assert invalid.status_code == 400
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Integration tests for the hourly/daily sales rollups behind the statistics endpoints
+"""
+
+import pytest
+import sqlite3
+import tempfile
+import json
+import os
+import sys
+
+# Add parent directory to path to import data_processor
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processor import SalesAnalyzer, date_range_to_ts
+
+SAMPLE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                           'simulator', 'sample_data.json')
+
+DATE_RANGES = [(None, None), ('2025-11-10', '2025-11-20'), ('2025-11-25', None), (None, '2025-11-05')]
+
+
+@pytest.fixture(scope='module')
+def analyzer():
+    """Simulator sample data imported in two overlapping parts (incremental rollup updates)"""
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(db_fd)
+
+    with open(SAMPLE_FILE, encoding='utf-8') as f:
+        events = json.load(f)
+    analyzer = SalesAnalyzer(db_path)
+    analyzer.ingest_events(events[3000:])
+    analyzer.ingest_events(events)
+
+    yield analyzer
+
+    os.unlink(db_path)
+
+
+def raw_breakdown(db_path, group_expression, join_clause, date_from, date_to):
+    """Per-group quantity and revenue computed directly on sales"""
+    conditions, params = [], []
+    if date_from:
+        conditions.append('s.sale_datetime >= ?')
+        params.append(date_from)
+    if date_to:
+        conditions.append("s.sale_datetime < date(?, '+1 day')")
+        params.append(date_to)
+    where_clause = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(f'''
+        SELECT {group_expression}, COUNT(*), SUM(s.price)
+        FROM sales s {join_clause} {where_clause}
+        GROUP BY 1
+    ''', params).fetchall()
+    conn.close()
+    return {group or 'UNKNOWN': (count, revenue) for group, count, revenue in rows}
+
+
+def rollup_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = [conn.execute(f'SELECT * FROM {table} ORDER BY 1, 2, 3, 4, 5').fetchall()
+            for table in ('sales_hourly_stats', 'sales_daily_stats')]
+    rows.append(conn.execute('SELECT * FROM transactions_daily_stats ORDER BY 1, 2').fetchall())
+    conn.close()
+    return rows
+
+
+class TestStatisticsRollups:
+    """Statistics answered from sales_daily_stats / transactions_daily_stats"""
+
+    @pytest.mark.parametrize('date_from,date_to', DATE_RANGES)
+    def test_breakdowns_match_raw_sales(self, analyzer, date_from, date_to):
+        """Brand and package statistics equal the aggregation of raw sales"""
+        cases = [
+            (analyzer.get_statistics_by_brand, 'brand_name', 'pb.brand_name',
+             'LEFT JOIN product_brands pb ON s.brand_id = pb.id'),
+            (analyzer.get_statistics_by_package_type, 'package_type', 'TRIM(s.product_name)', ''),
+        ]
+        for method, key, group_expression, join_clause in cases:
+            expected = raw_breakdown(analyzer.db_path, group_expression, join_clause, date_from, date_to)
+            stats = method(date_from, date_to)
+
+            assert {row[key]: row['quantity'] for row in stats} == \
+                {group: count for group, (count, _) in expected.items()}
+            for row in stats:
+                assert row['revenue'] == pytest.approx(expected[row[key]][1], abs=0.01)
+            assert sum(row['sales_percentage'] for row in stats) == pytest.approx(100, abs=0.5)
+            assert [row['revenue'] for row in stats] == sorted((row['revenue'] for row in stats), reverse=True)
+
+    @pytest.mark.parametrize('date_from,date_to', DATE_RANGES)
+    def test_overview_matches_raw_tables(self, analyzer, date_from, date_to):
+        """Totals and payment methods equal the raw sales and transactions"""
+        overview = analyzer.get_statistics_overview(date_from, date_to)
+        expected = raw_breakdown(analyzer.db_path, "'all'", '', date_from, date_to).get('all', (0, 0))
+
+        start_ts, end_ts = date_range_to_ts(date_from, date_to)
+        conn = sqlite3.connect(analyzer.db_path)
+        payments = conn.execute('''
+            SELECT COALESCE(payment_method, 'UNKNOWN'), COUNT(*), SUM(net_revenue) FROM transactions
+            WHERE start_ts >= ? AND start_ts < ? GROUP BY 1
+        ''', (start_ts or 0, end_ts or 2 ** 40)).fetchall()
+        conn.close()
+
+        assert overview['total_sales'] == expected[0]
+        assert overview['total_revenue'] == pytest.approx(expected[1] or 0, abs=0.01)
+        assert {method: stats['count'] for method, stats in overview['payment_methods'].items()} == \
+            {method: count for method, count, _ in payments}
+
+    def test_incremental_matches_rebuild(self, analyzer):
+        """Rollups maintained across imports equal a rebuild from sales and transactions"""
+        incremental = rollup_rows(analyzer.db_path)
+
+        conn = sqlite3.connect(analyzer.db_path)
+        cursor = conn.cursor()
+        analyzer.update_sales_period_stats(cursor)
+        analyzer.update_transaction_daily_stats(cursor)
+        conn.commit()
+        conn.close()
+
+        rebuilt = rollup_rows(analyzer.db_path)
+        assert [len(rows) for rows in incremental] == [len(rows) for rows in rebuilt]
+        for got, expected in zip(incremental, rebuilt):
+            for got_row, expected_row in zip(got, expected):
+                assert got_row[:-1] == expected_row[:-1]
+                assert got_row[-1] == pytest.approx(expected_row[-1])
+
+    def test_hourly_rollup_sums_to_daily(self, analyzer):
+        """Each day of sales_daily_stats is the sum of its hours"""
+        conn = sqlite3.connect(analyzer.db_path)
+        hourly = conn.execute('''
+            SELECT substr(hour, 1, 10), SUM(sales_count) FROM sales_hourly_stats GROUP BY 1
+        ''').fetchall()
+        daily = conn.execute('SELECT day, SUM(sales_count) FROM sales_daily_stats GROUP BY 1').fetchall()
+        conn.close()
+
+        assert hourly == daily
+
+    def test_daily_summary_endpoint(self, analyzer, monkeypatch):
+        """/api/statistics/daily-summary reads the daily rollup"""
+        import api_server
+        monkeypatch.setattr(api_server, 'analyzer', analyzer)
+
+        with api_server.app.test_client() as client:
+            response = client.get('/api/statistics/daily-summary?days=100000')
+
+        days = response.get_json()
+        conn = sqlite3.connect(analyzer.db_path)
+        expected = dict(conn.execute('SELECT DATE(sale_datetime), COUNT(*) FROM sales GROUP BY 1').fetchall())
+        conn.close()
+
+        assert response.status_code == 200
+        assert {day['date']: day['total_sales'] for day in days} == expected
+        assert [day['date'] for day in days] == sorted(expected, reverse=True)
+
+    @pytest.mark.parametrize('path', [
+        '/api/statistics/overview', '/api/statistics/by-brand', '/api/statistics/by-package-type',
+        '/api/statistics/quantiles', '/api/statistics/baskets', '/api/statistics/transactions',
+        '/api/motors/intervals/quantiles'
+    ])
+    def test_invalid_date_rejected(self, analyzer, monkeypatch, path):
+        """A date not in YYYY-MM-DD format is a 400 naming the parameter"""
+        import api_server
+        monkeypatch.setattr(api_server, 'analyzer', analyzer)
+
+        with api_server.app.test_client() as client:
+            bad_from = client.get(f'{path}?date_from=10/11/2025')
+            bad_to = client.get(f'{path}?date_from=2025-11-01&date_to=2025-13-01')
+
+        assert (bad_from.status_code, bad_to.status_code) == (400, 400)
+        assert 'date_from' in bad_from.get_json()['error']
+        assert 'date_to' in bad_to.get_json()['error']